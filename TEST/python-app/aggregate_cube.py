@@ -0,0 +1,375 @@
+"""
+実験用データセットのよく使われる集計 (1列のグループ化 + 件数・合計・平均・最小・最大) を
+data_db のマテリアライズドビュー (集計キューブ) として事前計算し、該当するプレビュークエリをキューブから返す。
+
+    python aggregate_cube.py build                       # CUBE_TABLES のキューブを作成 (既存は再作成)
+    python aggregate_cube.py build --table wine_review
+    python aggregate_cube.py refresh                     # データ更新後に再計算する
+    python aggregate_cube.py list
+"""
+import argparse
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from preview_engine import MbqlCompiler, UnsupportedQueryError, quote_ident
+
+# --- 集計キューブ設定 ---
+CUBE_SCHEMA = os.getenv("CUBE_SCHEMA", "cube")
+CUBE_TABLES = [t for t in os.getenv("CUBE_TABLES", "wine_review,ufo_scrubbed,social_media_ads,athlete_events").split(",") if t]
+# 異なる値の数 (pg_stats の推定値) がこれ以下の列をグループ化の次元にする
+CUBE_MAX_GROUPS = int(os.getenv("CUBE_MAX_GROUPS", 1000))
+# 日時の列は年・月・日の粒度で作る (週は日、四半期は月のキューブから集約し直す)
+CUBE_TEMPORAL_UNITS = ("year", "month", "day")
+# キューブ一覧 (catalog) を読み直す間隔。CLIで更新した場合もこの秒数以内に反映される
+CUBE_CATALOG_TTL_SEC = 60
+
+NUMERIC_DATA_TYPES = ("smallint", "integer", "bigint", "real", "double precision", "numeric")
+TEMPORAL_DATA_TYPES = ("date", "timestamp without time zone", "timestamp with time zone")
+# 要求された時間粒度 -> その粒度に集約し直せるキューブの粒度
+ROLLUP_UNITS = {
+    "year": ("year", "month", "day"), "quarter": ("month", "day"), "month": ("month", "day"),
+    "week": ("day",), "day": ("day",),
+}
+CUBE_AGGREGATIONS = {"count", "sum", "avg", "min", "max", "cum-sum", "cum-count"}
+ROUTABLE_CLAUSES = {"source-table", "aggregation", "breakout", "filter", "order-by", "limit"}
+
+
+def _cube_name(table: str, column: str, unit: Optional[str]) -> str:
+    name = f"{table}__{column}" + (f"__{unit}" if unit else "")
+    if len(name) > 63:
+        # PostgreSQL の識別子は63バイトまで
+        name = name[:54] + "_" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return name
+
+
+def _measure_columns(measure: str) -> List[str]:
+    return [f"sum__{measure}", f"nn__{measure}", f"min__{measure}", f"max__{measure}"]
+
+
+class CubeBuilder:
+    """
+    data_db の列の型と pg_stats の推定値から次元を決め、次元ごとに1つのマテリアライズドビューを作る。
+    各キューブは dim (日時は粒度で切り捨て) ごとの row_count と、数値列ごとの sum / nn (非NULL件数) / min / max を持つ。
+    作成したキューブは {CUBE_SCHEMA}.catalog に記録する。
+    """
+
+    def __init__(self, engine):
+        # engine: PreviewEngine (コネクションプールを共有する)
+        self.engine = engine
+
+    def _ensure_schema(self, conn):
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_ident(CUBE_SCHEMA)}")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_ident(CUBE_SCHEMA)}.catalog ("
+            "cube_name TEXT PRIMARY KEY, source_schema TEXT, source_table TEXT, dimension TEXT, unit TEXT, "
+            "measures TEXT[], row_count BIGINT, refreshed_at TIMESTAMPTZ)"
+        )
+
+    def plan(self, table: str, schema: str = "public") -> List[Dict[str, Any]]:
+        """table に作るキューブの一覧 ({"cube_name", "dimension", "unit", "measures"}) を返す。"""
+        with self.engine.pool.connection() as conn:
+            conn.execute(f"ANALYZE {quote_ident(schema)}.{quote_ident(table)}")
+            columns = conn.execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+                [schema, table],
+            ).fetchall()
+            primary_keys = {row[0] for row in conn.execute(
+                "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                "WHERE i.indrelid = %s::regclass AND i.indisprimary",
+                [f"{quote_ident(schema)}.{quote_ident(table)}"],
+            ).fetchall()}
+            row_count, = conn.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [f"{quote_ident(schema)}.{quote_ident(table)}"]
+            ).fetchone()
+            n_distinct = dict(conn.execute(
+                "SELECT attname, n_distinct FROM pg_stats WHERE schemaname = %s AND tablename = %s", [schema, table]
+            ).fetchall())
+        columns = [(name, data_type) for name, data_type in columns if name not in primary_keys]
+        measures = [name for name, data_type in columns if data_type in NUMERIC_DATA_TYPES]
+        cubes = []
+        for name, data_type in columns:
+            if data_type in TEMPORAL_DATA_TYPES:
+                units: List[Optional[str]] = list(CUBE_TEMPORAL_UNITS)
+            else:
+                estimate = n_distinct.get(name)
+                if estimate is None:
+                    continue
+                # n_distinct が負の場合は行数に対する比率
+                groups = estimate if estimate >= 0 else -estimate * max(row_count, 0)
+                if groups > CUBE_MAX_GROUPS:
+                    continue
+                units = [None]
+            for unit in units:
+                cubes.append({"cube_name": _cube_name(table, name, unit), "dimension": name, "unit": unit,
+                              "measures": [m for m in measures if m != name]})
+        return cubes
+
+    def build(self, table: str, schema: str = "public") -> List[Dict[str, Any]]:
+        """table のキューブを作り直して catalog に記録する。"""
+        cubes = self.plan(table, schema)
+        source = f"{quote_ident(schema)}.{quote_ident(table)}"
+        with self.engine.pool.connection() as conn:
+            self._ensure_schema(conn)
+            # 以前の計画で作ったキューブ (次元が変わった場合を含む) を先に削除する
+            for name, in conn.execute(f"SELECT cube_name FROM {quote_ident(CUBE_SCHEMA)}.catalog "
+                                      "WHERE source_schema = %s AND source_table = %s", [schema, table]).fetchall():
+                conn.execute(f"DROP MATERIALIZED VIEW IF EXISTS {quote_ident(CUBE_SCHEMA)}.{quote_ident(name)}")
+            conn.execute(f"DELETE FROM {quote_ident(CUBE_SCHEMA)}.catalog WHERE source_schema = %s AND source_table = %s",
+                         [schema, table])
+            for cube in cubes:
+                column = quote_ident(cube["dimension"])
+                dim = f"DATE_TRUNC('{cube['unit']}', {column})" if cube["unit"] else column
+                select = [f"{dim} AS dim", "COUNT(*) AS row_count"]
+                for measure in cube["measures"]:
+                    m = quote_ident(measure)
+                    sum_column, nn_column, min_column, max_column = (quote_ident(c) for c in _measure_columns(measure))
+                    select += [f"SUM({m}) AS {sum_column}", f"COUNT({m}) AS {nn_column}",
+                               f"MIN({m}) AS {min_column}", f"MAX({m}) AS {max_column}"]
+                started = time.monotonic()
+                conn.execute(f"CREATE MATERIALIZED VIEW {quote_ident(CUBE_SCHEMA)}.{quote_ident(cube['cube_name'])} AS "
+                             f"SELECT {', '.join(select)} FROM {source} GROUP BY 1")
+                self._record(conn, schema, table, cube)
+                print(f"Built {CUBE_SCHEMA}.{cube['cube_name']} in {time.monotonic() - started:.2f}s")
+        return cubes
+
+    def refresh(self, table: Optional[str] = None) -> int:
+        """catalog にあるキューブ (table 指定時はそのテーブルの分のみ) を再計算し、件数を返す。"""
+        with self.engine.pool.connection() as conn:
+            self._ensure_schema(conn)
+            sql = f"SELECT cube_name, source_schema, source_table, dimension, unit, measures FROM {quote_ident(CUBE_SCHEMA)}.catalog"
+            params: List[Any] = []
+            if table:
+                sql += " WHERE source_table = %s"
+                params.append(table)
+            rows = conn.execute(sql, params).fetchall()
+            for name, schema, source_table, dimension, unit, measures in rows:
+                conn.execute(f"REFRESH MATERIALIZED VIEW {quote_ident(CUBE_SCHEMA)}.{quote_ident(name)}")
+                self._record(conn, schema, source_table, {"cube_name": name, "dimension": dimension, "unit": unit, "measures": measures})
+        return len(rows)
+
+    def _record(self, conn, schema: str, table: str, cube: Dict[str, Any]):
+        conn.execute(
+            f"INSERT INTO {quote_ident(CUBE_SCHEMA)}.catalog VALUES (%s, %s, %s, %s, %s, %s, "
+            f"(SELECT COUNT(*) FROM {quote_ident(CUBE_SCHEMA)}.{quote_ident(cube['cube_name'])}), NOW()) "
+            "ON CONFLICT (cube_name) DO UPDATE SET row_count = EXCLUDED.row_count, refreshed_at = EXCLUDED.refreshed_at",
+            [cube["cube_name"], schema, table, cube["dimension"], cube["unit"], cube["measures"]],
+        )
+
+
+class CubeRouter:
+    """
+    プレビューのMBQLが集計キューブで答えられる場合に、キューブに対するSQLを返す。
+    対象は結合・式のない、グループ化が0または1列、集約が count / sum / avg / min / max / cum-sum / cum-count のクエリで、
+    フィルターはグループ化する列 (日時以外) に対するもののみ。結果の cols は MbqlCompiler と同じになる。
+    """
+
+    def __init__(self, engine, ttl_sec: float = CUBE_CATALOG_TTL_SEC):
+        self.engine = engine
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._catalog: Optional[List[Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        self.routed = 0
+        self.missed = 0
+
+    def catalog(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self._catalog is not None and time.monotonic() - self._loaded_at < self.ttl_sec:
+                return self._catalog
+        try:
+            rows = self.engine.fetch_all(
+                f"SELECT cube_name, source_schema, source_table, dimension, unit, measures, row_count, refreshed_at "
+                f"FROM {quote_ident(CUBE_SCHEMA)}.catalog"
+            )
+        except Exception as e:
+            # キューブ未作成 (catalog がない) の場合は常にベーステーブルを使う
+            print(f"Aggregate cube catalog is unavailable: {e}")
+            rows = []
+        catalog = [dict(zip(("cube_name", "source_schema", "source_table", "dimension", "unit", "measures", "row_count", "refreshed_at"), row))
+                   for row in rows]
+        with self._lock:
+            self._catalog, self._loaded_at = catalog, time.monotonic()
+        return catalog
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog = None
+
+    def _candidates(self, table: Dict[str, Any]) -> List[Dict[str, Any]]:
+        schema = table.get("schema") or "public"
+        return [c for c in self.catalog() if c["source_table"] == table["name"] and c["source_schema"] == schema]
+
+    def route(self, query: Dict[str, Any], table: Dict[str, Any], fields: List[Dict[str, Any]],
+              limit: Optional[int]) -> Optional[Tuple[str, List[Any], List[Dict[str, Any]]]]:
+        """キューブで答えられる場合は (SQL, パラメータ, cols)、答えられない場合は None を返す。"""
+        compiled = self._route(query, table, fields, limit)
+        with self._lock:
+            if compiled is None:
+                self.missed += 1
+            else:
+                self.routed += 1
+        return compiled
+
+    def _route(self, query: Dict[str, Any], table: Dict[str, Any], fields: List[Dict[str, Any]],
+               limit: Optional[int]) -> Optional[Tuple[str, List[Any], List[Dict[str, Any]]]]:
+        breakouts = query.get("breakout", [])
+        if not query.get("aggregation") or len(breakouts) > 1 or set(query) - ROUTABLE_CLAUSES:
+            return None
+        if any(a[0] not in CUBE_AGGREGATIONS for a in query["aggregation"]):
+            return None
+        cubes = self._candidates(table)
+        if not cubes:
+            return None
+        try:
+            # cols と集約・フィルターの妥当性はベーステーブル用のコンパイラで確認する
+            _, _, cols = MbqlCompiler(table, fields).compile(query, limit=limit)
+        except UnsupportedQueryError:
+            return None
+        fields_by_id = {f["id"]: f for f in fields}
+
+        dimension, unit = None, None
+        if breakouts:
+            ref = breakouts[0]
+            options = ref[2] if len(ref) > 2 and ref[2] else {}
+            dimension, unit = fields_by_id[ref[1]]["name"], options.get("temporal-unit")
+        filter_ids = _filter_field_ids(query.get("filter"))
+        if filter_ids:
+            filter_names = {fields_by_id[i]["name"] for i in filter_ids}
+            if len(filter_names) > 1 or (dimension is not None and filter_names != {dimension}):
+                return None
+            dimension = dimension or filter_names.pop()
+
+        measures = [fields_by_id[a[1][1]]["name"] for a in query["aggregation"] if len(a) > 1]
+        eligible = []
+        for cube in cubes:
+            if dimension is not None and cube["dimension"] != dimension:
+                continue
+            if not set(measures) <= set(cube["measures"]):
+                continue
+            if unit is not None and cube["unit"] not in ROLLUP_UNITS.get(unit, ()):
+                continue
+            if cube["unit"] is not None and (filter_ids or (breakouts and unit is None)):
+                # 切り捨て前の日時の値でグループ化・絞り込みはできない
+                continue
+            eligible.append(cube)
+        if not eligible:
+            return None
+        # 行数の少ない (粒度の粗い) キューブほど速い
+        cube = min(eligible, key=lambda c: c["row_count"] or 0)
+        try:
+            return self._compile(query, cube, fields_by_id, cols, limit)
+        except UnsupportedQueryError:
+            # 次元以外の列での並び替えなど
+            return None
+
+    def _compile(self, query: Dict[str, Any], cube: Dict[str, Any], fields_by_id: Dict[int, Dict[str, Any]],
+                 cols: List[Dict[str, Any]], limit: Optional[int]) -> Tuple[str, List[Any], List[Dict[str, Any]]]:
+        # 次元の列を "dim" に置き換えたフィールドでコンパイラを作り、グループ化・フィルターの式を流用する
+        # (次元以外の列を参照すると UnsupportedQueryError になる)
+        dim_fields = [{**f, "name": "dim"} for f in fields_by_id.values() if f["name"] == cube["dimension"]]
+        compiler = MbqlCompiler({"name": cube["cube_name"], "schema": CUBE_SCHEMA}, dim_fields)
+        select, group_by = [], []
+        for ref in query.get("breakout", []):
+            expr, _, _ = compiler._field(ref)
+            select.append(expr)
+            group_by.append(expr)
+        window = "ORDER BY " + ", ".join(group_by) if group_by else ""
+        for aggregation in query["aggregation"]:
+            op = aggregation[0]
+            if op in ("count", "cum-count"):
+                expr = "SUM(row_count)"
+                integer = True
+            else:
+                field = fields_by_id[aggregation[1][1]]
+                sum_column, nn_column, min_column, max_column = (quote_ident(c) for c in _measure_columns(field["name"]))
+                integer = "integer" in (field.get("base_type") or "").lower()
+                if op in ("sum", "cum-sum"):
+                    expr = f"SUM({sum_column})"
+                elif op == "avg":
+                    expr = f"SUM({sum_column}) / NULLIF(SUM({nn_column}), 0)"
+                    integer = False
+                elif op == "min":
+                    expr = f"MIN({min_column})"
+                elif op == "max":
+                    expr = f"MAX({max_column})"
+                else:
+                    raise UnsupportedQueryError(f"Aggregation is not available in cubes: {op}")
+            if op in ("cum-sum", "cum-count"):
+                expr = f"SUM({expr}) OVER ({window})"
+            # bigint の SUM は numeric になるため、ベーステーブルの COUNT(*) / SUM と同じ型に戻す
+            select.append(f"({expr})::bigint" if integer and op not in ("min", "max") else expr)
+
+        sql = f"SELECT {', '.join(select)} FROM {quote_ident(CUBE_SCHEMA)}.{quote_ident(cube['cube_name'])}"
+        if query.get("filter"):
+            sql += f" WHERE {compiler._filter(query['filter'])}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        order_by = []
+        for direction, ref in query.get("order-by", []):
+            if isinstance(ref, list) and ref[0] == "aggregation":
+                target = str(len(group_by) + ref[1] + 1)
+            else:
+                target = compiler._field(ref)[0]
+            order_by.append(f"{target} {'DESC' if direction == 'desc' else 'ASC'}")
+        if not order_by and group_by:
+            order_by = ["1 ASC"]
+        if order_by:
+            sql += f" ORDER BY {', '.join(order_by)}"
+        if limit is not None:
+            sql += f" LIMIT {int(min(query.get('limit', limit), limit))}"
+        elif "limit" in query:
+            sql += f" LIMIT {int(query['limit'])}"
+        return sql, list(compiler.params), cols
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cubes = len(self._catalog) if self._catalog is not None else None
+            return {"cubes": cubes, "routed": self.routed, "missed": self.missed}
+
+
+def _filter_field_ids(clause: Optional[List[Any]]) -> set:
+    """フィルター句で参照している列IDの集合。"""
+    if not clause:
+        return set()
+    if clause[0] in ("and", "or", "not"):
+        return set().union(*(_filter_field_ids(c) for c in clause[1:]))
+    ref = clause[1]
+    return {ref[1]} if isinstance(ref, list) and len(ref) >= 2 and isinstance(ref[1], int) else set()
+
+
+def main():
+    from preview_engine import PreviewEngine
+
+    parser = argparse.ArgumentParser(description="data_db の集計キューブを作成・更新する")
+    parser.add_argument("command", choices=["build", "refresh", "list"])
+    parser.add_argument("--table", action="append", help="対象テーブル (複数指定可。省略時は CUBE_TABLES)")
+    parser.add_argument("--schema", default="public")
+    args = parser.parse_args()
+
+    engine = PreviewEngine({
+        "host": os.getenv("DATA_DB_HOST", "data_db"), "port": int(os.getenv("DATA_DB_PORT", 5432)),
+        "dbname": os.getenv("DATA_DB_NAME", "data_db"), "user": os.getenv("DATA_DB_USER", "data_user"),
+        "password": os.getenv("DATA_DB_PASS", "data_password"),
+    })
+    try:
+        builder = CubeBuilder(engine)
+        if args.command == "build":
+            for table in args.table or CUBE_TABLES:
+                cubes = builder.build(table, args.schema)
+                print(f"{table}: {len(cubes)} cubes")
+        elif args.command == "refresh":
+            for table in args.table or [None]:
+                print(f"Refreshed {builder.refresh(table)} cubes")
+        else:
+            for cube in CubeRouter(engine).catalog():
+                print(f"{cube['cube_name']:<60} {cube['row_count'] or 0:>10,} rows  {cube['refreshed_at']}")
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+分析スクリプトが共有する入力 (操作ログ・セッション・実験のグループ分け・アンケートの回答) の読み込み。
+
+各入力は入力ファイルの指紋 (パス・サイズ・更新時刻) と依存する入力の指紋から求めた指紋を持ち、
+指紋が変わるまではプロセス内で1度作ったものを再利用する。セッションの DataFrame は
+logs/.cache/analysis/inputs/ にも保存し、別のプロセスからは読み込むだけにする。
+run_analyses.py は実行するタスクが使う入力を先に作ってからワーカーのプロセスを fork するため、
+タスクは作成済みの入力をそのまま使える。
+
+    from analysis_inputs import NAME_MAP, load_group_mapping, load_shared_logs, load_survey
+"""
+import copy
+import csv
+import glob
+import hashlib
+import os
+import pickle
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from log_loader import LOG_CACHE_DIR, discover_log_files, load_logs
+from session_metrics import logs_to_frame, sessionize
+
+# 実験のグループ分け (参加者ごとの1回目・2回目のダッシュボード・タスク・推薦の有無) とアンケートの回答 (Google フォームの CSV)
+GROUP_FILE = os.getenv("GROUP_FILE", "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - グループ.csv")
+SURVEY_FILE = os.getenv("SURVEY_FILE", "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - フォームの回答.csv")
+# タスクで使ったデータセットの元の CSV
+DATA_DIR = os.getenv("DATA_DIR", "/Users/jin/metabase/TEST/data_init")
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.join(LOG_CACHE_DIR, "analysis"))
+INPUT_CACHE_VERSION = 1
+
+# アンケートの氏名 -> グループ分けの CSV のニックネーム
+NAME_MAP = {
+    "芹澤尚舜": "せり",
+    "峪紳大朗": "さこ",
+    "佐竹宏紀": "ひろくん",
+    "今村真沙斗": "まさと",
+    "宮澤匠": "たくみ",
+    "鈴木俊詞": "しゅんじ",
+    "永沼翔翼": "つばさ",
+    "田中 翔太郎": "たなか",
+    "岡本悠吾": "ゆうご",
+    "矢野温加": "やん",
+    "塙裕貴": "はなわ",
+    "板井孝樹": "いたい"
+}
+
+
+def file_fingerprint(paths: Iterable[str]) -> str:
+    """ファイルのパス・サイズ・更新時刻から求めた指紋 (ないファイルも指紋に含める)。"""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        except OSError:
+            digest.update(f"{os.path.abspath(path)}\0missing\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+# --- 入力ファイルの読み込み ---
+def read_group_rows(path: str = GROUP_FILE) -> List[Dict[str, Any]]:
+    """
+    グループ分けの CSV を、参加者・回 (1, 2) ごとの行にする。
+        {"user": ニックネーム, "order": 1 or 2, "dashboard_id": "23", "task": "UFO", "rec": True}
+    ダッシュボードIDが空の回も含める。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = list(csv.reader(f))
+    # 3行目 (",id,task,rec,id,task,rec,memo,") が見出しで、その次の行からが参加者
+    header_idx = next((i for i, row in enumerate(lines) if len(row) > 1 and row[1] == 'id'), -1)
+    if header_idx == -1:
+        print("Error: Could not find header row in group file")
+        return []
+    rows = []
+    for row in lines[header_idx + 1:]:
+        if len(row) < 7 or not row[0]:
+            continue
+        for order, offset in ((1, 1), (2, 4)):
+            rows.append({"user": row[0], "order": order, "dashboard_id": str(row[offset]), "task": row[offset + 1],
+                         "rec": row[offset + 2] == "あり"})
+    return rows
+
+
+def read_survey(path: str = SURVEY_FILE) -> Tuple[List[str], List[List[str]]]:
+    """アンケートの CSV を (見出し, 回答の行) にする。テストの回答などの除外は各スクリプトで行う。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, list(reader)
+
+
+# --- 共有する入力 ---
+class SharedInput:
+    """
+    指紋で再利用する入力。files() の指紋と deps の入力の指紋が同じ間は build() を呼び直さない。
+    persist なら ANALYSIS_CACHE_DIR に pickle で保存し、他のプロセスからも使う。
+    利用側が変更しても共有のものが変わらないよう、copy で写しを返す。
+    """
+
+    def __init__(self, name: str, build: Callable[..., Any], files: Callable[[], Sequence[str]] = lambda: (),
+                 deps: Sequence[str] = (), persist: bool = False, copy: Callable[[Any], Any] = copy.deepcopy):
+        self.name = name
+        self.build = build
+        self.files = files
+        self.deps = tuple(deps)
+        self.persist = persist
+        self.copy = copy
+
+
+INPUTS: Dict[str, SharedInput] = {}
+_built: Dict[str, Tuple[str, Any]] = {}
+
+
+def register(shared: SharedInput) -> SharedInput:
+    INPUTS[shared.name] = shared
+    return shared
+
+
+def fingerprint(name: str) -> str:
+    shared = INPUTS[name]
+    digest = hashlib.sha1(f"{INPUT_CACHE_VERSION}\0{name}\0{file_fingerprint(shared.files())}".encode("utf-8"))
+    for dep in shared.deps:
+        digest.update(f"\0{dep}={fingerprint(dep)}".encode("utf-8"))
+    if shared.persist:
+        # 保存したものは、作り方 (このモジュール・session_metrics) が変わったら使わない
+        digest.update(file_fingerprint([__file__, sessionize.__code__.co_filename]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_path(name: str, key: str) -> str:
+    return os.path.join(ANALYSIS_CACHE_DIR, "inputs", f"{name}-{key}.pkl")
+
+
+def _load_persisted(name: str, key: str) -> Optional[Any]:
+    try:
+        with open(_cache_path(name, key), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+
+def _save_persisted(name: str, key: str, value: Any):
+    path = _cache_path(name, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    # 古い指紋のものは使われないので消す
+    for old in glob.glob(os.path.join(os.path.dirname(path), f"{name}-*.pkl")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def prepare(name: str) -> str:
+    """入力を (なければ) 作り、指紋を返す。依存する入力から順に作る。"""
+    key = fingerprint(name)
+    if name in _built and _built[name][0] == key:
+        return key
+    shared = INPUTS[name]
+    value = _load_persisted(name, key) if shared.persist else None
+    if value is None:
+        for dep in shared.deps:
+            prepare(dep)
+        value = shared.build(*[_built[dep][1] for dep in shared.deps])
+        if shared.persist:
+            _save_persisted(name, key, value)
+    _built[name] = (key, value)
+    return key
+
+
+def get(name: str) -> Any:
+    prepare(name)
+    return INPUTS[name].copy(_built[name][1])
+
+
+def _build_user_sessions(logs: List[Dict[str, Any]]) -> pd.DataFrame:
+    return sessionize(logs_to_frame(logs), by=("user_id",), split="login")
+
+
+def _build_dashboard_sessions(logs: List[Dict[str, Any]]) -> pd.DataFrame:
+    return sessionize(logs_to_frame(logs), by=("dashboard_id",), split="none")
+
+
+def _group_mapping(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {row["dashboard_id"]: {"user": row["user"], "task": row["task"], "rec": row["rec"], "order": row["order"]}
+            for row in rows if row["dashboard_id"]}
+
+
+def _frame_copy(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.copy(deep=False)
+
+
+# 操作ログのエントリは変更しない前提で、リストだけを写す
+register(SharedInput("logs", lambda: load_logs(), files=discover_log_files, copy=list))
+register(SharedInput("user_sessions", _build_user_sessions, deps=["logs"], persist=True, copy=_frame_copy))
+register(SharedInput("dashboard_sessions", _build_dashboard_sessions, deps=["logs"], persist=True, copy=_frame_copy))
+register(SharedInput("group_rows", lambda: read_group_rows(GROUP_FILE), files=lambda: [GROUP_FILE]))
+register(SharedInput("group_mapping", _group_mapping, deps=["group_rows"]))
+register(SharedInput("survey", lambda: read_survey(SURVEY_FILE), files=lambda: [SURVEY_FILE]))
+
+
+def load_shared_logs() -> List[Dict[str, Any]]:
+    """すべての操作ログ (log_loader.load_logs() と同じ)。"""
+    return get("logs")
+
+
+def load_user_sessions() -> pd.DataFrame:
+    """ユーザーごとに login で分けたセッション (analyze_logs の分け方。session_metrics.sessionize を参照)。"""
+    return get("user_sessions")
+
+
+def load_dashboard_sessions() -> pd.DataFrame:
+    """ダッシュボードごとに1つのセッション。"""
+    return get("dashboard_sessions")
+
+
+def load_group_rows() -> List[Dict[str, Any]]:
+    return get("group_rows")
+
+
+def load_group_mapping() -> Dict[str, Dict[str, Any]]:
+    """ダッシュボードID -> {"user": ニックネーム, "task": タスク, "rec": 推薦ありか, "order": 1 or 2}"""
+    return get("group_mapping")
+
+
+def load_survey() -> Tuple[List[str], List[List[str]]]:
+    """アンケートの (見出し, 回答の行)。"""
+    return get("survey")
@@ -1,27 +1,11 @@
-import json
 from datetime import datetime
 import pandas as pd
-import os
 import collections
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "logs/app_log.jsonl"
-
-def load_logs(log_file):
-    logs = []
-    if not os.path.exists(log_file):
-        print(f"Log file not found: {log_file}")
-        return logs
-        
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
 
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     if not logs:
         return
 
@@ -1,25 +1,14 @@
-import json
 from datetime import datetime
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 
 TARGETS = {
     "7": {"Condition": "Rec Available", "TaskOrder": 1, "ExpectedDataset": "UFO"},
     "8": {"Condition": "No Rec", "TaskOrder": 2, "ExpectedDataset": "Wine"}
 }
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     dashboard_sessions = {}
     
@@ -1,21 +1,10 @@
-import json
 from datetime import datetime
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 TARGET_DASHBOARD_ID = "5"
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     events = []
     for log in logs:
@@ -1,12 +1,14 @@
 import pandas as pd
+import os
 import warnings
+from analysis_inputs import DATA_DIR
 
 warnings.filterwarnings('ignore')
 
 def analyze_ufo():
     print("--- UFO Analysis ---")
     try:
-        df = pd.read_csv('/Users/jin/metabase/TEST/data_init/UFOscrubbed.csv', low_memory=False)
+        df = pd.read_csv(os.path.join(DATA_DIR, 'UFOscrubbed.csv'), low_memory=False)
     except Exception as e:
         print(f"Error loading UFO data: {e}")
         return
@@ -69,7 +71,7 @@ def analyze_ufo():
 def analyze_wine():
     print("\n--- Wine Analysis ---")
     try:
-        df = pd.read_csv('/Users/jin/metabase/TEST/data_init/wineReview.csv')
+        df = pd.read_csv(os.path.join(DATA_DIR, 'wineReview.csv'))
     except Exception as e:
         print(f"Error loading Wine data: {e}")
         return
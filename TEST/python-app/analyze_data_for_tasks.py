@@ -1,7 +1,6 @@
 import pandas as pd
 import os
-
-DATA_DIR = '/Users/jin/metabase/TEST/data_init'
+from analysis_inputs import DATA_DIR
 
 def analyze_olympics():
     print("\n=== Olympics Analysis ===")
@@ -1,69 +1,10 @@
-import json
-import csv
 import statistics
-from datetime import datetime
-
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
-GROUP_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - グループ.csv"
-SURVEY_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - フォームの回答.csv"
-
-def load_group_mapping():
-    mapping = {} # dashboard_id -> {user, task, rec_condition}
-    
-    with open(GROUP_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        # Skip header lines (rows 1 and 2) based on file view
-        # Row 1: ,,,,,,,, (empty)
-        # Row 2: ,1回目,,,2回目,,,,
-        # Row 3: ,id,task,rec,id,task,rec,memo,
-        # Actual data starts from row 4
-        
-        lines = list(reader)
-        # Find the header row index
-        header_idx = -1
-        for i, row in enumerate(lines):
-            if len(row) > 1 and row[1] == 'id':
-                header_idx = i
-                break
-        
-        if header_idx == -1:
-            print("Error: Could not find header row in group file")
-            return {}
-
-        for row in lines[header_idx+1:]:
-            if len(row) < 7: continue
-            user_name = row[0]
-            if not user_name: continue
-
-            # Task 1
-            dash1 = row[1]
-            task1 = row[2]
-            rec1 = row[3]
-            if dash1:
-                mapping[str(dash1)] = {"user": user_name, "task": task1, "rec": rec1 == "あり", "order": 1}
-            
-            # Task 2
-            dash2 = row[4]
-            task2 = row[5]
-            rec2 = row[6]
-            if dash2:
-                mapping[str(dash2)] = {"user": user_name, "task": task2, "rec": rec2 == "あり", "order": 2}
-
-    return mapping
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
+from analysis_inputs import NAME_MAP, load_dashboard_sessions, load_group_mapping, load_shared_logs, load_survey
+from session_metrics import session_metrics
 
 def analyze():
     group_mapping = load_group_mapping() # dash_id -> {task, rec, user, order}
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     # 1. Map Email -> Dashboard IDs from Logs
     email_to_dashboards = {}
@@ -75,49 +16,26 @@ def analyze():
                 email_to_dashboards[uid] = set()
             email_to_dashboards[uid].add(did)
 
-    # Group logs by dashboard_id for Quantitative Analysis
-    dashboard_sessions = {}
-    for log in logs:
-        dash_id = str(log.get('dashboard_id'))
-        if dash_id in group_mapping:
-            if dash_id not in dashboard_sessions:
-                dashboard_sessions[dash_id] = []
-            dashboard_sessions[dash_id].append(log)
-            
-    # Calculate metrics per dashboard
+    # Calculate metrics per dashboard (one session per dashboard, see session_metrics.py)
+    sessions = load_dashboard_sessions()
+    sessions = sessions[sessions['session_id'].isin(list(group_mapping))]
+    dashboard_metrics = session_metrics(sessions).set_index('session_id')
     results = []
     
     for dash_id, meta in group_mapping.items():
-        events = dashboard_sessions.get(dash_id, [])
-        if not events:
+        if dash_id not in dashboard_metrics.index:
             # print(f"Warning: No logs for Dashboard {dash_id} ({meta['user']})")
             continue
-            
-        events.sort(key=lambda x: x['timestamp'])
-        
-        start_time = datetime.fromisoformat(events[0]['timestamp'])
-        end_time = datetime.fromisoformat(events[-1]['timestamp'])
-        duration_min = (end_time - start_time).total_seconds() / 60
-        
-        views_created = 0
-        rec_used = 0
-        
-        for e in events:
-            if e.get('action') == 'create_view':
-                views_created += 1
-                if e.get('recommendation_source') == 'recommendation':
-                    rec_used += 1
-        
-        rec_rate = (rec_used / views_created * 100) if views_created > 0 else 0
+        m = dashboard_metrics.loc[dash_id]
         
         results.append({
             "user": meta['user'],
             "task": meta['task'],
             "rec": meta['rec'],
-            "duration": duration_min,
-            "views": views_created,
-            "rec_used": rec_used,
-            "rec_rate": rec_rate
+            "duration": m['duration_sec'] / 60,
+            "views": int(m['views_created']),
+            "rec_used": int(m['rec_views_created']),
+            "rec_rate": m['rec_rate']
         })
         
     # Aggregate Quantitative Results
@@ -160,22 +78,6 @@ def analyze():
         "rec_surprise": [] 
     }
 
-    # Manual Name Mapping (Survey Full Name -> Group CSV Nickmake)
-    NAME_MAP = {
-        "芹澤尚舜": "せり",
-        "峪紳大朗": "さこ",
-        "佐竹宏紀": "ひろくん",
-        "今村真沙斗": "まさと",
-        "宮澤匠": "たくみ",
-        "鈴木俊詞": "しゅんじ",
-        "永沼翔翼": "つばさ",
-        "田中 翔太郎": "たなか",
-        "岡本悠吾": "ゆうご",
-        "矢野温加": "やん",
-        "塙裕貴": "はなわ",
-        "板井孝樹": "いたい"
-    }
-
     # Build (nickname, task) -> is_rec map from group_mapping
     # group_mapping values are meta dicts: {'user': nickname, 'task': 'UFO', 'rec': bool, ...}
     nickname_task_condition = {}
@@ -187,65 +89,63 @@ def analyze():
         match = re.search(r'\((\d)\)', val)
         return int(match.group(1)) if match else None
 
-    with open(SURVEY_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        for row in reader:
-            if "テスト" in row[1] or "test" in row[1].lower(): continue
-            name = row[1]
-            if "石埜" in name: continue 
-            
-            nickname = NAME_MAP.get(name)
-            if not nickname:
-                # print(f"Warning: No mapping for {name}")
-                continue
-
-            # --- SUS ---
-            scores = []
-            valid = True
-            for i in range(10):
-                match = re.search(r'\((\d)\)', row[3+i])
-                if match:
-                    val = int(match.group(1))
-                    q_scores[i].append(val)
-                    if (i+1)%2==1: scores.append(val-1)
-                    else: scores.append(5-val)
-                else: valid = False
-            
-            if valid:
-                sus_total_scores.append(sum(scores)*2.5)
-
-            # --- Task 1 ---
-            task1 = row[13] # UFO or Wine
-            if task1:
-                is_rec = nickname_task_condition.get((nickname, task1))
-                if is_rec is not None:
-                    r_cond = "Rec" if is_rec else "No Rec"
-                    v = parse_likert(row[14])
-                    if v: metrics["readable"][r_cond].append(v)
-                    v = parse_likert(row[15])
-                    if v: metrics["requirements"][r_cond].append(v)
-                    if is_rec:
-                        v = parse_likert(row[16])
-                        if v: metrics["rec_useful"].append(v)
-                        v = parse_likert(row[17])
-                        if v: metrics["rec_surprise"].append(v)
+    header, rows = load_survey()
+    for row in rows:
+        if "テスト" in row[1] or "test" in row[1].lower(): continue
+        name = row[1]
+        if "石埜" in name: continue 
+        
+        nickname = NAME_MAP.get(name)
+        if not nickname:
+            # print(f"Warning: No mapping for {name}")
+            continue
 
-            # --- Task 2 ---
-            if len(row) > 20 and row[20]:
-                task2 = row[20]
-                is_rec = nickname_task_condition.get((nickname, task2))
-                if is_rec is not None:
-                    r_cond = "Rec" if is_rec else "No Rec"
-                    v = parse_likert(row[21])
-                    if v: metrics["readable"][r_cond].append(v)
-                    v = parse_likert(row[22])
-                    if v: metrics["requirements"][r_cond].append(v)
-                    if is_rec:
-                        v = parse_likert(row[23])
-                        if v: metrics["rec_useful"].append(v)
-                        v = parse_likert(row[24])
-                        if v: metrics["rec_surprise"].append(v)
+        # --- SUS ---
+        scores = []
+        valid = True
+        for i in range(10):
+            match = re.search(r'\((\d)\)', row[3+i])
+            if match:
+                val = int(match.group(1))
+                q_scores[i].append(val)
+                if (i+1)%2==1: scores.append(val-1)
+                else: scores.append(5-val)
+            else: valid = False
+        
+        if valid:
+            sus_total_scores.append(sum(scores)*2.5)
+
+        # --- Task 1 ---
+        task1 = row[13] # UFO or Wine
+        if task1:
+            is_rec = nickname_task_condition.get((nickname, task1))
+            if is_rec is not None:
+                r_cond = "Rec" if is_rec else "No Rec"
+                v = parse_likert(row[14])
+                if v: metrics["readable"][r_cond].append(v)
+                v = parse_likert(row[15])
+                if v: metrics["requirements"][r_cond].append(v)
+                if is_rec:
+                    v = parse_likert(row[16])
+                    if v: metrics["rec_useful"].append(v)
+                    v = parse_likert(row[17])
+                    if v: metrics["rec_surprise"].append(v)
+
+        # --- Task 2 ---
+        if len(row) > 20 and row[20]:
+            task2 = row[20]
+            is_rec = nickname_task_condition.get((nickname, task2))
+            if is_rec is not None:
+                r_cond = "Rec" if is_rec else "No Rec"
+                v = parse_likert(row[21])
+                if v: metrics["readable"][r_cond].append(v)
+                v = parse_likert(row[22])
+                if v: metrics["requirements"][r_cond].append(v)
+                if is_rec:
+                    v = parse_likert(row[23])
+                    if v: metrics["rec_useful"].append(v)
+                    v = parse_likert(row[24])
+                    if v: metrics["rec_surprise"].append(v)
 
     if sus_total_scores:
         print(f"Average Total SUS: {statistics.mean(sus_total_scores):.1f} (SD: {statistics.stdev(sus_total_scores):.1f})")
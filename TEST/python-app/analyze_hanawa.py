@@ -1,7 +1,6 @@
 
-import json
+from log_loader import load_logs
 
-LOG_FILE = '/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl'
 # 23: Wine (Rec) - Hanawa
 # 24: UFO (No Rec) - Hanawa
 TARGETS = [
@@ -28,15 +27,10 @@ TYPE_MAP = {
 def analyze():
     events_by_db = {t['id']: [] for t in TARGETS}
     
-    with open(LOG_FILE, 'r') as f:
-        for line in f:
-            try:
-                e = json.loads(line)
-            except:
-                continue
-            db_id = e.get('dashboard_id')
-            if db_id in events_by_db:
-                events_by_db[db_id].append(e)
+    for e in load_logs(dashboard_ids=[t['id'] for t in TARGETS]):
+        db_id = e.get('dashboard_id')
+        if db_id in events_by_db:
+            events_by_db[db_id].append(e)
 
     for target in TARGETS:
         db_id = target['id']
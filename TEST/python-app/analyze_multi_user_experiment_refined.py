@@ -1,35 +1,19 @@
-import json
-from datetime import datetime
 import pandas as pd
+from analysis_inputs import load_dashboard_sessions
+from session_metrics import distinct_values, session_metrics
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 
 USER_MAPPING = {
     "A": ["3", "4"],
     "B": ["5", "6"]
 }
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
-    
-    # Group by Dashboard ID
-    dashboard_sessions = {}
-    
-    for log in logs:
-        dash_id = str(log.get('dashboard_id'))
-        if dash_id not in dashboard_sessions:
-            dashboard_sessions[dash_id] = []
-        dashboard_sessions[dash_id].append(log)
+    # Metrics per Dashboard ID (one session per dashboard, see session_metrics.py)
+    sessions = load_dashboard_sessions()
+    dashboard_metrics = session_metrics(sessions, rec_enabled_default="Unknown")
+    dashboard_rows = {dash_id: i for i, dash_id in enumerate(dashboard_metrics['session_id'])}
+    table_names = distinct_values(sessions, 'table_name')
         
     print("Experiment Analysis Report (Refined)")
     print("=" * 60)
@@ -38,45 +22,20 @@ def analyze():
         print(f"--- User {user} ---")
         
         for i, dash_id in enumerate(dash_ids):
-            events = dashboard_sessions.get(dash_id, [])
-            if not events:
+            row = dashboard_rows.get(dash_id)
+            if row is None:
                 print(f"Dashboard {dash_id}: No logs found.")
                 continue
+            m = dashboard_metrics.iloc[row]
             
-            # Sort by timestamp
-            events.sort(key=lambda x: x['timestamp'])
-            
-            start_time = datetime.fromisoformat(events[0]['timestamp'])
-            end_time = datetime.fromisoformat(events[-1]['timestamp'])
-            duration_sec = (end_time - start_time).total_seconds()
-            duration_min = round(duration_sec / 60, 2)
-            
-            views_created = 0
-            rec_used = 0
-            custom_created = 0
-            views_deleted = 0
-            datasets = set()
-            
-            for e in events:
-                # Track dataset
-                if 'table_name' in e:
-                    datasets.add(e['table_name'])
-                
-                action = e.get('action')
-                if action == 'create_view':
-                    views_created += 1
-                    source = e.get('recommendation_source', 'custom')
-                    if source == 'recommendation':
-                        rec_used += 1
-                    else:
-                        custom_created += 1
-                    
-                elif action == 'delete_view':
-                    views_deleted += 1
+            duration_min = round(m['duration_sec'] / 60, 2)
+            views_created = int(m['views_created'])
+            rec_used = int(m['rec_views_created'])
+            datasets = table_names[row]
             
             rec_usage_rate = 0
             if views_created > 0:
-                rec_usage_rate = round((rec_used / views_created) * 100, 1)
+                rec_usage_rate = round(m['rec_rate'], 1)
 
             condition = "No Rec" if i == 0 else "With Rec"
 
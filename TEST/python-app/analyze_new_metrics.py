@@ -1,47 +1,6 @@
-import json
-import csv
 import re
 import statistics
-
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
-GROUP_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - グループ.csv"
-
-def load_group_mapping():
-    mapping = {} 
-    with open(GROUP_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
-        header_idx = -1
-        for i, row in enumerate(lines):
-            if len(row) > 1 and row[1] == 'id':
-                header_idx = i
-                break
-        
-        for row in lines[header_idx+1:]:
-            if len(row) < 7: continue
-            user_name = row[0]
-            if not user_name: continue
-            
-            # Task 1
-            dash1 = row[1]
-            task1 = row[2]
-            rec1 = row[3] == "あり"
-            if dash1: mapping[str(dash1)] = {"task": task1, "rec": rec1, "user": user_name}
-            
-            # Task 2
-            dash2 = row[4]
-            task2 = row[5]
-            rec2 = row[6] == "あり"
-            if dash2: mapping[str(dash2)] = {"task": task2, "rec": rec2, "user": user_name}
-    return mapping
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try: logs.append(json.loads(line))
-            except: continue
-    return logs
+from analysis_inputs import load_group_mapping, load_shared_logs
 
 def extract_attributes(card_name):
     """
@@ -90,7 +49,7 @@ def calculate_complexity(card_name):
 
 def analyze():
     group_map = load_group_mapping()
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     dashboard_events = {}
     for l in logs:
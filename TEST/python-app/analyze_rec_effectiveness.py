@@ -1,7 +1,6 @@
-import json
 from datetime import datetime
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 
 # Groups
 NO_REC_DASHBOARDS = ["3", "5", "8"]
@@ -9,18 +8,8 @@ REC_DASHBOARDS = ["4", "6", "7"]
 
 ADVANCED_CHARTS = ["map", "gauge", "waterfall", "line"]
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     group_stats = {
         "No Rec": {"dashboards": NO_REC_DASHBOARDS, "unique_types": [], "advanced_count": 0, "total_views": 0},
@@ -1,18 +1,7 @@
-import json
 import pandas as pd
 from datetime import datetime
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
 
 def classify_session(log):
     timestamp_str = log['timestamp']
@@ -25,7 +14,7 @@ def classify_session(log):
     return None
 
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     sessions = {
         "Experiment (2025-12-12)": {"events": []}
@@ -1,8 +1,7 @@
-import json
 from datetime import datetime
 import pandas as pd
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 
 # Configuration for context
 DASHBOARD_META = {
@@ -14,18 +13,8 @@ DASHBOARD_META = {
     "8": {"User": "C", "Task": 2, "Rec": False, "Dataset": "Wine"}
 }
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     # Calculate durations per dashboard
     dash_durations = {}
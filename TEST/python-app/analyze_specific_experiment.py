@@ -1,18 +1,8 @@
-import json
 import pandas as pd
 from datetime import datetime
+from log_loader import load_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/archive_20251209_085844/app_log.jsonl"
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
+LOG_FILE = "logs/archive_20251209_085844/app_log.jsonl"
 
 def classify_session(log):
     timestamp_str = log['timestamp']
@@ -30,7 +20,7 @@ def classify_session(log):
     return "Unknown"
 
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_logs([LOG_FILE])
     
     sessions = {
         "Task 1 (No Rec)": {"events": [], "start": None, "end": None},
@@ -1,7 +1,6 @@
 import pandas as pd
 import os
-
-DATA_DIR = '/Users/jin/metabase/TEST/data_init'
+from analysis_inputs import DATA_DIR
 
 def analyze_superpower_details():
     df = pd.read_csv(os.path.join(DATA_DIR, 'athlete_events.csv'))
@@ -1,8 +1,6 @@
-import csv
 import re
 import statistics
-
-CSV_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - フォームの回答.csv"
+from analysis_inputs import load_survey
 
 def parse_score(text):
     match = re.search(r'\((\d)\)', text)
@@ -32,19 +30,17 @@ def calculate_sus(row):
 def main():
     sus_scores = []
     
-    with open(CSV_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        
-        for row in reader:
-            name = row[1]
-            if "テスト" in name or "test" in name.lower():
-                continue
-                
-            sus = calculate_sus(row)
-            if sus is not None:
-                sus_scores.append(sus)
-                print(f"{name}: {sus}")
+    header, rows = load_survey()
+    
+    for row in rows:
+        name = row[1]
+        if "テスト" in name or "test" in name.lower():
+            continue
+            
+        sus = calculate_sus(row)
+        if sus is not None:
+            sus_scores.append(sus)
+            print(f"{name}: {sus}")
 
     if sus_scores:
         avg = statistics.mean(sus_scores)
@@ -1,27 +1,7 @@
-import json
-import csv
 import statistics
 import unicodedata
 from datetime import datetime
-
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
-SURVEY_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - フォームの回答.csv"
-GROUP_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - グループ.csv"
-
-NAME_MAP = {
-    "芹澤尚舜": "せり",
-    "峪紳大朗": "さこ",
-    "佐竹宏紀": "ひろくん",
-    "今村真沙斗": "まさと",
-    "宮澤匠": "たくみ",
-    "鈴木俊詞": "しゅんじ",
-    "永沼翔翼": "つばさ",
-    "田中 翔太郎": "たなか",
-    "岡本悠吾": "ゆうご",
-    "矢野温加": "やん",
-    "塙裕貴": "はなわ",
-    "板井孝樹": "いたい"
-}
+from analysis_inputs import NAME_MAP, load_group_rows, load_shared_logs, load_survey
 
 def char_width(char):
     w = unicodedata.east_asian_width(char)
@@ -60,47 +40,22 @@ def format_table(headers, rows):
         
     return header_line + "\n" + separator + "\n" + "\n".join(row_lines)
 
-def load_group_mapping():
-    mapping = {} 
-    with open(GROUP_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
-        header_idx = -1
-        for i, row in enumerate(lines):
-            if len(row) > 1 and row[1] == 'id':
-                header_idx = i
-                break
-        
-        for row in lines[header_idx+1:]:
-            if len(row) < 7: continue
-            user_name = row[0]
-            if not user_name: continue
-            
-            # Use columns directly. Note: Task name in Group CSV might differ slightly from Survey CSV?
-            # Group CSV: UFO, Wine
-            # Survey CSV: UFO, Wine
-            mapping[user_name] = {
-                "task1": {"dash": row[1], "task": row[2], "rec": row[3] == "あり"},
-                "task2": {"dash": row[4], "task": row[5], "rec": row[6] == "あり"}
-            }
-    return mapping
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try: logs.append(json.loads(line))
-            except: continue
-    return logs
-
 def parse_likert(val):
     import re
     match = re.search(r'\((\d)\)', val)
     return int(match.group(1)) if match else None
 
+def load_user_tasks():
+    # nickname -> {"task1": {...}, "task2": {...}}
+    mapping = {}
+    for row in load_group_rows():
+        mapping.setdefault(row['user'], {})[f"task{row['order']}"] = {
+            "dash": row['dashboard_id'], "task": row['task'], "rec": row['rec']}
+    return mapping
+
 def analyze():
-    group_map = load_group_mapping()
-    logs = load_logs(LOG_FILE)
+    group_map = load_user_tasks()
+    logs = load_shared_logs()
     
     # 1. Process Logs per Dashboard
     dash_metrics = {} # dash_id -> {duration, views, unique, rec_rate}
@@ -149,47 +104,45 @@ def analyze():
     # 2. Process Survey
     user_survey_data = {} # nickname -> {sus, task_metrics: {(task, rec) -> {readability, ...}}}
     
-    with open(SURVEY_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        for row in reader:
-            if "テスト" in row[1] or "test" in row[1].lower(): continue
-            name = row[1]
-            if "石埜" in name: continue
-            nickname = NAME_MAP.get(name)
-            if not nickname: continue
-            
-            # SUS
-            qs = []
-            for i in range(10):
-                val = parse_likert(row[3+i])
-                if val:
-                    if i%2==0: qs.append(val-1) # 0, 2...
-                    else: qs.append(5-val)      # 1, 3...
-            sus = sum(qs)*2.5 if len(qs)==10 else 0
-            
-            task_data = {}
-            
-            # Task 1
-            t1 = row[13]
-            if t1:
-                t1_read = parse_likert(row[14])
-                t1_req = parse_likert(row[15])
-                t1_use = parse_likert(row[16])
-                t1_sur = parse_likert(row[17])
-                task_data[t1] = {"read": t1_read, "req": t1_req, "use": t1_use, "sur": t1_sur}
-                
-            # Task 2
-            if len(row) > 20: 
-                t2 = row[20]
-                if t2:
-                    t2_read = parse_likert(row[21])
-                    t2_req = parse_likert(row[22])
-                    t2_use = parse_likert(row[23])
-                    t2_sur = parse_likert(row[24])
-                    task_data[t2] = {"read": t2_read, "req": t2_req, "use": t2_use, "sur": t2_sur}
+    header, rows = load_survey()
+    for row in rows:
+        if "テスト" in row[1] or "test" in row[1].lower(): continue
+        name = row[1]
+        if "石埜" in name: continue
+        nickname = NAME_MAP.get(name)
+        if not nickname: continue
+        
+        # SUS
+        qs = []
+        for i in range(10):
+            val = parse_likert(row[3+i])
+            if val:
+                if i%2==0: qs.append(val-1) # 0, 2...
+                else: qs.append(5-val)      # 1, 3...
+        sus = sum(qs)*2.5 if len(qs)==10 else 0
+        
+        task_data = {}
+        
+        # Task 1
+        t1 = row[13]
+        if t1:
+            t1_read = parse_likert(row[14])
+            t1_req = parse_likert(row[15])
+            t1_use = parse_likert(row[16])
+            t1_sur = parse_likert(row[17])
+            task_data[t1] = {"read": t1_read, "req": t1_req, "use": t1_use, "sur": t1_sur}
             
-            user_survey_data[nickname] = {"sus": sus, "tasks": task_data}
+        # Task 2
+        if len(row) > 20: 
+            t2 = row[20]
+            if t2:
+                t2_read = parse_likert(row[21])
+                t2_req = parse_likert(row[22])
+                t2_use = parse_likert(row[23])
+                t2_sur = parse_likert(row[24])
+                task_data[t2] = {"read": t2_read, "req": t2_req, "use": t2_use, "sur": t2_sur}
+        
+        user_survey_data[nickname] = {"sus": sus, "tasks": task_data}
 
     # 3. Combine and Format
     headers = [
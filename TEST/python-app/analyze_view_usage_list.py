@@ -1,24 +1,13 @@
-import json
 from collections import Counter
+from analysis_inputs import load_shared_logs
 
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
 
 # Groups
 NO_REC_DASHBOARDS = ["3", "5", "8"]
 REC_DASHBOARDS = ["4", "6", "7"]
 
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                logs.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-    return logs
-
 def analyze():
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     
     no_rec_views = []
     rec_views = []
@@ -0,0 +1,261 @@
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+# --- エンドポイント種別ごとの制限 ---
+# rate: 1秒あたりの補充トークン数, capacity: バースト上限, max_wait_sec: トークン待ちの上限, timeout: HTTPタイムアウト
+ENDPOINT_LIMITS = {
+    "query": {"rate": 2.0, "capacity": 5, "max_wait_sec": 10.0, "timeout": 60},
+    "dashboard": {"rate": 5.0, "capacity": 10, "max_wait_sec": 5.0, "timeout": 15},
+    "metadata": {"rate": 5.0, "capacity": 10, "max_wait_sec": 5.0, "timeout": 30},
+    "write": {"rate": 2.0, "capacity": 5, "max_wait_sec": 10.0, "timeout": 30},
+    "other": {"rate": 5.0, "capacity": 10, "max_wait_sec": 5.0, "timeout": 30},
+}
+
+# --- サーキットブレーカー設定 ---
+BREAKER_WINDOW = 20  # 直近何件の結果でエラー率を判定するか
+BREAKER_MIN_REQUESTS = 5
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_OPEN_SEC = 30.0
+
+# バックグラウンド (先読み) のリクエストは待たずにトークンを取り、前面の操作のためにこの数を残す
+# (行をそのまま返すプレビューは件数とサンプルの2回)
+BACKGROUND_RESERVE_TOKENS = 2
+
+# ブレーカー作動時に返す直近の成功レスポンスの保持件数と合計バイト数の上限
+STALE_CACHE_SIZE = 256
+STALE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class RateLimitedError(requests.exceptions.RequestException):
+    """トークン待ちが上限を超えたため送信を見送った。"""
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Metabaseのエラー率が高いため送信せずに失敗させた。"""
+
+
+def classify_endpoint(method: str, path: str) -> str:
+    path = path.split("?", 1)[0]
+    if path.startswith("/api/dataset") or re.fullmatch(r"/api/card/\d+/query(/\w+)?", path):
+        return "query"
+    if method.upper() != "GET" and path.startswith(("/api/card", "/api/dashboard")):
+        return "write"
+    if path.startswith("/api/dashboard"):
+        return "dashboard"
+    if path.startswith(("/api/database", "/api/table", "/api/field")):
+        return "metadata"
+    return "other"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, max_wait_sec: float) -> bool:
+        """トークンを1つ取得する。max_wait_sec 以内に取得できなければ False を返す。"""
+        deadline = time.monotonic() + max_wait_sec
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = min((1 - self.tokens) / self.rate, deadline - time.monotonic())
+                    if wait <= 0:
+                        return False
+                    self._cond.wait(wait)
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self, reserve: int = 0) -> bool:
+        """待たずにトークンを1つ取得する。取得後も reserve 個以上残る場合だけ取得し、待っている呼び出しがあれば譲る。"""
+        with self._cond:
+            self._refill()
+            if self.waiting or self.tokens < 1 + reserve:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    def __init__(self, window: int = BREAKER_WINDOW, min_requests: int = BREAKER_MIN_REQUESTS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, open_sec: float = BREAKER_OPEN_SEC):
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.open_sec = open_sec
+        self.results = deque(maxlen=window)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """送信してよければ真を返す。half_open の試行枠を取得した場合は "trial" を返す。"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_sec:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "closed":
+                return True
+            # half_open では試行リクエストを1件だけ通す
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return "trial"
+            return False
+
+    def release_trial(self):
+        """試行枠を取得したが送信しなかった場合に枠を戻す。"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, success: bool):
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+                if success:
+                    self.state = "closed"
+                    self.results.clear()
+                else:
+                    self._open()
+                return
+            self.results.append(success)
+            failures = self.results.count(False)
+            if len(self.results) >= self.min_requests and failures / len(self.results) >= self.failure_ratio:
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.results.clear()
+
+
+class ApiGuard:
+    """
+    Metabase API 呼び出しをエンドポイント種別ごとのトークンバケットとサーキットブレーカーで保護する。
+    ブレーカー作動中やレート超過時は、同じセッションの同一の GET リクエストの直近の成功レスポンスがあればそれを返す。
+    返すレスポンスは写しで、served_stale 属性が True になる。
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]] = None):
+        limits = limits or ENDPOINT_LIMITS
+        self.limits = limits
+        self.buckets = {name: TokenBucket(cfg["rate"], cfg["capacity"]) for name, cfg in limits.items()}
+        self.breakers = {name: CircuitBreaker() for name in limits}
+        self.counters = {name: {"requests": 0, "failures": 0, "rejected": 0, "short_circuited": 0, "served_stale": 0} for name in limits}
+        self._stale: "OrderedDict[str, requests.Response]" = OrderedDict()
+        self._stale_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(method: str, path: str, args: tuple, kwargs: Dict[str, Any]) -> Optional[str]:
+        # GET のみ直近の結果を再利用できる。ストリーミング応答は再読み込みできないため除く
+        # (/api/dataset の結果は呼び出し側の QueryResultCache が合計バイト数の上限付きで保持する)
+        if kwargs.get("stream") or method.upper() != "GET":
+            return None
+        # 権限はユーザーごとに異なるため、他のセッションの結果は返さない (send の最初の引数がセッションID)
+        session_id = args[0] if args else kwargs.get("session_id")
+        body = json.dumps(kwargs.get("json"), sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(f"{session_id} {method.upper()} {path} {body}".encode("utf-8")).hexdigest()
+
+    def _count(self, endpoint: str, name: str):
+        with self._lock:
+            self.counters[endpoint][name] += 1
+
+    def _fallback(self, endpoint: str, cache_key: Optional[str], error: requests.exceptions.RequestException) -> requests.Response:
+        with self._lock:
+            cached = self._stale.get(cache_key) if cache_key else None
+        if cached is None:
+            raise error
+        self._count(endpoint, "served_stale")
+        stale = copy.copy(cached)
+        stale.served_stale = True  # RequestTracer が参照する
+        return stale
+
+    def request(self, send: Callable[..., requests.Response], method: str, path: str, *args,
+                background: bool = False, **kwargs) -> requests.Response:
+        """
+        send(method, path, *args, **kwargs) をレート制限・ブレーカー付きで呼び出す。
+        background=True (先読み) の場合はトークンを待たず、前面の操作の分を残せないときは RateLimitedError を送出する
+        (古いレスポンスでは代用しない)。
+        """
+        endpoint = classify_endpoint(method, path)
+        limits = self.limits[endpoint]
+        cache_key = self._cache_key(method, path, args, kwargs)
+        kwargs.setdefault("timeout", limits["timeout"])
+
+        breaker = self.breakers[endpoint]
+        permit = breaker.allow()
+        if not permit:
+            self._count(endpoint, "short_circuited")
+            return self._fallback(endpoint, cache_key, CircuitOpenError(f"Metabase API ({endpoint}) is temporarily unavailable"))
+        bucket = self.buckets[endpoint]
+        if not (bucket.try_acquire(BACKGROUND_RESERVE_TOKENS) if background else bucket.acquire(limits["max_wait_sec"])):
+            self._count(endpoint, "rejected")
+            if permit == "trial":
+                breaker.release_trial()
+            if background:
+                raise RateLimitedError(f"No spare Metabase API ({endpoint}) capacity for background requests")
+            return self._fallback(endpoint, cache_key, RateLimitedError(f"Too many Metabase API ({endpoint}) requests"))
+
+        self._count(endpoint, "requests")
+        try:
+            response = send(method, path, *args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self._count(endpoint, "failures")
+            breaker.record(False)
+            return self._fallback(endpoint, cache_key, e)
+        except BaseException:
+            # 想定外の例外で結果を記録できない場合は、試行枠を戻して half_open のまま止まらないようにする
+            # (結果を記録する場合は record() が試行枠を戻すため、ここでは戻さない)
+            if permit == "trial":
+                breaker.release_trial()
+            raise
+
+        # 5xx と 429 はMetabase側の過負荷としてブレーカーに数える
+        overloaded = response.status_code >= 500 or response.status_code == 429
+        breaker.record(not overloaded)
+        if overloaded:
+            self._count(endpoint, "failures")
+        elif cache_key and response.ok and len(response.content or b"") <= STALE_CACHE_MAX_BYTES:
+            with self._lock:
+                previous = self._stale.pop(cache_key, None)
+                if previous is not None:
+                    self._stale_bytes -= len(previous.content or b"")
+                self._stale[cache_key] = response
+                self._stale_bytes += len(response.content or b"")
+                while len(self._stale) > STALE_CACHE_SIZE or self._stale_bytes > STALE_CACHE_MAX_BYTES:
+                    _, evicted = self._stale.popitem(last=False)
+                    self._stale_bytes -= len(evicted.content or b"")
+        return response
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            counters = {name: dict(values) for name, values in self.counters.items()}
+        return {
+            name: {
+                **counters[name],
+                "queue_depth": self.buckets[name].waiting,
+                "breaker_state": self.breakers[name].state,
+            }
+            for name in self.limits
+        }
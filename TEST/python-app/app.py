@@ -13,6 +13,24 @@ from datetime import datetime
 import json
 from streamlit_session_browser_storage import SessionStorage
 import uuid
+import functools
+from metadata_cache import MetadataCache
+from metabase_session import TokenManager
+from api_guard import ApiGuard
+from request_tracing import RequestTracer, begin_action, current_action
+from log_writer import JsonlLogWriter
+from session_log import SessionLogBuffer
+from query_cache import QueryResultCache, query_cache_key
+from column_stats import ColumnStatsService, is_ranged
+from preview_downsample import downsample_for_chart
+from result_decoder import decode_json, preview_column_names, result_to_frame
+from preview_prefetch import PreviewPrefetcher, candidate_queries
+from aggregate_cube import CUBE_SCHEMA, CubeBuilder, CubeRouter
+from dashboard_layout import LayoutIndex
+from layout_optimizer import optimize_layout, preferred_sizes
+from query_cost import UNIT_LABELS, assess_query_cost, estimate_query_cost
+from result_export import EXPORT_FORMATS, default_export_path, export_card, export_direct, export_query
+from preview_engine import PREVIEW_ENGINE, PreviewEngine, UnsupportedQueryError, estimate_result_bytes, is_raw_row_query, preview_row_cap, result_rows
 
 import plotly.graph_objects as go
 
@@ -127,39 +145,25 @@ def normalize_id(input_id: Any) -> str:
     translation_table = str.maketrans("０１２３４５６７８９", "0123456789")
     return input_id.translate(translation_table)
 
-def find_empty_space(dashcards: List[Dict], card_width: int, card_height: int, grid_columns: int = 24) -> Tuple[int, int]:
-    if not dashcards:
-        return (0, 0)
-    max_row_so_far = max((c.get('row', 0) + c.get('size_y', 0)) for c in dashcards) if dashcards else 0
-    grid_height = max_row_so_far + card_height
-    grid_map = np.zeros((grid_height, grid_columns), dtype=int)
-    for card in dashcards:
-        col, row, width, height = card.get('col', 0), card.get('row', 0), card.get('size_x', 6), card.get('size_y', 4)
-        grid_map[row:row+height, col:col+width] = 1
-    for r in range(grid_height - card_height + 1):
-        for c in range(grid_columns - card_width + 1):
-            if np.sum(grid_map[r:r+card_height, c:c+card_width]) == 0:
-                return (r, c)
-    return (max_row_so_far, 0)
-
-def _deduplicate_columns(column_names: List[str]) -> List[str]:
-    new_names = []
-    counts = {}
-    for name in column_names:
-        if name in counts:
-            counts[name] += 1
-            new_names.append(f"{name}_{counts[name]}")
-        else:
-            counts[name] = 1
-            new_names.append(name)
-    return new_names
+@st.cache_resource
+def get_log_writer() -> JsonlLogWriter:
+    # プロセス内で1つの書き込みスレッドが logs/app_log.jsonl にまとめて追記する (終了時に残りを書き出す)
+    return JsonlLogWriter().start()
+
+def get_session_log() -> SessionLogBuffer:
+    # 操作ログはサーバー側に追記し、ブラウザの sessionStorage にはダウンロード時にまとめて保存する。
+    # ページを再読み込みした場合は、ブラウザに保存済みの分から復元する
+    if "session_log" not in st.session_state:
+        ss = SessionStorage()
+        st.session_state.session_log = SessionLogBuffer.restore(ss.getItem)
+    return st.session_state.session_log
+
+def sync_session_log():
+    """前回の保存以降の操作ログを、新しいチャンクとしてブラウザに保存する。"""
+    ss = SessionStorage()
+    get_session_log().sync(lambda key, value: ss.setItem(key, value, key=f"set_{key}"))
 
 def add_log_entry(action: str, details: Dict):
-    ss = SessionStorage()
-    log = ss.getItem('operation_log') 
-    if log is None:
-        log = []
-    
     # 基本情報の収集
     timestamp = datetime.now().isoformat()
     user_id = st.session_state.get("username", "unknown")
@@ -172,44 +176,51 @@ def add_log_entry(action: str, details: Dict):
         "dashboard_id": dashboard_id,
         "recommendation_enabled": use_rec,
         "action": action,
+        "trace_id": current_action().get("trace_id"),
         **details
     }
     
-    # Session Storage (UI表示用)
-    log.append(entry)
-    ss.setItem('operation_log', log, key=f"set_log_{uuid.uuid4()}")
-    
-    # Server-side File Logging (分析用)
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+    # セッションの操作ログ (UI表示・ダウンロード用)。ブラウザへの保存は sync_session_log で行う
+    get_session_log().append(entry)
     
-    log_file = os.path.join(log_dir, "app_log.jsonl")
-    try:
-        with open(log_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-    except Exception as e:
-        print(f"Failed to write log to file: {e}")
+    # Server-side File Logging (分析用)。書き込みは専用スレッドが行うため、画面の操作を待たせない
+    get_log_writer().write(entry)
 
-    print(f"LOG: {entry}")
+def finish_dashboard_creation():
+    # ダウンロードの時点でブラウザ側の操作ログも最新にする
+    add_log_entry("finish_dashboard_creation", {})
+    sync_session_log()
 
 # --- Metabase連携関数 ---
+@st.cache_resource
+def get_token_manager() -> TokenManager:
+    # セッショントークンはユーザー・ホスト単位でキャッシュし、リラン・プロセス間で再利用する
+    return TokenManager(METABASE_API_URL)
+
+@st.cache_resource
+def get_api_guard() -> ApiGuard:
+    # 全セッション共通のレート制限とサーキットブレーカー (共有のMetabaseを保護する)
+    return ApiGuard()
+
+@st.cache_resource
+def get_request_tracer() -> RequestTracer:
+    # エンドポイント別のレイテンシ等を集計し、logs/ に定期的にスナップショットを書き出す
+    return RequestTracer().start()
+
+def metabase_request(method: str, path: str, session_id: str, **kwargs) -> requests.Response:
+    send = functools.partial(get_api_guard().request, get_token_manager().request)
+    return get_request_tracer().request(send, method, path, session_id, **kwargs)
+
 def get_metabase_session(username, password):
-    api_url = f"{METABASE_API_URL}/api/session"
-    credentials = {"username": username, "password": password}
     try:
-        response = requests.post(api_url, json=credentials)
-        response.raise_for_status()
-        return response.json().get("id")
+        return get_token_manager().get_token(username, password)
     except requests.exceptions.RequestException as e:
         st.error(f"Metabaseへのログインに失敗しました: {e}")
         return None
 
 def get_dashboard_details(session_id, dashboard_id):
-    api_url = f"{METABASE_API_URL}/api/dashboard/{dashboard_id}"
-    headers = {"X-Metabase-Session": session_id}
     try:
-        response = requests.get(api_url, headers=headers)
+        response = metabase_request("GET", f"/api/dashboard/{dashboard_id}", session_id)
         if response.status_code == 404:
             st.error(f"ID '{dashboard_id}' のダッシュボードが見つかりません。")
             return None
@@ -219,79 +230,112 @@ def get_dashboard_details(session_id, dashboard_id):
         st.error(f"ダッシュボード情報の取得に失敗しました: {e}")
         return None
 
-@st.cache_data(ttl=60) # キャッシュ時間を短く設定
-def get_all_tables_metadata(_session_id: str) -> Tuple[Optional[int], Optional[List[Dict]]]:
+@st.cache_resource
+def get_metadata_cache() -> MetadataCache:
+    # データベースID単位でセッション間共有・ディスク永続化されるメタデータキャッシュ
+    return MetadataCache(METABASE_API_URL, request=metabase_request)
+
+def get_all_tables_metadata(session_id: str) -> Tuple[Optional[int], Optional[List[Dict]]]:
     """
-    Sample Database以外の最初のデータベースを取得し、その中の全てのテーブルを返す。
-    隠しテーブルも含める設定 (include_hidden=true) を追加。
+    Sample Database以外の最初のデータベースを取得し、その中の全てのテーブル一覧を返す。
+    一覧は共有キャッシュの軽量インデックスでフィールドを含まない (フィールドは load_table_fields で取得)。
     """
-    headers = {"X-Metabase-Session": _session_id}
+    cache = get_metadata_cache()
     try:
-        # 1. 全データベース取得
-        db_response = requests.get(f"{METABASE_API_URL}/api/database", headers=headers)
-        db_response.raise_for_status()
-        databases = db_response.json().get('data', [])
-        
-        # Sample Database 以外を取得
-        target_db = next((db for db in databases if db['name'] != 'Sample Database'), None)
-        
-        if not target_db:
+        db_id = cache.get_target_database_id(session_id)
+        if db_id is None:
             return None, None
-
-        db_id = target_db['id']
-        
-        # 2. ターゲットDBの全テーブルメタデータを取得 (include_hidden=true を追加)
-        # APIドキュメント: GET /api/database/{id}/metadata
-        meta_url = f"{METABASE_API_URL}/api/database/{db_id}/metadata?include_hidden=true"
-        meta_response = requests.get(meta_url, headers=headers)
-        meta_response.raise_for_status()
-        
-        tables = meta_response.json().get('tables', [])
-        return db_id, tables
-        
+        # 集計キューブはプレビューの高速化用で、分析対象のテーブルとしては表示しない
+        return db_id, [t for t in cache.get_table_index(session_id, db_id) if t.get('schema') != CUBE_SCHEMA]
     except requests.exceptions.RequestException as e:
         st.error(f"メタデータの取得に失敗しました: {e}")
         return None, None
 
+def load_table_fields(table_id: int) -> List[Dict]:
+    """テーブルのフィールド一覧を返す。テーブルが選択された時点で初めてAPIから読み込む。"""
+    table = next((tbl for tbl in st.session_state.tables_metadata or [] if tbl['id'] == table_id), None)
+    if table is None:
+        return []
+    try:
+        table_detail = get_metadata_cache().get_table(st.session_state.metabase_session_id, table['db_id'], table_id)
+    except requests.exceptions.RequestException as e:
+        st.error(f"テーブル情報の取得に失敗しました: {e}")
+        return []
+    return table_detail.get('fields', []) if table_detail else []
+
 # 古い関数 ensure_and_get_analytics_db_id は削除し、get_all_tables_metadata に統合しました
 
 def create_card(session_id: str, card_payload: Dict[str, Any]) -> Optional[int]:
-    api_url = f"{METABASE_API_URL}/api/card"
-    headers = {"X-Metabase-Session": session_id}
     try:
-        response = requests.post(api_url, headers=headers, json=card_payload)
+        response = metabase_request("POST", "/api/card", session_id, json=card_payload)
         response.raise_for_status()
         st.success(f"カード「{card_payload['name']}」が正常に作成されました！")
         return response.json().get('id')
     except requests.exceptions.RequestException as e:
         st.error(f"カードの作成に失敗しました: {e}")
-        st.error(f"Metabaseからの応答: {e.response.text}")
+        if e.response: st.error(f"Metabaseからの応答: {e.response.text}")
         return None
 
+@st.cache_resource
+def get_layout_index() -> LayoutIndex:
+    # ダッシュボード・タブごとの占有グリッドを全セッションで共有し、取得したダッシュカードとの差分だけを反映する
+    return LayoutIndex()
+
+def get_layout_dashcards(dashboard_data: Dict) -> Tuple[Optional[int], List[Dict]]:
+    """
+    配置の対象 (先頭のタブ、タブがなければダッシュボード全体) のタブIDとダッシュカードのリストを返す。
+    タブの中に dashcards がある形式と、トップレベルの dashcards に dashboard_tab_id が付いた形式の両方に対応する。
+    """
+    tabs = dashboard_data.get("tabs")
+    if not (isinstance(tabs, list) and tabs):
+        return None, dashboard_data.setdefault('dashcards', [])
+    target_tab = tabs[0]
+    if "dashcards" in target_tab:
+        return target_tab.get("id"), target_tab["dashcards"]
+    tab_id = target_tab.get("id")
+    return tab_id, [c for c in dashboard_data.get('dashcards', []) if c.get("dashboard_tab_id") == tab_id]
+
+def update_dashboard_dashcards(session_id: str, dashboard_id: str, dashboard_data: Dict, tab_id: Optional[int], dashcards: List[Dict]) -> Dict:
+    """配置対象のダッシュカードを dashcards に置き換えて保存し、保存後のダッシュボードを返す。"""
+    update_payload = {"name": dashboard_data.get("name"), "description": dashboard_data.get("description")}
+    tabs = dashboard_data.get("tabs")
+    if isinstance(tabs, list) and tabs:
+        if "dashcards" in tabs[0]:
+            tabs[0]["dashcards"] = dashcards
+        else:
+            others = [c for c in dashboard_data.get('dashcards', []) if c.get("dashboard_tab_id") != tab_id]
+            update_payload["dashcards"] = others + [{**c, "dashboard_tab_id": tab_id} for c in dashcards]
+        update_payload["tabs"] = tabs
+    else:
+        update_payload["dashcards"] = dashcards
+    put_response = metabase_request("PUT", f"/api/dashboard/{dashboard_id}", session_id, json=update_payload)
+    put_response.raise_for_status()
+    return put_response.json()
+
+def sync_layout_index(dashboard_id: str, tab_id: Optional[int], saved_dashboard: Any):
+    # 保存後のダッシュボード (採番済みのID) で占有グリッドを更新する。応答が想定外の形式なら破棄して次回作り直す
+    try:
+        saved_tab_id, saved_dashcards = get_layout_dashcards(saved_dashboard)
+        if saved_tab_id == tab_id:
+            get_layout_index().get(dashboard_id, tab_id, saved_dashcards)
+            return
+    except (AttributeError, TypeError):
+        pass
+    get_layout_index().invalidate(dashboard_id)
+
 def add_card_to_dashboard(session_id: str, dashboard_id: str, card_id: int, size_x: int, size_y: int) -> bool:
-    dashboard_api_url = f"{METABASE_API_URL}/api/dashboard/{dashboard_id}"
-    headers = {"X-Metabase-Session": session_id}
+    dashboard_path = f"/api/dashboard/{dashboard_id}"
     try:
-        get_response = requests.get(dashboard_api_url, headers=headers)
+        get_response = metabase_request("GET", dashboard_path, session_id)
         get_response.raise_for_status()
         dashboard_data = get_response.json()
-        has_tabs = "tabs" in dashboard_data and isinstance(dashboard_data.get("tabs"), list) and len(dashboard_data["tabs"]) > 0
-        if has_tabs:
-            target_tab = dashboard_data["tabs"][0]
-            dashcards = target_tab.get("dashcards", [])
-        else:
-            dashcards = dashboard_data.get('dashcards', [])
-        new_row, new_col = find_empty_space(dashcards, size_x, size_y)
+        tab_id, dashcards = get_layout_dashcards(dashboard_data)
+        occupancy = get_layout_index().get(dashboard_id, tab_id, dashcards)
+        with occupancy.lock:
+            new_row, new_col = occupancy.find(size_x, size_y)
         new_dashcard = {"id": -1, "card_id": card_id, "col": new_col, "row": new_row, "size_x": size_x, "size_y": size_y, "series": [], "visualization_settings": {}}
-        dashcards.append(new_dashcard)
-        update_payload = {"name": dashboard_data.get("name"), "description": dashboard_data.get("description")}
-        if has_tabs:
-            target_tab["dashcards"] = dashcards
-            update_payload["tabs"] = dashboard_data["tabs"]
-        else:
-            update_payload["dashcards"] = dashcards
-        put_response = requests.put(dashboard_api_url, headers=headers, json=update_payload)
-        put_response.raise_for_status()
+        saved = update_dashboard_dashcards(session_id, dashboard_id, dashboard_data, tab_id, dashcards + [new_dashcard])
+        sync_layout_index(dashboard_id, tab_id, saved)
         return True
     except requests.exceptions.RequestException as e:
         st.error(f"カードのダッシュボードへの追加に失敗しました: {e}")
@@ -299,50 +343,406 @@ def add_card_to_dashboard(session_id: str, dashboard_id: str, card_id: int, size
         return False
 
 def remove_card_from_dashboard(session_id: str, dashboard_id: str, dashcard_id_to_remove: int) -> bool:
-    dashboard_api_url = f"{METABASE_API_URL}/api/dashboard/{dashboard_id}"
-    headers = {"X-Metabase-Session": session_id}
+    dashboard_path = f"/api/dashboard/{dashboard_id}"
     try:
-        get_response = requests.get(dashboard_api_url, headers=headers)
+        get_response = metabase_request("GET", dashboard_path, session_id)
         get_response.raise_for_status()
         dashboard_data = get_response.json()
-        has_tabs = "tabs" in dashboard_data and isinstance(dashboard_data.get("tabs"), list) and len(dashboard_data["tabs"]) > 0
-        if has_tabs:
-            target_tab = dashboard_data["tabs"][0]
-            dashcards_list = target_tab.get("dashcards", [])
-        else:
-            dashcards_list = dashboard_data.get('dashcards', [])
+        tab_id, dashcards_list = get_layout_dashcards(dashboard_data)
         original_count = len(dashcards_list)
         new_dashcards_list = [card for card in dashcards_list if card.get("id") != dashcard_id_to_remove]
         if len(new_dashcards_list) == original_count:
             st.warning(f"ID {dashcard_id_to_remove} のカードがダッシュボード上に見つかりません。")
             return False
-        update_payload = {"name": dashboard_data.get("name"), "description": dashboard_data.get("description")}
-        if has_tabs:
-            target_tab["dashcards"] = new_dashcards_list
-            update_payload["tabs"] = dashboard_data["tabs"]
-        else:
-            update_payload["dashcards"] = new_dashcards_list
-        put_response = requests.put(dashboard_api_url, headers=headers, json=update_payload)
-        put_response.raise_for_status()
+        saved = update_dashboard_dashcards(session_id, dashboard_id, dashboard_data, tab_id, new_dashcards_list)
+        sync_layout_index(dashboard_id, tab_id, saved)
         return True
     except requests.exceptions.RequestException as e:
         st.error(f"カードのダッシュボードからの削除に失敗しました: {e}")
         if e.response: st.error(f"Metabaseからの応答: {e.response.text}")
         return False
 
-def execute_query(session_id: str, dataset_query: Dict[str, Any]) -> Optional[Dict]:
-    api_url = f"{METABASE_API_URL}/api/dataset"
-    headers = {"X-Metabase-Session": session_id}
+def compact_dashboard(session_id: str, dashboard_id: str) -> Optional[int]:
+    """カードを上に詰めて空白をなくし、移動したカード数を返す。失敗した場合は None。"""
+    dashboard_path = f"/api/dashboard/{dashboard_id}"
+    try:
+        get_response = metabase_request("GET", dashboard_path, session_id)
+        get_response.raise_for_status()
+        dashboard_data = get_response.json()
+        tab_id, dashcards = get_layout_dashcards(dashboard_data)
+        occupancy = get_layout_index().get(dashboard_id, tab_id, dashcards)
+        with occupancy.lock:
+            moves = occupancy.compact()
+        if not moves:
+            return 0
+        compacted = [{**card, "row": moves[card["id"]]} if card.get("id") in moves else card for card in dashcards]
+        saved = update_dashboard_dashcards(session_id, dashboard_id, dashboard_data, tab_id, compacted)
+        sync_layout_index(dashboard_id, tab_id, saved)
+        return len(moves)
+    except requests.exceptions.RequestException as e:
+        get_layout_index().invalidate(dashboard_id)
+        st.error(f"ダッシュボードの整理に失敗しました: {e}")
+        if e.response: st.error(f"Metabaseからの応答: {e.response.text}")
+        return None
+
+@st.cache_resource
+def get_preferred_sizes() -> Dict[str, str]:
+    # トリプルの v_i->size から、ビュー種別ごとに最もよく使われたサイズ (S/M/L) を求めておく
+    if not os.path.exists(TRIPLES_FILE):
+        return {}
+    return preferred_sizes(TRIPLES_FILE)
+
+def layout_card_size(dashcard: Dict, use_size_evidence: bool) -> Tuple[int, int]:
+    """最適化で使うカードの (size_x, size_y)。use_size_evidence なら推薦データでよく使われるサイズにする。"""
+    size = (dashcard.get("size_x", 6), dashcard.get("size_y", 4))
+    if not use_size_evidence:
+        return size
+    view = CARD_DISPLAY_TYPE_MAPPING.get((dashcard.get("card") or {}).get("display"))
+    label = get_preferred_sizes().get(view)
+    mapped = next((v for k, v in SIZE_MAPPING.items() if label and k.split(" ")[0] == label), None)
+    return (mapped["width"], mapped["height"]) if mapped else size
+
+def optimize_dashboard_layout(session_id: str, dashboard_id: str, use_size_evidence: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    ダッシュボードのカードを並べ直し、全体の高さを小さく、同じテーブルのカードを隣り合うようにして保存する。
+    戻り値は optimize_layout の結果 (配置を除く)。失敗した場合は None。
+    """
+    dashboard_path = f"/api/dashboard/{dashboard_id}"
+    try:
+        get_response = metabase_request("GET", dashboard_path, session_id)
+        get_response.raise_for_status()
+        dashboard_data = get_response.json()
+        tab_id, dashcards = get_layout_dashcards(dashboard_data)
+        cards = []
+        for index, dashcard in enumerate(dashcards):
+            card = dashcard.get("card") or {}
+            size_x, size_y = layout_card_size(dashcard, use_size_evidence)
+            group = ((card.get("dataset_query") or {}).get("query") or {}).get("source-table", card.get("table_id"))
+            cards.append({"key": index, "width": size_x, "height": size_y, "group": group})
+        result = optimize_layout(cards)
+        arranged = []
+        for card, dashcard in zip(cards, dashcards):
+            row, col = result["placements"][card["key"]]
+            arranged.append({**dashcard, "row": row, "col": col, "size_x": card["width"], "size_y": card["height"]})
+        saved = update_dashboard_dashcards(session_id, dashboard_id, dashboard_data, tab_id, arranged)
+        sync_layout_index(dashboard_id, tab_id, saved)
+        return {k: v for k, v in result.items() if k != "placements"}
+    except requests.exceptions.RequestException as e:
+        get_layout_index().invalidate(dashboard_id)
+        st.error(f"レイアウトの最適化に失敗しました: {e}")
+        if e.response: st.error(f"Metabaseからの応答: {e.response.text}")
+        return None
+
+@st.cache_resource
+def get_query_cache() -> QueryResultCache:
+    # 正規化したMBQLをキーに、全セッションでクエリ結果を共有する
+    return QueryResultCache()
+
+@st.cache_resource
+def get_preview_engine() -> Optional[PreviewEngine]:
+    # PREVIEW_ENGINE=postgres の場合のみ、分析用DBへ直接接続するプレビューエンジンを使う
+    if PREVIEW_ENGINE != "postgres":
+        return None
+    try:
+        engine = PreviewEngine(DATA_DB_CONFIG["details"])
+        # 集計キューブ (aggregate_cube.py build で作成) があれば、該当する集約プレビューをキューブから返す
+        engine.router = CubeRouter(engine)
+        return engine
+    except Exception as e:
+        print(f"Preview engine is unavailable, falling back to Metabase: {e}")
+        return None
+
+@st.cache_resource
+def get_column_stats_service() -> ColumnStatsService:
+    # テーブルと最終同期時刻をキーに、列の統計を全セッションで共有する
+    return ColumnStatsService(request=metabase_request, engine=get_preview_engine())
+
+def get_column_stats(table_id: int, field_id: Optional[int] = None, with_top_values: bool = False) -> Optional[Dict]:
+    """
+    テーブルの列の統計を返す。field_id を省略した場合はテーブル全体 ({"row_count", "columns"})。
+    取得できない場合 (結合先の列など) は None。
+    """
+    session_id = st.session_state.metabase_session_id
+    table = next((t for t in st.session_state.tables_metadata or [] if t['id'] == table_id), None)
+    if table is None:
+        return None
+    # 最終同期時刻は、定期的に更新されるメタデータキャッシュのテーブル一覧から取る
+    table = next((t for t in get_metadata_cache().get_table_index(session_id, table['db_id']) if t['id'] == table_id), table)
+    service = get_column_stats_service()
+    try:
+        if field_id is None:
+            return service.get_table_stats(session_id, table, load_table_fields(table_id))
+        return service.get_column_stats(session_id, table, load_table_fields(table_id), field_id, with_top_values=with_top_values)
+    except (requests.exceptions.RequestException, KeyError, IndexError) as e:
+        print(f"Failed to get column statistics for table {table_id}: {e}")
+        return None
+
+def get_query_context(table_id: Optional[int], background: bool = False) -> Dict[str, Any]:
+    """
+    クエリの実行に使う、Streamlit のセッションと共有リソースから得る値をまとめる。
+    先読みのスレッドにはこれを渡し、スレッドからは st.session_state やスクリプトのコンテキストを参照しない。
+    background=True の場合、Metabase へのリクエストはレート制限のトークンを待たない (前面の操作の分を残す)。
+    """
+    table = next((t for t in st.session_state.get("tables_metadata") or [] if t['id'] == table_id), None)
+    send = functools.partial(get_api_guard().request, get_token_manager().request, background=background)
+    return {
+        "table": table, "fields": load_table_fields(table_id) if table else [],
+        "cache": get_query_cache(), "engine": get_preview_engine(),
+        "request": functools.partial(get_request_tracer().request, send),
+    }
+
+def execute_direct_query(dataset_query: Dict[str, Any], sample: Optional[Dict[str, int]] = None,
+                         context: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+    """プレビューエンジンで直接実行する。実行できないクエリやDBエラーの場合は None を返す。"""
+    context = context or get_query_context(dataset_query.get("query", {}).get("source-table"))
+    engine, table = context["engine"], context["table"]
+    if engine is None or table is None:
+        return None
     try:
-        response = requests.post(api_url, headers=headers, json=dataset_query)
+        return engine.execute(dataset_query, table, context["fields"], sample=sample)
+    except UnsupportedQueryError:
+        return None
+    except Exception as e:
+        print(f"Direct preview query failed, falling back to Metabase: {e}")
+        return None
+
+def execute_query(session_id: str, dataset_query: Dict[str, Any], use_cache: bool = True, prefer_direct: bool = False,
+                  sample: Optional[Dict[str, int]] = None, report_errors: bool = True,
+                  context: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+    """
+    クエリを実行して /api/dataset 形式の結果を返す。
+    prefer_direct=True (プレビュー・統計用) の場合は、可能であれば分析用DBへ直接問い合わせる。
+    sample={"rows": N, "total": M} の場合は N 行だけ取得する。直接接続では無作為抽出、
+    Metabase経由では limit による先頭 N 行となり、結果の sample_method に記録する。
+    report_errors=False (バックグラウンドの先読み) の場合はエラーを画面に表示しない。
+    context (get_query_context の戻り値) を渡せば、Streamlit のコンテキストのないスレッドからも呼べる。
+    """
+    table_id = dataset_query.get("query", {}).get("source-table")
+    context = context or get_query_context(table_id)
+    cache = context["cache"]
+    cache_key = query_cache_key(dataset_query) + (f":sample={sample['rows']}" if sample else "")
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    table = context["table"]
+    table_name = table['name'] if table else None
+    if prefer_direct:
+        result = execute_direct_query(dataset_query, sample=sample, context=context)
+        if result is not None:
+            if sample:
+                result["sample_method"] = "random"
+            cache.put(cache_key, result, estimate_result_bytes(result), table_id=table_id, table_name=table_name)
+            return result
+    if sample:
+        dataset_query = {**dataset_query, "query": {**dataset_query["query"], "limit": sample["rows"]}}
+    try:
+        response = context["request"]("POST", "/api/dataset", session_id, json=dataset_query)
         response.raise_for_status()
-        return response.json()
+        result = decode_json(response.content)
+        if sample:
+            result["sample_method"] = "head"
+        if result.get('status') == 'completed':
+            cache.put(cache_key, result, len(response.content), table_id=table_id, table_name=table_name)
+        return result
     except requests.exceptions.RequestException as e:
+        if not report_errors:
+            print(f"Query failed: {e}")
+            return None
         st.error(f"クエリの実行に失敗しました: {e}")
         if e.response:
             st.error(f"Metabaseからの応答: {e.response.text}")
         return None
 
+def get_preview_row_cap(query: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> int:
+    """プレビューの行数上限 (列数に応じて決まる)。"""
+    if is_raw_row_query(query):
+        fields = context["fields"] if context else load_table_fields(query.get("source-table"))
+        num_columns = len(query.get("fields") or fields)
+    else:
+        num_columns = len(query.get("breakout", [])) + len(query.get("aggregation", []))
+    return preview_row_cap(num_columns)
+
+def assess_preview_cost(dataset_query: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    プレビューを送る前に、列の統計 (直接接続があれば EXPLAIN も) から結果行数と実行時間を推定し、
+    警告・実行の可否を判定する。戻り値は assess_query_cost と同じで、推定値を "estimate" に含める。
+    """
+    query = dataset_query["query"]
+    table_id = query.get("source-table")
+    table_stats = get_column_stats(table_id)
+    plan = None
+    engine = get_preview_engine()
+    table = next((t for t in st.session_state.get("tables_metadata") or [] if t['id'] == table_id), None)
+    if engine is not None and table is not None:
+        try:
+            plan = engine.explain(dataset_query, table, load_table_fields(table_id))
+        except UnsupportedQueryError:
+            pass
+        except Exception as e:
+            print(f"EXPLAIN failed, estimating from column statistics: {e}")
+    estimate = estimate_query_cost(query, table_stats, plan=plan)
+    assessment = assess_query_cost(query, estimate, table_stats, load_table_fields(table_id), get_preview_row_cap(query))
+    return {**assessment, "estimate": estimate}
+
+def apply_suggested_granularity(key_prefix: str, unit: str):
+    # ウィジェットの値は描画前 (コールバック内) でしか変更できない
+    st.session_state[f"{key_prefix}granularity"] = UNIT_LABELS[unit]
+    st.session_state.pop(f"{key_prefix}cost_assessment", None)
+
+def preview_count_query(dataset_query: Dict[str, Any]) -> Dict[str, Any]:
+    """行をそのまま返すプレビューの件数を数えるクエリ。"""
+    query = dataset_query["query"]
+    count_query = {**dataset_query, "query": {k: v for k, v in query.items() if k in ("source-table", "filter", "joins")}}
+    count_query["query"]["aggregation"] = [["count"]]
+    return count_query
+
+def preview_limited_query(dataset_query: Dict[str, Any], cap: int) -> Dict[str, Any]:
+    """集約クエリのプレビュー。打ち切りの有無を判定するため上限+1行を取得する。"""
+    query = dataset_query["query"]
+    return {**dataset_query, "query": {**query, "limit": min(query.get("limit", cap + 1), cap + 1)}}
+
+def is_preview_cached(dataset_query: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> bool:
+    """execute_preview_query の結果がすべてクエリキャッシュにあり、Metabase・分析用DBに問い合わせずに済むか。"""
+    query = dataset_query["query"]
+    context = context or get_query_context(query.get("source-table"))
+    cache, cap = context["cache"], get_preview_row_cap(query, context)
+    if not is_raw_row_query(query):
+        return cache.contains(query_cache_key(preview_limited_query(dataset_query, cap)))
+    count_key = query_cache_key(preview_count_query(dataset_query))
+    if not cache.contains(count_key):
+        return False
+    count_rows = result_rows(cache.get(count_key) or {})
+    total = count_rows[0][0] if count_rows else None
+    if total is not None and total <= cap:
+        return cache.contains(query_cache_key(dataset_query))
+    return cache.contains(query_cache_key(dataset_query) + f":sample={cap}")
+
+def execute_preview_query(session_id: str, dataset_query: Dict[str, Any], report_errors: bool = True,
+                          context: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    プレビュー用にクエリを実行し、(結果, サンプリング情報) を返す。
+    列数に応じた行数上限を超える場合、行をそのまま返すクエリは件数を数えたうえでサンプリングし、
+    集約クエリは上限行で打ち切る。サンプリング情報は {"shown", "total", "method"} (total は不明なら None)。
+    保存するカードには元の dataset_query を使うため、この関数の制限は影響しない。
+    """
+    query = dataset_query["query"]
+    context = context or get_query_context(query.get("source-table"))
+    cap = get_preview_row_cap(query, context)
+
+    if is_raw_row_query(query):
+        count_result = execute_query(session_id, preview_count_query(dataset_query), prefer_direct=True, report_errors=report_errors, context=context)
+        count_rows = result_rows(count_result) if count_result and count_result.get('status') == 'completed' else []
+        total = count_rows[0][0] if count_rows else None
+        if total is not None and total <= cap:
+            return execute_query(session_id, dataset_query, prefer_direct=True, report_errors=report_errors, context=context), None
+        sample = {"rows": cap, "total": total or cap}
+        result = execute_query(session_id, dataset_query, prefer_direct=True, report_errors=report_errors, sample=sample, context=context)
+        if not result or result.get('status') != 'completed':
+            return result, None
+        return result, {"shown": result.get("row_count", len(result_rows(result))), "total": total, "method": result.get("sample_method", "head")}
+
+    result = execute_query(session_id, preview_limited_query(dataset_query, cap), prefer_direct=True, report_errors=report_errors, context=context)
+    if not result or result.get('status') != 'completed' or result.get("row_count", 0) <= cap:
+        return result, None
+    return result, {"shown": cap, "total": None, "method": "head"}
+
+# この大きさ以下のエクスポートはブラウザからもダウンロードできるようにする
+EXPORT_DOWNLOAD_MAX_BYTES = 50 * 1024 * 1024
+
+def export_results(session_id: str, fmt: str, card_id: Optional[int] = None, dataset_query: Optional[Dict[str, Any]] = None,
+                   progress=None) -> Dict[str, Any]:
+    """
+    保存済みカード、またはビルダーのクエリの全件を exports/ 以下に書き出す。
+    ビルダーのクエリは直接接続できれば分析用DBから、できなければ Metabase のエクスポートAPIから受信する。
+    """
+    if card_id is not None:
+        return export_card(metabase_request, session_id, card_id, default_export_path(f"card_{card_id}", fmt), fmt, progress)
+    out_path = default_export_path("query", fmt)
+    engine = get_preview_engine()
+    table_id = dataset_query.get("query", {}).get("source-table")
+    table = next((t for t in st.session_state.get("tables_metadata") or [] if t['id'] == table_id), None)
+    if engine is not None and table is not None:
+        try:
+            return export_direct(engine, dataset_query, table, load_table_fields(table_id), out_path, fmt, progress)
+        except UnsupportedQueryError:
+            pass
+        except Exception as e:
+            print(f"Direct export failed, falling back to Metabase: {e}")
+    return export_query(metabase_request, session_id, dataset_query, out_path, fmt, progress)
+
+def display_export_form():
+    with st.expander("結果のエクスポート"):
+        preview_data = st.session_state.get('preview_data')
+        sources = ["保存済みカード"] + (["現在のプレビュー"] if preview_data else [])
+        source = st.radio("対象", sources, key="export_source", horizontal=True)
+        card_id = None
+        if source == "保存済みカード":
+            card_id = st.number_input("カードID", min_value=1, step=1, key="export_card_id")
+        fmt = st.selectbox("形式", EXPORT_FORMATS, key="export_format")
+        if st.button("全件をエクスポート", key="export_button"):
+            bar = st.progress(0.0, text="エクスポート中...")
+
+            def show_progress(p: Dict[str, Any]):
+                # 総行数は事前に分からないため、受信済みの行数と容量だけを表示する
+                bar.progress(1.0 if p["done"] else 0.5, text=f"{p['rows']:,} 行 / {p['bytes'] / 1e6:.1f} MB")
+
+            dataset_query = None if card_id is not None else preview_data['final_payload']['dataset_query']
+            try:
+                result = export_results(st.session_state.metabase_session_id, fmt, card_id=card_id and int(card_id),
+                                        dataset_query=dataset_query, progress=show_progress)
+            except (requests.exceptions.RequestException, OSError, RuntimeError) as e:
+                st.error(f"エクスポートに失敗しました: {e}")
+                return
+            add_log_entry("export_results", {"card_id": card_id and int(card_id), "format": fmt,
+                                             "rows": result["rows"], "bytes": result["bytes"]})
+            st.success(f"{result['rows']:,} 行を {result['path']} に書き出しました。")
+            if result["bytes"] <= EXPORT_DOWNLOAD_MAX_BYTES:
+                with open(result["path"], "rb") as f:
+                    st.download_button("ダウンロード", f.read(), file_name=os.path.basename(result["path"]), key="export_download")
+
+@st.cache_resource
+def get_preview_prefetcher() -> PreviewPrefetcher:
+    # 先読み用のスレッドプールは全セッションで共有する
+    return PreviewPrefetcher()
+
+def recent_created_queries() -> List[Dict[str, Any]]:
+    """このセッションの操作ログから、作成したグラフの種別とクエリを古い順に返す。"""
+    log = get_session_log().entries
+    return [{"display": e.get("card_type"), "query": e["dataset_query"].get("query", {})}
+            for e in log if e.get("action") == "create_view" and e.get("dataset_query")]
+
+def schedule_preview_prefetch(recommendations: List[str]):
+    """推薦されたグラフの初期設定のプレビューをバックグラウンドで実行し、クエリキャッシュに入れておく。"""
+    table_id = st.session_state.custom_builder_selections.get("table_id")
+    table = next((t for t in st.session_state.tables_metadata or [] if t['id'] == table_id), None)
+    if table is None:
+        return
+    displays = [REVERSE_CARD_DISPLAY_TYPE_MAPPING.get(view, view) for view in recommendations]
+    queries = candidate_queries(displays, table, load_table_fields(table_id), recent_created_queries())
+    session_id = st.session_state.metabase_session_id
+    # 先読みはキャッシュに結果を入れるだけなので、必要な値をここで取り出し、スレッドには Streamlit のコンテキストを渡さない
+    # (スクリプトの実行が終わるとコンテキストは古くなる)
+    context = get_query_context(table_id, background=True)
+
+    def to_dataset_query(query: Dict[str, Any]) -> Dict[str, Any]:
+        return {"type": "query", "database": table['db_id'], "query": query}
+
+    # キャッシュ済みのものは先読みせず、前面ならコストの判定で止めるクエリも先読みしない
+    queries = [q for q in queries if not is_preview_cached(to_dataset_query(q), context)
+               and assess_preview_cost(to_dataset_query(q))["level"] != "block"]
+
+    def run(query: Dict[str, Any]):
+        begin_action("prefetch_preview", table_id=table_id)
+        execute_preview_query(session_id, to_dataset_query(query), report_errors=False, context=context)
+
+    get_preview_prefetcher().schedule(get_prefetch_key(), queries, run, key=lambda q: query_cache_key(to_dataset_query(q)))
+
+def get_prefetch_key() -> str:
+    if "prefetch_key" not in st.session_state:
+        st.session_state.prefetch_key = uuid.uuid4().hex
+    return st.session_state.prefetch_key
+
 # --- RotatEモデル用関数 ---
 @st.cache_resource
 def load_kge_model_and_data():
@@ -412,7 +812,7 @@ def get_all_available_fields(selections: Dict) -> List[Dict]:
         join_alias = join["join_alias"]
         target_table = next((tbl for tbl in st.session_state.tables_metadata if tbl['id'] == join['target_table_id']), None)
         if target_table:
-            for field in target_table.get("fields", []):
+            for field in load_table_fields(target_table['id']):
                 field_copy = field.copy()
                 field_copy['mbql_ref'] = ["field", field['id'], {"join-alias": join_alias}]
                 field_copy['display_name_with_table'] = f"{target_table['display_name']} ({join_alias}) -> {field['display_name']}"
@@ -426,7 +826,7 @@ def handle_table_selection(selections: Dict, key_prefix: str):
         selected_table = table_options[selected_table_name]
         selections.update({
             "table_id": selected_table['id'], "table_name": selected_table_name,
-            "available_fields": selected_table.get('fields', []),
+            "available_fields": load_table_fields(selected_table['id']),
             "joins": [], "filters": [], "aggregation": [], "breakout_id": None
         })
     else:
@@ -447,7 +847,8 @@ def handle_custom_chart_submission(payload: Dict[str, Any], size_key: str):
             log_details = {
                 "card_name": payload['name'],
                 "card_type": payload['display'],
-                "task_duration_sec": task_duration
+                "task_duration_sec": task_duration,
+                "dataset_query": payload['dataset_query']
             }
             if st.session_state.pending_recommendation:
                 log_details["recommendation_source"] = "recommendation"
@@ -470,6 +871,7 @@ def handle_custom_chart_submission(payload: Dict[str, Any], size_key: str):
             st.session_state.pending_recommendation = None
             if 'recommendations' in st.session_state:
                 del st.session_state.recommendations
+            get_preview_prefetcher().cancel(get_prefetch_key())
             time.sleep(2)
             st.rerun()
 
@@ -514,11 +916,27 @@ def display_add_filter_form(selections: Dict, all_fields: List[Dict] = None, key
         operator_map = {"である": "=", "ではない": "!=", "より大きい": ">", "より小さい": "<", "以上": ">=", "以下": "<=", "範囲": "between", "空": "is-null", "空ではない": "not-null"}
         new_filter_op_name = cols[1].selectbox("条件", operator_map.keys(), index=None, key=f"{key_prefix}new_filter_op")
         new_filter_value1, new_filter_value2 = None, None
+        # 選択した列の統計 (値の範囲・よく出る値) を入力の手がかりとして表示する。結合先の列は対象外
+        column_stats, selected_field = None, field_options.get(new_filter_field_display_name)
+        if selected_field and selected_field['mbql_ref'][2] is None and selections.get('table_id'):
+            column_stats = get_column_stats(selections['table_id'], selected_field['id'], with_top_values=not is_ranged(selected_field))
+        if column_stats:
+            hints = []
+            if column_stats['min'] is not None:
+                hints.append(f"範囲: {column_stats['min']} 〜 {column_stats['max']}")
+            if column_stats['distinct'] is not None:
+                hints.append(f"異なる値: 約{column_stats['distinct']:,}件")
+            hints.append(f"空: {column_stats['null_count']:,}件")
+            st.caption(" / ".join(hints))
+        top_values = [str(v) for v, _ in column_stats['top_values'] if v is not None] if column_stats and column_stats['top_values'] else []
         if new_filter_op_name and operator_map[new_filter_op_name] not in ["is-null", "not-null"]:
             if operator_map[new_filter_op_name] == "between":
                 val_cols = st.columns(2)
                 new_filter_value1 = val_cols[0].text_input("開始値", key=f"{key_prefix}new_filter_value1")
                 new_filter_value2 = val_cols[1].text_input("終了値", key=f"{key_prefix}new_filter_value2")
+            elif operator_map[new_filter_op_name] in ["=", "!="] and top_values:
+                # よく出る値から選択できるようにする (一覧にない値も入力可能)
+                new_filter_value1 = st.selectbox("値", top_values, index=None, accept_new_options=True, key=f"{key_prefix}new_filter_value1")
             else:
                 new_filter_value1 = st.text_input("値", key=f"{key_prefix}new_filter_value1")
         
@@ -547,7 +965,7 @@ def display_existing_joins(selections: Dict, key_prefix: str = ""):
             base_field = next((f for f in selections['available_fields'] if f['id'] == join['condition'][1][1]), None)
             target_table = next((t for t in st.session_state.tables_metadata if t['id'] == join['target_table_id']), None)
             if target_table:
-                target_field = next((f for f in target_table['fields'] if f['id'] == join['condition'][2][1]), None)
+                target_field = next((f for f in load_table_fields(target_table['id']) if f['id'] == join['condition'][2][1]), None)
                 if base_field and target_field:
                     join_type_display = JOIN_STRATEGY_DISPLAY_MAP.get(join['strategy'], join['strategy'])
                     join_str = (f"**{selections['table_name']}** に **{join_type_display}** で **{join['target_table_name']}** を結合"
@@ -568,7 +986,7 @@ def display_join_builder(selections: Dict, key_prefix: str = ""):
             base_fields = {f['display_name']: f['id'] for f in selections['available_fields']}
             base_field_name = cols[0].selectbox(f"{selections['table_name']} の列", base_fields.keys(), index=None, key=f"{key_prefix}join_base_field")
             cols[1].markdown("<p style='text-align: center; font-size: 24px; margin-top: 25px'>=</p>", unsafe_allow_html=True)
-            target_fields = {f['display_name']: f['id'] for f in target_table['fields']}
+            target_fields = {f['display_name']: f['id'] for f in load_table_fields(target_table['id'])}
             target_field_name = cols[2].selectbox(f"{target_table_name} の列", target_fields.keys(), index=None, key=f"{key_prefix}join_target_field")
             if st.button("結合を追加", key=f"{key_prefix}add_join_button"):
                 if base_field_name and target_field_name and join_type_display_name:
@@ -783,52 +1201,22 @@ def display_custom_chart_form():
                     data_max = 100.0 # デフォルト
                     
                     if selections.get('table_id'):
-                        # 集計対象のフィールドを取得
-                        target_field_id = None
-                        if agg_field_ref:
-                             # agg_field_ref is ["field", id, options]
-                             target_field_id = agg_field_ref[1]
-                        
-                        # クエリ構築
-                        stats_query = {
-                            "type": "query",
-                            "database": next((t['db_id'] for t in st.session_state.tables_metadata if t['id'] == selections['table_id']), None),
-                            "query": {
-                                "source-table": selections['table_id'],
-                                "aggregation": []
-                            }
-                        }
-                        
-                        if agg_type_name == "行のカウント":
-                            # Countの場合: Min=0, Max=Count(*)
-                            stats_query["query"]["aggregation"] = [["count"]]
-                            # Countの結果がMaxになる
-                        elif target_field_id:
-                            # フィールド集計の場合: Min=min(field), Max=max(field)
-                            # ただし、Sumの場合は合計値がMaxになるべきだが、ここでは「データの範囲」として
-                            # カラム自体のMin/Maxを取得する（ユーザーの要望「集計対象データの最小値、最大値」）
-                            # もし「売上合計」のゲージなら、0〜売上合計 が適切かもしれないが、
-                            # ここではカラムの統計値を取得する。
-                            stats_query["query"]["aggregation"] = [["min", agg_field_ref], ["max", agg_field_ref]]
-                        
-                        # 実行 (キャッシュなどを考慮しつつ)
-                        # ここでは簡易的に毎回実行（軽量なはず）
-                        try:
-                            with st.spinner("データの統計情報を取得中..."):
-                                stats_result = execute_query(st.session_state.metabase_session_id, stats_query)
-                                if stats_result and stats_result.get('status') == 'completed' and stats_result['data']['rows']:
-                                    row = stats_result['data']['rows'][0]
-                                    if agg_type_name == "行のカウント":
-                                        data_min = 0.0
-                                        data_max = float(row[0])
-                                    else:
-                                        # Min/Max
-                                        if len(row) >= 2:
-                                            data_min = float(row[0]) if row[0] is not None else 0.0
-                                            data_max = float(row[1]) if row[1] is not None else 100.0
-                        except Exception as e:
-                            # エラー時はデフォルト
-                            pass
+                        # 列の統計はテーブルの同期時刻ごとにキャッシュされるため、再描画のたびに集計し直さない
+                        with st.spinner("データの統計情報を取得中..."):
+                            if agg_type_name == "行のカウント":
+                                # Countの場合: Min=0, Max=行数
+                                table_stats = get_column_stats(selections['table_id'])
+                                if table_stats and table_stats['row_count'] is not None:
+                                    data_max = float(table_stats['row_count'])
+                            elif agg_field_ref:
+                                # フィールド集計の場合: カラム自体のMin/Maxを「集計対象データの範囲」とする
+                                column_stats = get_column_stats(selections['table_id'], agg_field_ref[1])
+                                if column_stats:
+                                    try:
+                                        data_min = float(column_stats['min']) if column_stats['min'] is not None else 0.0
+                                        data_max = float(column_stats['max']) if column_stats['max'] is not None else 100.0
+                                    except (TypeError, ValueError):
+                                        pass
 
                     # マージンを持たせる
                     if data_max == data_min: data_max += 100
@@ -922,8 +1310,18 @@ def display_custom_chart_form():
                         selections['gauge_segments'] = segments
             st.markdown("---")
             st.selectbox('カードサイズを選択', list(SIZE_MAPPING.keys()), key=f'{key_prefix}card_size_selection')
+            cost_assessment = st.session_state.get(f"{key_prefix}cost_assessment")
+            if cost_assessment and cost_assessment["messages"]:
+                show = st.error if cost_assessment["level"] == "block" else st.warning
+                show("\n\n".join(cost_assessment["messages"]))
+                for field_id, unit in cost_assessment["suggested_unit"].items():
+                    st.button(f"時間粒度を「{UNIT_LABELS[unit]}」に変更する", key=f"{key_prefix}apply_granularity_{field_id}",
+                              on_click=apply_suggested_granularity, args=(key_prefix, unit))
+                if cost_assessment["level"] == "block":
+                    st.checkbox("警告を確認したうえでプレビューを実行する", key=f"{key_prefix}cost_override")
             col1, col2 = st.columns(2)
             if col1.button("プレビュー", key=f"{key_prefix}preview_button"):
+                begin_action("preview", chart_type=chart_display_name)
                 table_id = selections['table_id']
                 selected_table = next((tbl for tbl in st.session_state.tables_metadata if tbl['id'] == table_id), None)
                 all_fields = get_all_available_fields(selections)
@@ -1096,17 +1494,27 @@ def display_custom_chart_form():
                     query["order-by"] = [["desc", ["aggregation", 0]]]
 
                 dataset_query = {"type": "query", "database": selected_table['db_id'], "query": query}
-                with st.spinner("プレビューデータを取得中..."):
-                    result = execute_query(st.session_state.metabase_session_id, dataset_query)
+                # 同じクエリを先読み中なら二重に送らず、完了を待ってキャッシュの結果を使う
+                get_preview_prefetcher().wait_for(query_cache_key(dataset_query))
+                if is_preview_cached(dataset_query):
+                    # キャッシュ済みの結果は問い合わせないため、コストの推定 (EXPLAIN・列の統計) も省く
+                    st.session_state.pop(f"{key_prefix}cost_assessment", None)
+                else:
+                    # 高コストなプレビューは Metabase に送る前に止める (全利用者の応答が遅くなるため)
+                    cost_assessment = assess_preview_cost(dataset_query)
+                    st.session_state[f"{key_prefix}cost_assessment"] = cost_assessment
+                    if cost_assessment["level"] == "block" and not st.session_state.get(f"{key_prefix}cost_override"):
+                        add_log_entry("preview_blocked", {"chart_type": chart_display_name, "query": query,
+                                                          "estimate": cost_assessment["estimate"], "messages": cost_assessment["messages"]})
+                        st.rerun()
+                with st.spinner("プレビューデータを取得中..."), get_preview_prefetcher().foreground():
+                    result, sample_info = execute_preview_query(st.session_state.metabase_session_id, dataset_query)
                 if result and result.get('status') == 'completed':
                     result_cols = result['data']['cols']
-                    display_names = [c['display_name'] for c in result_cols]
                     internal_names = [c['name'] for c in result_cols]
-                    unique_display_names = _deduplicate_columns(display_names)
-                    # Altair/Streamlit fails if column names contain colons (interpreted as type encoding)
-                    # Sanitize column names by replacing colons with underscores
-                    unique_display_names = [col.replace(':', '_') for col in unique_display_names]
-                    df = pd.DataFrame(result['data']['rows'], columns=unique_display_names)
+                    unique_display_names = preview_column_names(result_cols)
+                    # 集約クエリは打ち切り判定のため1行多く取得しているので、表示する行数までに絞る
+                    df = result_to_frame(result, unique_display_names, max_rows=sample_info['shown'] if sample_info else None)
                     
                     if chart_display_name == "ピボットテーブル":
                         num_rows = len(selections.get('pivot_rows', []))
@@ -1232,7 +1640,7 @@ def display_custom_chart_form():
                         "dataset_query": dataset_query,
                         "visualization_settings": viz_settings
                     }
-                    st.session_state.preview_data = {'df': df, 'chart_type': CHART_TYPE_MAP.get(chart_display_name), 'final_payload': final_payload, **preview_extras}
+                    st.session_state.preview_data = {'df': df, 'chart_type': CHART_TYPE_MAP.get(chart_display_name), 'final_payload': final_payload, 'sample_info': sample_info, **preview_extras}
                     st.rerun()
                 else:
                     st.error("プレビューデータの取得に失敗しました。")
@@ -1247,6 +1655,13 @@ def display_custom_chart_form():
         preview_data = st.session_state.preview_data
         df = preview_data['df']
         chart_type = preview_data['chart_type']
+        sample_info = preview_data.get('sample_info')
+        if sample_info:
+            if sample_info['total'] is None:
+                st.caption(f"⚠️ プレビューは先頭 {sample_info['shown']:,} 行のみ表示しています（作成されるグラフには全件が含まれます）。")
+            else:
+                method = "無作為抽出" if sample_info['method'] == "random" else "先頭から"
+                st.caption(f"⚠️ サンプル表示: 全 {sample_info['total']:,} 行中 {sample_info['shown']:,} 行（{method}）。作成されるグラフには全件が含まれます。")
         if not df.empty:
             if len(df.columns) < 1:
                     st.warning("プレビュー対象の列がありません。")
@@ -1259,9 +1674,12 @@ def display_custom_chart_form():
                         else:
                             x_col = df.columns[0]
                             y_cols = list(df.columns[1:])
-                            if chart_type == "bar": st.bar_chart(df, x=x_col, y=y_cols)
-                            elif chart_type == "line": st.line_chart(df, x=x_col, y=y_cols)
-                            elif chart_type == "area": st.area_chart(df, x=x_col, y=y_cols)
+                            plot_df, original_rows = downsample_for_chart(df, chart_type)
+                            if original_rows:
+                                st.caption(f"描画点数を {original_rows:,} 点から {len(plot_df):,} 点に間引いています。")
+                            if chart_type == "bar": st.bar_chart(plot_df, x=x_col, y=y_cols)
+                            elif chart_type == "line": st.line_chart(plot_df, x=x_col, y=y_cols)
+                            elif chart_type == "area": st.area_chart(plot_df, x=x_col, y=y_cols)
                     elif chart_type == "pie":
                         if len(df.columns) == 2:
                             fig = px.pie(df, names=df.columns[0], values=df.columns[1], title="円グラフプレビュー")
@@ -1276,8 +1694,10 @@ def display_custom_chart_form():
                         else:
                             x_col = df.columns[0]
                             y_col = df.columns[1]
-                            st.scatter_chart(df, x=x_col, y=y_col)
-                            st.scatter_chart(df, x=x_col, y=y_col)
+                            plot_df, original_rows = downsample_for_chart(df, chart_type)
+                            if original_rows:
+                                st.caption(f"描画点数を {original_rows:,} 点から {len(plot_df):,} 点に間引いています（密度を保つ格子サンプリング）。")
+                            st.scatter_chart(plot_df, x=x_col, y=y_col)
                     elif chart_type == "waterfall":
                         if len(df.columns) >= 2:
                             try:
@@ -1337,6 +1757,7 @@ def display_custom_chart_form():
             st.info("クエリは成功しましたが、結果は0件でした。")
         st.markdown("---")
         if st.button("作成してダッシュボードに追加", type="primary", key=f"{key_prefix}add_to_dashboard_button"):
+            begin_action("create_view", chart_type=selections.get('chart_display_name'))
             add_log_entry("click_create_view", {
                 "dashboard_id": st.session_state.dashboard_id,
                 "chart_type": selections.get('chart_display_name'),
@@ -1351,6 +1772,7 @@ def display_credentials_form():
         dashboard_id, secret_key = st.text_input("Dashboard ID"), st.text_input("Secret Key", type="password")
         use_recommendation = st.checkbox("推薦機能を使用する", value=True)
         if st.form_submit_button("接続"):
+            begin_action("login")
             session_id = get_metabase_session(username, password)
             if session_id:
                 st.session_state.update(metabase_session_id=session_id, dashboard_id=dashboard_id, secret_key=secret_key, use_recommendation=use_recommendation, username=username)
@@ -1381,7 +1803,7 @@ def display_table_selection_form():
             st.session_state.custom_builder_selections.update({
                 "table_id": selected_table['id'], 
                 "table_name": selected_table_name,
-                "available_fields": selected_table.get('fields', []),
+                "available_fields": load_table_fields(selected_table['id']),
                 "joins": [], "filters": [], "aggregation": [], "breakout_id": None
             })
             st.session_state.table_selected = True
@@ -1420,6 +1842,8 @@ def embed_dashboard():
 
 def main():
     st.set_page_config(layout="wide"); st.title("ダッシュボードビュー推薦システム (RotatE版)")
+    # このリランで発生するMetabaseリクエストをユーザー操作に紐付ける (ボタン操作時は個別の操作名で上書きする)
+    begin_action("rerun", user_id=st.session_state.get("username", "unknown"), dashboard_id=st.session_state.get("dashboard_id", ""))
     # ダイアログの「☓」ボタンを非表示にするCSS（グローバルに適用）
     st.markdown("""
         <style>
@@ -1484,7 +1908,7 @@ def main():
                     st.session_state.custom_builder_selections.update({
                         "table_id": selected_table['id'], 
                         "table_name": selected_table_name,
-                        "available_fields": selected_table.get('fields', []),
+                        "available_fields": load_table_fields(selected_table['id']),
                         "joins": [], "filters": [], "aggregation": [], "breakout_id": None
                     })
                     st.session_state.table_selected = True
@@ -1493,13 +1917,30 @@ def main():
             else:
                 st.error("テーブル情報がありません")
 
+            display_export_form()
+
             st.divider()
             st.header("Debug Info")
             if st.button("ログアウト"):
                 add_log_entry("logout", {})
+                get_preview_prefetcher().cancel(get_prefetch_key())
                 st.session_state.metabase_session_id = None
                 st.session_state.table_selected = False
                 st.rerun()
+            if st.checkbox("Metabase API の状態を表示"):
+                st.json(get_api_guard().metrics())
+                st.json({"query_cache": get_query_cache().stats()})
+                st.json({"preview_prefetch": get_preview_prefetcher().stats()})
+                st.json({"log_writer": get_log_writer().stats()})
+                engine = get_preview_engine()
+                if engine is not None:
+                    st.json({"aggregate_cubes": engine.router.stats()})
+                    if st.button("集計キューブを再計算"):
+                        refreshed = CubeBuilder(engine).refresh()
+                        engine.router.invalidate()
+                        get_query_cache().clear()
+                        st.success(f"{refreshed} 個のキューブを再計算しました。")
+                st.code(get_request_tracer().to_prometheus(), language="text")
             if st.checkbox("取得済みテーブル一覧を表示"):
                 if st.session_state.tables_metadata:
                     st.json([{"id": t['id'], "name": t['name'], "display_name": t['display_name']} for t in st.session_state.tables_metadata])
@@ -1515,7 +1956,7 @@ def main():
              st.session_state.custom_builder_selections.update({
                 "table_id": first_table['id'], 
                 "table_name": first_table['display_name'],
-                "available_fields": first_table.get('fields', []),
+                "available_fields": load_table_fields(first_table['id']),
                 "joins": [], "filters": [], "aggregation": [], "breakout_id": None
             })
              st.session_state.table_selected = True
@@ -1551,6 +1992,7 @@ def main():
                                 with st.container(border=True):
                                     st.markdown(f"**{card_name}**")
                                     if st.button("🗑️ 削除", key=f"delete_dashcard_{dashcard_id}", use_container_width=True):
+                                        begin_action("delete_view")
                                         log_details = {"card_name": card_name, "dashcard_id": dashcard_id}
                                         task_start = time.time()
                                         with st.spinner("カードを削除中..."):
@@ -1571,6 +2013,22 @@ def main():
                                         else:
                                             st.error("カードの削除に失敗しました。")
                             col_index += 1
+                        if st.button("↑ カードを上に詰める", key="compact_dashboard_button", help="削除などで空いた隙間をなくします"):
+                            begin_action("compact_dashboard")
+                            with st.spinner("ダッシュボードを整理中..."):
+                                moved = compact_dashboard(st.session_state.metabase_session_id, dashboard_id)
+                            if moved is not None:
+                                add_log_entry("compact_dashboard", {"dashboard_id": dashboard_id, "moved_cards": moved})
+                                st.rerun()
+                        use_size_evidence = st.checkbox("推薦データのサイズを使う", key="layout_use_size_evidence",
+                                                        help="各グラフの種類で最もよく使われるサイズ (S/M/L) に揃えて並べ直します")
+                        if st.button("レイアウトを最適化", key="optimize_layout_button", help="全体の高さを小さくし、同じテーブルのカードを隣り合わせに並べ直します"):
+                            begin_action("optimize_layout")
+                            with st.spinner("レイアウトを最適化中..."):
+                                layout_result = optimize_dashboard_layout(st.session_state.metabase_session_id, dashboard_id, use_size_evidence)
+                            if layout_result is not None:
+                                add_log_entry("optimize_layout", {"dashboard_id": dashboard_id, "use_size_evidence": use_size_evidence, **layout_result})
+                                st.rerun()
                     
                     if st.session_state.recommendations is None:
                         if current_views_types and st.session_state.get('use_recommendation', True): 
@@ -1584,6 +2042,7 @@ def main():
                             add_log_entry("generate_recommendations", log_details)
                             if recommendations:
                                 st.session_state.recommendations = recommendations
+                                schedule_preview_prefetch(recommendations)
                                 st.rerun() 
                             else:
                                 st.info("推薦できるビューはありませんでした。")
@@ -1681,22 +2140,20 @@ def main():
 
             st.markdown("---")
             st.subheader("📊 操作ログ")
-            ss = SessionStorage()
-            current_log = ss.getItem('operation_log')
-            if current_log:
+            session_log = get_session_log()
+            if session_log.entries:
                 try:
-                    log_data_json = json.dumps(current_log, indent=2, ensure_ascii=False)
+                    log_data_json = json.dumps(session_log.entries, indent=2, ensure_ascii=False)
                     st.download_button(
                         label="操作ログをダウンロード (.json)",
                         data=log_data_json,
                         file_name=f"metabase_app_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                         mime="application/json",
                         use_container_width=True,
-                        on_click=add_log_entry,
-                        args=("finish_dashboard_creation", {})
+                        on_click=finish_dashboard_creation
                     )
                     with st.expander("最新のログを表示 (最新5件)"):
-                        st.json(current_log[-5:])
+                        st.json(session_log.tail(5))
                 except Exception as e:
                     st.error(f"ログのシリアル化に失敗しました: {e}")
             else:
@@ -0,0 +1,146 @@
+"""
+Offline throughput/latency benchmark of the app's Metabase access layer against fake_metabase.
+
+    python benchmark_client.py --iterations 200 --concurrency 8 --latency-ms 20 --rows 10000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from api_guard import ApiGuard, ENDPOINT_LIMITS
+from fake_metabase import FakeMetabase, load_recordings
+from metabase_session import TokenManager
+from metadata_cache import MetadataCache
+from request_tracing import RequestTracer, begin_action
+from result_decoder import decode_json, preview_column_names, result_to_frame
+
+DASHBOARD_ID = 1
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_case(name: str, fn: Callable[[int], None], iterations: int, concurrency: int) -> Dict:
+    latencies = []
+
+    def timed(i):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - start
+    return {
+        "case": name,
+        "iterations": iterations,
+        "throughput_rps": iterations / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def build_preview_frame(content: bytes):
+    # Same steps as the preview path in app.display_custom_chart_form
+    result = decode_json(content)
+    return result_to_frame(result, preview_column_names(result["data"]["cols"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Metabase client layer against a fake Metabase")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--fields", type=int, default=30)
+    parser.add_argument("--recordings", help="JSON file of recorded responses")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the ApiGuard token buckets")
+    args = parser.parse_args()
+
+    latency = {name: args.latency_ms for name in ENDPOINT_LIMITS}
+    recordings = load_recordings(args.recordings) if args.recordings else None
+    work_dir = tempfile.mkdtemp(prefix="benchmark_client_")
+
+    with FakeMetabase(latency_ms=latency, num_tables=args.tables, num_fields=args.fields,
+                      num_rows=args.rows, recordings=recordings) as fake:
+        token_manager = TokenManager(fake.url, cache_file=os.path.join(work_dir, "tokens.json"))
+        limits = ENDPOINT_LIMITS
+        if args.no_rate_limit:
+            limits = {name: {**cfg, "rate": 1e9, "capacity": 10 ** 9} for name, cfg in ENDPOINT_LIMITS.items()}
+        guard = ApiGuard(limits)
+        tracer = RequestTracer(snapshot_file=os.path.join(work_dir, "metrics_snapshots.jsonl"),
+                               prometheus_file=os.path.join(work_dir, "metabase_metrics.prom"))
+
+        def send(method, path, session_id, **kwargs):
+            return guard.request(token_manager.request, method, path, session_id, **kwargs)
+
+        def request(method, path, session_id, **kwargs):
+            return tracer.request(send, method, path, session_id, **kwargs)
+
+        session_id = token_manager.get_token("bench", "bench")
+        metadata = MetadataCache(fake.url, cache_dir=os.path.join(work_dir, "metadata"), request=request)
+        db_id = metadata.get_target_database_id(session_id)
+        table_ids = [t["id"] for t in metadata.get_table_index(session_id, db_id)]
+        dataset_query = {"type": "query", "database": db_id, "query": {"source-table": table_ids[0], "aggregation": [["count"]], "breakout": [["field", 1, None]]}}
+
+        def cold_login(i):
+            TokenManager(fake.url, cache_file=os.path.join(work_dir, f"cold_{i}.json")).get_token("bench", "bench")
+
+        def dashboard(i):
+            request("GET", f"/api/dashboard/{DASHBOARD_ID}", session_id).raise_for_status()
+
+        def add_card(i):
+            # Same request sequence as app.add_card_to_dashboard
+            card = request("POST", "/api/card", session_id, json={"name": f"bench {i}", "display": "bar", "dataset_query": dataset_query, "visualization_settings": {}})
+            card.raise_for_status()
+            dashboard_data = request("GET", f"/api/dashboard/{DASHBOARD_ID + 1}", session_id).json()
+            dashcards = dashboard_data.get("dashcards", []) + [{"id": -1, "card_id": card.json()["id"], "col": 0, "row": 0, "size_x": 8, "size_y": 5}]
+            request("PUT", f"/api/dashboard/{DASHBOARD_ID + 1}", session_id, json={"name": dashboard_data["name"], "dashcards": dashcards}).raise_for_status()
+
+        def full_metadata(i):
+            request("GET", f"/api/database/{db_id}/metadata?include_hidden=true", session_id).raise_for_status()
+
+        def cached_table(i):
+            metadata.get_table(session_id, db_id, table_ids[i % len(table_ids)])
+
+        def query(i):
+            response = request("POST", "/api/dataset", session_id, json=dataset_query)
+            response.raise_for_status()
+            build_preview_frame(response.content)
+
+        cases = [
+            ("login (no cache)", cold_login),
+            ("login (cached token)", lambda i: token_manager.get_token("bench")),
+            ("GET dashboard", dashboard),
+            ("create card + PUT dashboard", add_card),
+            ("GET full metadata", full_metadata),
+            ("table fields (metadata cache)", cached_table),
+            (f"dataset + DataFrame ({args.rows} rows)", query),
+        ]
+        results = []
+        for name, fn in cases:
+            begin_action(name)
+            results.append(run_case(name, fn, args.iterations, args.concurrency))
+
+    print(f"{'case':<36}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['case']:<36}{r['throughput_rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+    print("\nApiGuard metrics:")
+    for name, values in guard.metrics().items():
+        print(f"  {name}: {values}")
+    tracer.flush()
+    print(f"\nRequest traces written to {tracer.snapshot_file}")
+
+
+if __name__ == "__main__":
+    main()
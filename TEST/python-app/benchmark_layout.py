@@ -0,0 +1,58 @@
+"""
+Benchmark of multi-card dashboard layouts: first-fit placement (the app's add_card_to_dashboard order)
+against the grouped bottom-left layout of optimize_layout, reporting total height, separated groups of related
+cards, and packing time by card count.
+
+    python benchmark_layout.py --cards 10 25 50 100 200
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List
+
+from dashboard_layout import PlacementEngine
+from layout_optimizer import layout_cost, optimize_layout
+
+# SIZE_MAPPING in app.py (S / M / L)
+CARD_SIZES = [(8, 5), (12, 10), (16, 10)]
+SIZE_WEIGHTS = [0.3, 0.5, 0.2]
+
+
+def make_cards(num_cards: int, seed: int, num_groups: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    cards = []
+    for i in range(num_cards):
+        width, height = rng.choices(CARD_SIZES, weights=SIZE_WEIGHTS)[0]
+        cards.append({"key": i, "width": width, "height": height, "group": rng.randrange(num_groups)})
+    return cards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard layout optimizer")
+    parser.add_argument("--cards", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--groups", type=int, default=5, help="number of related-card groups (e.g. source tables)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'cards':>6} | {'first-fit h':>11} {'sep':>4} | {'optimized h':>11} {'sep':>4} {'ms':>8} | {'lower bound':>11}")
+    for num_cards in args.cards:
+        cards = make_cards(num_cards, args.seed, args.groups)
+
+        # First fit in creation order, as cards are added one at a time today
+        engine = PlacementEngine([])
+        first_fit = engine.place_many([(c["width"], c["height"]) for c in cards])
+        _, ff_height, ff_separated = layout_cost(cards, first_fit)
+
+        start = time.perf_counter()
+        result = optimize_layout(cards)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if optimize_layout(cards)["placements"] != result["placements"]:
+            raise SystemExit(f"Non-deterministic layout for {num_cards} cards")
+
+        lower_bound = -(-sum(c["width"] * c["height"] for c in cards) // 24)
+        print(f"{num_cards:>6} | {ff_height:>11} {ff_separated:>4} | "
+              f"{result['height']:>11} {result['separated']:>4} {elapsed_ms:>8.1f} | {lower_bound:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of dashboard card placement: the previous brute-force find_empty_space against the
+summed-area-table PlacementEngine, on synthetic dashboards with hundreds of dashcards.
+
+    python benchmark_placement.py --cards 100 300 1000 --placements 20
+"""
+import argparse
+import random
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from dashboard_layout import GRID_COLUMNS, PlacementEngine, find_empty_space
+
+CARD_SIZES = [(4, 3), (6, 4), (8, 6), (12, 6), (12, 8), (24, 4), (6, 6), (18, 6)]
+
+
+def brute_force_find_empty_space(dashcards: List[Dict], card_width: int, card_height: int, grid_columns: int = 24) -> Tuple[int, int]:
+    # The implementation previously in app.py, kept as the reference for correctness and timing
+    if not dashcards:
+        return (0, 0)
+    max_row_so_far = max((c.get('row', 0) + c.get('size_y', 0)) for c in dashcards) if dashcards else 0
+    grid_height = max_row_so_far + card_height
+    grid_map = np.zeros((grid_height, grid_columns), dtype=int)
+    for card in dashcards:
+        col, row, width, height = card.get('col', 0), card.get('row', 0), card.get('size_x', 6), card.get('size_y', 4)
+        grid_map[row:row+height, col:col+width] = 1
+    for r in range(grid_height - card_height + 1):
+        for c in range(grid_columns - card_width + 1):
+            if np.sum(grid_map[r:r+card_height, c:c+card_width]) == 0:
+                return (r, c)
+    return (max_row_so_far, 0)
+
+
+def make_dashboard(num_cards: int, seed: int, hole_ratio: float = 0.1) -> List[Dict]:
+    """Pack cards like the app does, then delete a fraction of them to leave holes (removed cards)."""
+    rng = random.Random(seed)
+    sizes = [rng.choice(CARD_SIZES) for _ in range(num_cards)]
+    engine = PlacementEngine([])
+    cards = [{"id": i, "row": row, "col": col, "size_x": w, "size_y": h}
+             for i, ((w, h), (row, col)) in enumerate(zip(sizes, engine.place_many(sizes)))]
+    return [c for c in cards if rng.random() >= hole_ratio]
+
+
+def time_brute_force(dashcards: List[Dict], sizes: List[Tuple[int, int]]) -> Tuple[float, List[Tuple[int, int]]]:
+    # add_card_to_dashboard re-runs the search from scratch for every card
+    cards = list(dashcards)
+    slots = []
+    start = time.perf_counter()
+    for w, h in sizes:
+        row, col = brute_force_find_empty_space(cards, w, h)
+        cards.append({"row": row, "col": col, "size_x": w, "size_y": h})
+        slots.append((row, col))
+    return time.perf_counter() - start, slots
+
+
+def time_single(dashcards: List[Dict], sizes: List[Tuple[int, int]]) -> Tuple[float, List[Tuple[int, int]]]:
+    cards = list(dashcards)
+    slots = []
+    start = time.perf_counter()
+    for w, h in sizes:
+        row, col = find_empty_space(cards, w, h)
+        cards.append({"row": row, "col": col, "size_x": w, "size_y": h})
+        slots.append((row, col))
+    return time.perf_counter() - start, slots
+
+
+def time_batch(dashcards: List[Dict], sizes: List[Tuple[int, int]]) -> Tuple[float, List[Tuple[int, int]]]:
+    start = time.perf_counter()
+    slots = PlacementEngine(dashcards, GRID_COLUMNS).place_many(sizes)
+    return time.perf_counter() - start, slots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard card placement")
+    parser.add_argument("--cards", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--placements", type=int, default=20, help="cards to place on each dashboard")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'dashcards':>10} {'brute force ms':>15} {'SAT single ms':>14} {'SAT batch ms':>13} {'speedup':>9}")
+    for num_cards in args.cards:
+        dashcards = make_dashboard(num_cards, args.seed)
+        rng = random.Random(args.seed + num_cards)
+        sizes = [rng.choice(CARD_SIZES) for _ in range(args.placements)]
+        brute_sec, expected = time_brute_force(dashcards, sizes)
+        single_sec, single_slots = time_single(dashcards, sizes)
+        batch_sec, batch_slots = time_batch(dashcards, sizes)
+        if single_slots != expected or batch_slots != expected:
+            raise SystemExit(f"Placement mismatch on {num_cards} dashcards: {expected} != {single_slots} / {batch_slots}")
+        print(f"{len(dashcards):>10} {brute_sec * 1000:>15.1f} {single_sec * 1000:>14.2f} {batch_sec * 1000:>13.2f} "
+              f"{brute_sec / batch_sec:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Benchmark of the vectorized sessionization and metrics engine (session_metrics.py) against the per-event loops the
+analysis scripts used before (analyze_logs.analyze_sessions / calculate_metrics and the per-dashboard loop of
+analyze_multi_user_experiment.py), on synthetic operation logs. Both results are checked to be identical.
+
+    python benchmark_sessions.py --events 1000000 3000000
+    python benchmark_sessions.py --real   # also check equivalence on the logs under logs/
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from session_metrics import logs_to_frame, report_frame, session_metrics, sessionize, value_counts
+
+ACTIONS = ["select_table", "show_recommendations", "create_view", "create_view", "delete_view", "move_view"]
+SOURCES = ["recommendation", "custom", None]
+CARD_TYPES = ["bar", "line", "pie", "table", "scatter"]
+
+
+def make_logs(num_events: int, num_users: int, seed: int) -> List[Dict[str, Any]]:
+    """Interleaved sessions of several users; every session starts with a login, as the app logs it."""
+    rng = random.Random(seed)
+    clock = datetime(2025, 12, 1, 9, 0, 0)
+    logs = []
+    remaining = [0] * num_users
+    dashboards = [str(rng.randrange(1, 200)) for _ in range(num_users)]
+    for _ in range(num_events):
+        user = rng.randrange(num_users)
+        clock += timedelta(microseconds=rng.randrange(1, 2_000_000))
+        entry = {"timestamp": clock.isoformat(), "user_id": f"user{user}@example.com", "dashboard_id": dashboards[user],
+                 "recommendation_enabled": user % 2 == 0}
+        if remaining[user] == 0:
+            remaining[user] = rng.randrange(20, 400)
+            dashboards[user] = str(rng.randrange(1, 200))
+            entry.update(action="login", dashboard_id="")
+        else:
+            remaining[user] -= 1
+            entry["action"] = rng.choice(ACTIONS)
+            if entry["action"] == "create_view":
+                source = rng.choice(SOURCES)
+                if source is not None:
+                    entry["recommendation_source"] = source
+                entry["card_type"] = rng.choice(CARD_TYPES)
+                entry["task_duration_sec"] = rng.choice([0, None, round(rng.uniform(1, 120), 2)])
+        logs.append(entry)
+    return logs
+
+
+# --- The loops used by analyze_logs.py before session_metrics.py ---
+def legacy_analyze_sessions(logs):
+    logs.sort(key=lambda x: x['timestamp'])
+    sessions = {}
+    current_session_id = 0
+    for log in logs:
+        user_id = log.get('user_id', 'unknown')
+        timestamp = datetime.fromisoformat(log['timestamp'])
+        if log.get('action') == 'login':
+            current_session_id += 1
+        session_key = f"{user_id}_{current_session_id}"
+        if session_key not in sessions:
+            sessions[session_key] = {'user_id': user_id, 'start_time': timestamp, 'end_time': timestamp, 'events': [],
+                                     'rec_enabled': log.get('recommendation_enabled', True)}
+        session = sessions[session_key]
+        session['events'].append(log)
+        session['end_time'] = timestamp
+        if 'recommendation_enabled' in log:
+            session['rec_enabled'] = log['recommendation_enabled']
+    return sessions
+
+
+def legacy_calculate_metrics(sessions):
+    metrics = []
+    for session_id, data in sessions.items():
+        total = rec = custom = deleted = 0
+        durations_rec, durations_custom = [], []
+        for event in data['events']:
+            action = event.get('action')
+            if action == 'create_view':
+                total += 1
+                duration = event.get('task_duration_sec')
+                if event.get('recommendation_source', 'custom') == 'recommendation':
+                    rec += 1
+                    if duration: durations_rec.append(duration)
+                else:
+                    custom += 1
+                    if duration: durations_custom.append(duration)
+            elif action == 'delete_view':
+                deleted += 1
+        metrics.append({
+            'Session ID': session_id, 'User ID': data['user_id'], 'Rec Enabled': data['rec_enabled'],
+            'Start Time': data['start_time'], 'End Time': data['end_time'],
+            'Duration (sec)': (data['end_time'] - data['start_time']).total_seconds(),
+            'Total Views Created': total, 'Rec Views Created': rec, 'Custom Views Created': custom, 'Views Deleted': deleted,
+            'Avg Time Rec (sec)': sum(durations_rec) / len(durations_rec) if durations_rec else 0,
+            'Avg Time Custom (sec)': sum(durations_custom) / len(durations_custom) if durations_custom else 0,
+        })
+    return pd.DataFrame(metrics)
+
+
+# --- The per-dashboard loop of analyze_multi_user_experiment.py ---
+def legacy_dashboard_metrics(logs):
+    dashboard_sessions = {}
+    for log in logs:
+        dashboard_sessions.setdefault(str(log.get('dashboard_id')), []).append(log)
+    results = {}
+    for dash_id, events in dashboard_sessions.items():
+        events.sort(key=lambda x: x['timestamp'])
+        duration_sec = (datetime.fromisoformat(events[-1]['timestamp'])
+                        - datetime.fromisoformat(events[0]['timestamp'])).total_seconds()
+        views_created = rec_used = views_deleted = 0
+        chart_types = {}
+        for e in events:
+            if e.get('action') == 'create_view':
+                views_created += 1
+                if e.get('recommendation_source', 'custom') == 'recommendation':
+                    rec_used += 1
+                c_type = e.get('card_type', 'unknown')
+                chart_types[c_type] = chart_types.get(c_type, 0) + 1
+            elif e.get('action') == 'delete_view':
+                views_deleted += 1
+        results[dash_id] = (round(duration_sec / 60, 2), views_created, rec_used, views_deleted, chart_types)
+    return results
+
+
+def engine_dashboard_metrics(frame):
+    sessions = sessionize(frame, by=("dashboard_id",), split="none")
+    metrics = session_metrics(sessions)
+    charts = value_counts(sessions, "card_type")
+    return {row.session_id: (round(row.duration_sec / 60, 2), row.views_created, row.rec_views_created, row.views_deleted,
+                             charts[i])
+            for i, row in enumerate(metrics.itertuples())}
+
+
+def check_equal(logs: List[Dict[str, Any]]):
+    legacy = legacy_calculate_metrics(legacy_analyze_sessions(list(logs)))
+    engine = report_frame(session_metrics(sessionize(logs_to_frame(logs))))
+    pd.testing.assert_frame_equal(legacy.reset_index(drop=True), engine.reset_index(drop=True), check_dtype=False)
+    if legacy_dashboard_metrics(list(logs)) != engine_dashboard_metrics(logs_to_frame(logs)):
+        raise SystemExit("Per-dashboard metrics differ")
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized session metrics engine")
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 3_000_000])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real", action="store_true", help="check equivalence on the logs under logs/")
+    args = parser.parse_args()
+
+    if args.real:
+        from log_loader import load_logs
+        logs = load_logs()
+        check_equal(logs)
+        print(f"Real logs: {len(logs):,} entries, engine matches the legacy loops")
+    check_equal(make_logs(200_000, args.users, args.seed))
+    print("Synthetic logs (200,000 entries): engine matches the legacy loops")
+
+    # "from dicts" includes building the frame from load_logs() entries; "from frame" starts from a columnar frame
+    # such as event_store.load_events() returns
+    print(f"{'events':>10} | {'legacy s':>8} | {'to_frame s':>10} {'sessionize s':>12} {'metrics s':>9} | "
+          f"{'from dicts':>10} {'from frame':>10} | {'sessions':>8} | {'gap s':>5} {'dash s':>6}")
+    for num_events in args.events:
+        logs = make_logs(num_events, args.users, args.seed)
+        sessions_legacy, t_sessions = timed(legacy_analyze_sessions, list(logs))
+        legacy, t_metrics = timed(legacy_calculate_metrics, sessions_legacy)
+        del sessions_legacy
+
+        frame, t_frame = timed(logs_to_frame, logs)
+        del logs
+        sessions, t_sessionize = timed(sessionize, frame)
+        metrics, t_engine = timed(session_metrics, sessions)
+        pd.testing.assert_frame_equal(legacy, report_frame(metrics), check_dtype=False)
+        del sessions, legacy
+
+        _, t_gap = timed(lambda: session_metrics(sessionize(frame, by=("user_id", "dashboard_id"), split="login+gap")))
+        _, t_dash = timed(lambda: session_metrics(sessionize(frame, by=("dashboard_id",), split="none")))
+        legacy_total = t_sessions + t_metrics
+        engine_total = t_sessionize + t_engine
+        print(f"{num_events:>10,} | {legacy_total:>8.2f} | {t_frame:>10.2f} {t_sessionize:>12.2f} {t_engine:>9.2f} | "
+              f"{legacy_total / (t_frame + engine_total):>9.1f}x {legacy_total / engine_total:>9.1f}x | "
+              f"{len(metrics):>8,} | {t_gap:>5.2f} {t_dash:>6.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from preview_engine import quote_ident
+
+# 上位の値として保持する件数
+TOP_K = 10
+
+NUMERIC_TYPES = ("integer", "float", "double", "decimal")
+TEMPORAL_TYPES = ("date", "time", "timestamp")
+
+
+def _has_type(field: Dict[str, Any], types) -> bool:
+    return any(t in (field.get("base_type") or "").lower() for t in types)
+
+
+def is_ranged(field: Dict[str, Any]) -> bool:
+    """最小値・最大値を持つ列 (数値・日時) か。"""
+    return _has_type(field, NUMERIC_TYPES + TEMPORAL_TYPES)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+def fingerprint_distinct(field: Dict[str, Any]) -> Optional[int]:
+    """Metabase が同期時に記録した異なる値の数 (フィンガープリントの推定値)。なければ None。"""
+    return _to_int(((field.get("fingerprint") or {}).get("global") or {}).get("distinct-count"))
+
+
+def has_cheap_distinct(field: Dict[str, Any]) -> bool:
+    """正確な異なる値の数を集計しても負荷の小さい列 (数値・日時・真偽値)。文字列や JSON などの長い列は含めない。"""
+    return is_ranged(field) or _has_type(field, ("boolean",))
+
+
+class ColumnStatsService:
+    """
+    テーブルの全列について最小値・最大値・空の件数・おおよその異なる値の数・上位の値を計算し、
+    テーブルIDと最終同期時刻 (updated_at) をキーにプロセス内で共有する。
+    統計は1回のバッチクエリで取得する。直接接続 (PreviewEngine) があれば pg_stats の推定値を使い、
+    なければ Metabase の /api/dataset で集計する (この場合、上位の値は列ごとに必要になった時点で取得する)。
+    Metabase 経由の場合、異なる値の数はフィールドのフィンガープリントの推定値を使い、推定値がない列のうち
+    数値・日時・真偽値の列だけを集計する (文字列の列の COUNT(DISTINCT) は全件の比較になるため行わない)。
+    """
+
+    def __init__(self, request: Callable[..., requests.Response], engine: Optional[Any] = None, top_k: int = TOP_K):
+        # request(method, path, session_id, **kwargs) -> Response
+        self._request = request
+        self.engine = engine
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Dict[str, Any]] = {}  # table_id -> {"synced_at", "row_count", "columns"}
+        self.queries = 0
+
+    # --- 公開API ---
+    def get_table_stats(self, session_id: str, table: Dict[str, Any], fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """{"row_count": int, "columns": {field_id: {"min", "max", "null_count", "distinct", "top_values"}}} を返す。"""
+        with self._lock:
+            entry = self._entries.get(table["id"])
+            if entry is not None and entry["synced_at"] == table.get("updated_at"):
+                return entry
+        if self.engine is not None:
+            try:
+                entry = self._compute_direct(table, fields)
+            except Exception as e:
+                print(f"Direct column statistics failed, falling back to Metabase: {e}")
+                entry = self._compute_mbql(session_id, table, fields)
+        else:
+            entry = self._compute_mbql(session_id, table, fields)
+        entry["synced_at"] = table.get("updated_at")
+        with self._lock:
+            self._entries[table["id"]] = entry
+        return entry
+
+    def get_column_stats(self, session_id: str, table: Dict[str, Any], fields: List[Dict[str, Any]], field_id: int,
+                         with_top_values: bool = False) -> Optional[Dict[str, Any]]:
+        """1列分の統計。with_top_values=True の場合、未取得なら上位の値も取得する。"""
+        entry = self.get_table_stats(session_id, table, fields)
+        column = entry["columns"].get(field_id)
+        if column is not None and with_top_values and column["top_values"] is None:
+            field = next(f for f in fields if f["id"] == field_id)
+            column["top_values"] = self._fetch_top_values(session_id, table, field)
+        return column
+
+    def invalidate(self, table_id: Optional[int] = None):
+        with self._lock:
+            if table_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_id, None)
+
+    # --- Metabase 経由 ---
+    def _run_mbql(self, session_id: str, table: Dict[str, Any], query: Dict[str, Any]) -> Dict[str, Any]:
+        self.queries += 1
+        dataset_query = {"type": "query", "database": table["db_id"], "query": {"source-table": table["id"], **query}}
+        response = self._request("POST", "/api/dataset", session_id, json=dataset_query)
+        response.raise_for_status()
+        result = response.json()
+        if result.get("status") != "completed":
+            raise requests.exceptions.RequestException(f"Statistics query failed: {result.get('error')}")
+        return result
+
+    def _compute_mbql(self, session_id: str, table: Dict[str, Any], fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 全列の集約を1つのクエリにまとめる: [count, (min, max,) count-where is-null, (distinct,) ...]
+        aggregations: List[Any] = [["count"]]
+        layout = []
+        for field in fields:
+            ref = ["field", field["id"], None]
+            if is_ranged(field):
+                aggregations += [["min", ref], ["max", ref]]
+            aggregations.append(["count-where", ["is-null", ref]])
+            exact_distinct = fingerprint_distinct(field) is None and has_cheap_distinct(field)
+            if exact_distinct:
+                aggregations.append(["distinct", ref])
+            layout.append((field, exact_distinct))
+        row = self._run_mbql(session_id, table, {"aggregation": aggregations})["data"]["rows"][0]
+        columns, i = {}, 1
+        for field, exact_distinct in layout:
+            stats = {"min": None, "max": None}
+            if is_ranged(field):
+                stats["min"], stats["max"] = row[i], row[i + 1]
+                i += 2
+            stats.update(null_count=_to_int(row[i]), distinct=fingerprint_distinct(field), top_values=None)
+            i += 1
+            if exact_distinct:
+                stats["distinct"] = _to_int(row[i])
+                i += 1
+            columns[field["id"]] = stats
+        return {"row_count": _to_int(row[0]), "columns": columns}
+
+    def _fetch_top_values(self, session_id: str, table: Dict[str, Any], field: Dict[str, Any]) -> List[List[Any]]:
+        query = {
+            "aggregation": [["count"]], "breakout": [["field", field["id"], None]],
+            "order-by": [["desc", ["aggregation", 0]]], "limit": self.top_k,
+        }
+        return [list(row) for row in self._run_mbql(session_id, table, query)["data"]["rows"]]
+
+    # --- 直接接続 ---
+    def _compute_direct(self, table: Dict[str, Any], fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 最小値・最大値・空の件数は1回の走査で集計し、異なる値の数と上位の値は ANALYZE の推定値 (pg_stats) を使う
+        self.queries += 1
+        select = ["COUNT(*)"]
+        for field in fields:
+            column = quote_ident(field["name"])
+            if is_ranged(field):
+                select += [f"MIN({column})", f"MAX({column})"]
+            select.append(f"COUNT(*) FILTER (WHERE {column} IS NULL)")
+        table_sql = quote_ident(table["name"])
+        if table.get("schema"):
+            table_sql = f"{quote_ident(table['schema'])}.{table_sql}"
+        row = self.engine.fetch_all(f"SELECT {', '.join(select)} FROM {table_sql}")[0]
+        estimates = {
+            name: (n_distinct, values, freqs)
+            for name, n_distinct, values, freqs in self.engine.fetch_all(
+                "SELECT attname, n_distinct, most_common_vals::text::text[], most_common_freqs "
+                "FROM pg_stats WHERE schemaname = %s AND tablename = %s",
+                [table.get("schema") or "public", table["name"]],
+            )
+        }
+        row_count = int(row[0])
+        columns, i = {}, 1
+        for field in fields:
+            stats = {"min": None, "max": None}
+            if is_ranged(field):
+                stats["min"], stats["max"] = row[i], row[i + 1]
+                i += 2
+            stats["null_count"] = int(row[i])
+            i += 1
+            n_distinct, values, freqs = estimates.get(field["name"], (None, None, None))
+            # n_distinct が負の場合は行数に対する比率
+            if n_distinct is not None:
+                stats["distinct"] = int(n_distinct if n_distinct >= 0 else -n_distinct * row_count)
+            else:
+                stats["distinct"] = None
+            stats["top_values"] = [[v, round(f * row_count)] for v, f in zip(values, freqs)][:self.top_k] if values else None
+            columns[field["id"]] = stats
+        return {"row_count": row_count, "columns": columns}
@@ -1,9 +1,6 @@
 
-import json
 import collections
-
-# Path to log file
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
+from analysis_inputs import load_shared_logs
 
 # Chart type mapping
 TYPE_MAP = {
@@ -42,40 +39,34 @@ def analyze():
     # Track which recommendations were already counted for a specific state to avoid over-counting?
     # For now, simply count all occurrences as "Impressions"
     
-    with open(LOG_FILE, 'r') as f:
-        for line in f:
-            try:
-                entry = json.loads(line)
-            except:
+    for entry in load_shared_logs():
+        dash_id = entry.get('dashboard_id')
+        action = entry.get('action')
+
+        # 1. Identify Task for Dashboard
+        if action == 'select_table' or action == 'create_view':
+            table = entry.get('table_name')
+            if table in TABLE_MAP:
+                task = TABLE_MAP[table]
+                # Update dashboard task (last seen table might define current context)
+                if task != "Training":
+                    dashboard_tasks[dash_id] = task
+
+        # 2. Count Recommendations
+        if action == 'generate_recommendations':
+            # Check if recommendation was enabled
+            if not entry.get('recommendation_enabled'):
                 continue
-                
-            dash_id = entry.get('dashboard_id')
-            action = entry.get('action')
-            
-            # 1. Identify Task for Dashboard
-            if action == 'select_table' or action == 'create_view':
-                table = entry.get('table_name')
-                if table in TABLE_MAP:
-                    task = TABLE_MAP[table]
-                    # Update dashboard task (last seen table might define current context)
-                    if task != "Training":
-                        dashboard_tasks[dash_id] = task
-            
-            # 2. Count Recommendations
-            if action == 'generate_recommendations':
-                # Check if recommendation was enabled
-                if not entry.get('recommendation_enabled'):
-                    continue
-                    
-                # Get task
-                task = dashboard_tasks.get(dash_id)
-                if not task:
-                    continue # Skip if task unknown or Training
-                    
-                recs = entry.get('recommendations', [])
-                for r in recs:
-                    human_type = TYPE_MAP.get(r, r)
-                    rec_counts[task][human_type] += 1
+
+            # Get task
+            task = dashboard_tasks.get(dash_id)
+            if not task:
+                continue # Skip if task unknown or Training
+
+            recs = entry.get('recommendations', [])
+            for r in recs:
+                human_type = TYPE_MAP.get(r, r)
+                rec_counts[task][human_type] += 1
 
     # Print results
     print("Recommendation Counts by Task (Impressions):")
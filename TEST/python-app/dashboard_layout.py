@@ -0,0 +1,202 @@
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Metabase のダッシュボードの列数
+GRID_COLUMNS = 24
+# サイズが指定されていないダッシュカードの既定サイズ
+DEFAULT_SIZE_X = 6
+DEFAULT_SIZE_Y = 4
+
+
+def card_rect(card: Dict) -> Tuple[int, int, int, int]:
+    """ダッシュカードの (row, col, size_y, size_x)。"""
+    return card.get('row', 0), card.get('col', 0), card.get('size_y', DEFAULT_SIZE_Y), card.get('size_x', DEFAULT_SIZE_X)
+
+
+def first_free_slot(grid: np.ndarray, width: int, height: int, start_row: int = 0) -> Optional[Tuple[int, int]]:
+    """
+    占有グリッド (0 以外が使用中) で width x height の空き領域を上の行・左の列から探し、左上の (row, col) を返す。
+    2次元累積和 (summed-area table) で全ての位置の占有セル数を一度に求めるため、グリッドの大きさに比例する時間で済む。
+    start_row より上は探さない。見つからない場合は None。
+    """
+    rows, cols = grid.shape
+    if width > cols or height > rows - start_row or width <= 0 or height <= 0:
+        return None
+    area = np.zeros((rows - start_row + 1, cols + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(grid[start_row:], axis=0, dtype=np.int32), axis=1, out=area[1:, 1:])
+    # occupied[r, c] = 領域 [r, r+height) x [c, c+width) の使用中セル数
+    occupied = area[height:, width:] - area[:-height, width:] - area[height:, :-width] + area[:-height, :-width]
+    free = np.flatnonzero(occupied.ravel() == 0)
+    if len(free) == 0:
+        return None
+    row, col = divmod(int(free[0]), occupied.shape[1])
+    return start_row + row, col
+
+
+class PlacementEngine:
+    """
+    ダッシュボード (またはタブ) の占有グリッドを保持し、新しいカードの配置位置を決める。
+    グリッドは必要に応じて下に伸ばし、配置したカードはその場で占有済みにするため、複数のカードを続けて配置できる。
+    グリッドの値はそのセルを覆うカードの数で、重なったカードの一方を取り除いても他方の領域は空かない。
+    """
+
+    def __init__(self, dashcards: Sequence[Dict], grid_columns: int = GRID_COLUMNS):
+        self.grid_columns = grid_columns
+        self.bottom = max((row + size_y for row, _, size_y, _ in map(card_rect, dashcards)), default=0)
+        self.grid = np.zeros((self.bottom, grid_columns), dtype=np.int16)
+        for card in dashcards:
+            self._mark(*card_rect(card))
+
+    def _mark(self, row: int, col: int, height: int, width: int, delta: int = 1):
+        # 範囲外の部分は元の実装 (numpy のスライス) と同じく切り捨てる
+        self._ensure_rows(row + height)
+        self.grid[row:row + height, col:col + width] += delta
+
+    def _ensure_rows(self, rows: int):
+        if rows > len(self.grid):
+            self.grid = np.vstack([self.grid, np.zeros((rows - len(self.grid), self.grid_columns), dtype=np.int16)])
+
+    def _first_open_row(self) -> int:
+        # 全ての列が埋まっている行より上には置けないので、探索をその下から始める
+        full = (self.grid > 0).all(axis=1)
+        open_rows = np.flatnonzero(~full)
+        return int(open_rows[0]) if len(open_rows) else len(self.grid)
+
+    def find(self, width: int, height: int) -> Tuple[int, int]:
+        """width x height のカードを置ける最初の (row, col)。空きがなければ最下部の左端。"""
+        if self.bottom == 0:
+            return (0, 0)
+        # 最下部の下に height 行を足せば、幅が収まる限り必ず空きが見つかる
+        self._ensure_rows(self.bottom + height)
+        slot = first_free_slot(self.grid, width, height, start_row=self._first_open_row())
+        return slot if slot is not None else (self.bottom, 0)
+
+    def place(self, width: int, height: int) -> Tuple[int, int]:
+        """配置位置を決め、その領域を占有済みにする。"""
+        row, col = self.find(width, height)
+        self._mark(row, col, height, width)
+        self.bottom = max(self.bottom, row + height)
+        return row, col
+
+    def place_many(self, sizes: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """(size_x, size_y) の順に複数のカードを配置し、それぞれの (row, col) を返す。"""
+        return [self.place(width, height) for width, height in sizes]
+
+
+def find_empty_space(dashcards: List[Dict], card_width: int, card_height: int, grid_columns: int = GRID_COLUMNS) -> Tuple[int, int]:
+    """
+    既存のダッシュカードと重ならない最初の位置 (row, col) を返す。
+    呼び出すたびにグリッドを作り直す。app.py はダッシュボードごとのグリッドを LayoutIndex で使い回して配置する。
+    """
+    return PlacementEngine(dashcards, grid_columns).find(card_width, card_height)
+
+
+def _card_key(card: Dict) -> Hashable:
+    # 保存前のダッシュカード (id が負・未設定) は位置で区別する
+    card_id = card.get('id')
+    if isinstance(card_id, int) and card_id >= 0:
+        return card_id
+    return ("pending",) + card_rect(card)
+
+
+class DashboardOccupancy(PlacementEngine):
+    """
+    1つのダッシュボード (タブ) の占有グリッドを、ダッシュカードのIDと領域とともに保持する。
+    sync() で Metabase から取得したダッシュカードとの差分 (追加・削除・移動したカード) だけをグリッドに反映する。
+    複数のセッションから同じダッシュボードを編集するため、読み書きは lock を取得して行う。
+    """
+
+    def __init__(self, dashcards: Sequence[Dict] = (), grid_columns: int = GRID_COLUMNS):
+        super().__init__([], grid_columns)
+        self.lock = threading.RLock()
+        self.cards: Dict[Hashable, Tuple[int, int, int, int]] = {}
+        self.sync(dashcards)
+
+    def add(self, card: Dict):
+        key = _card_key(card)
+        if key in self.cards:
+            self.remove(key)
+        rect = card_rect(card)
+        self.cards[key] = rect
+        self._mark(*rect)
+        self.bottom = max(self.bottom, rect[0] + rect[2])
+
+    def remove(self, key: Hashable):
+        rect = self.cards.pop(key, None)
+        if rect is None:
+            return
+        self._mark(*rect, delta=-1)
+        if rect[0] + rect[2] >= self.bottom:
+            self.bottom = max((row + size_y for row, _, size_y, _ in self.cards.values()), default=0)
+            # 最下部より下は空なので切り詰め、探索する範囲を小さく保つ
+            self.grid = self.grid[:self.bottom]
+
+    def sync(self, dashcards: Sequence[Dict]) -> int:
+        """dashcards と一致するように差分を反映し、変更したカード数を返す。"""
+        current = {_card_key(card): card for card in dashcards}
+        changed = 0
+        for key in [k for k, rect in self.cards.items() if k not in current or card_rect(current[k]) != rect]:
+            self.remove(key)
+            changed += 1
+        for key, card in current.items():
+            if key not in self.cards:
+                self.add(card)
+                changed += 1
+        return changed
+
+    def place(self, width: int, height: int) -> Tuple[int, int]:
+        row, col = super().place(width, height)
+        # 保存されて ID が付くまでは位置をキーにしておき、次の sync() で置き換える
+        self.cards[("pending", row, col, height, width)] = (row, col, height, width)
+        return row, col
+
+    def compact(self) -> Dict[Hashable, int]:
+        """
+        カードを上に詰めて、削除などで生じた空白をなくす。移動したカードの {キー: 新しい row} を返す。
+        上・左にあるカードから順に、そのカードが占める列で既に置いたカードの下端まで上げる。
+        列の位置と、同じ列の中でのカードの上下の順序は変えない。
+        """
+        heights = np.zeros(self.grid_columns, dtype=int)
+        moves: Dict[Hashable, int] = {}
+        compacted: Dict[Hashable, Tuple[int, int, int, int]] = {}
+        for key, (row, col, height, width) in sorted(self.cards.items(), key=lambda item: (item[1][0], item[1][1])):
+            new_row = int(heights[col:col + width].max(initial=0))
+            heights[col:col + width] = new_row + height
+            if new_row != row:
+                moves[key] = new_row
+            compacted[key] = (new_row, col, height, width)
+        self.cards = {}
+        self.bottom = 0
+        self.grid = np.zeros((0, self.grid_columns), dtype=np.int16)
+        for key, rect in compacted.items():
+            self.cards[key] = rect
+            self._mark(*rect)
+            self.bottom = max(self.bottom, rect[0] + rect[2])
+        return moves
+
+
+class LayoutIndex:
+    """ダッシュボードID・タブIDごとの DashboardOccupancy をプロセス内で共有する。"""
+
+    def __init__(self, grid_columns: int = GRID_COLUMNS):
+        self.grid_columns = grid_columns
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, Any], DashboardOccupancy] = {}
+
+    def get(self, dashboard_id: Any, tab_id: Any, dashcards: Sequence[Dict]) -> DashboardOccupancy:
+        """dashcards (Metabase から取得した最新の状態) に同期した占有グリッドを返す。"""
+        key = (str(dashboard_id), tab_id)
+        with self._lock:
+            occupancy = self._entries.get(key)
+            if occupancy is None:
+                occupancy = self._entries[key] = DashboardOccupancy(grid_columns=self.grid_columns)
+        with occupancy.lock:
+            occupancy.sync(dashcards)
+        return occupancy
+
+    def invalidate(self, dashboard_id: Any):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == str(dashboard_id)]:
+                del self._entries[key]
@@ -0,0 +1,307 @@
+"""
+操作ログ (app_log.jsonl) を、型付きの列で持つ Parquet のイベントストアに変換する。
+
+    logs/events/date=<YYYY-MM-DD>/action=<action>/part-<ソース>.parquet
+    logs/events/_ingested.json    取り込み済みのソース (セグメント・アーカイブ) と行数
+
+ソースは log_segments のセグメント (圧縮済み)、start_app.sh が以前作ったアーカイブ (logs/archive_*/app_log.jsonl)、
+書き込み中のログの3種類。セグメントとアーカイブは変更されないため1度だけ取り込み、
+書き込み中のログは取り込むたびに part-live を書き直す (ローテーションされるとセグメントとして取り込まれる)。
+ユーザーID・ダッシュボードIDなどは辞書エンコードし、ビューの配列はリストの列にする。
+スキーマにないキーは extra 列に JSON で残す。
+
+    python event_store.py ingest                # 未取り込みのソースと書き込み中のログを取り込む
+    python event_store.py ingest --watch 60     # 60秒ごとに取り込み続ける
+    python event_store.py info
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from log_segments import LOG_DIR, LOG_FILE, TimeBound, list_segments, parse_lines
+
+EVENT_STORE_DIR = os.path.join(LOG_DIR, "events")
+INGESTED_FILE = "_ingested.json"
+LIVE_SOURCE = "live"
+UNKNOWN_DATE = "unknown"
+
+_dict = pa.dictionary(pa.int32(), pa.string())
+# 操作ログの列と型。新しいキーを分析で使うようになったらここに加える (それまでは extra 列に残る)
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us")),
+    ("user_id", _dict),
+    ("dashboard_id", _dict),
+    ("recommendation_enabled", pa.bool_()),
+    ("trace_id", pa.string()),
+    ("task_duration_sec", pa.float64()),
+    ("table_id", pa.int64()),
+    ("table_name", _dict),
+    ("card_name", pa.string()),
+    ("card_type", _dict),
+    ("chart_type", _dict),
+    ("recommendation_source", _dict),
+    ("view_name", _dict),
+    ("rank", pa.int64()),
+    ("dashcard_id", pa.int64()),
+    ("current_views", pa.list_(pa.string())),
+    ("recommendations", pa.list_(pa.string())),
+    ("recommendation_list", pa.list_(pa.string())),
+    ("extra", pa.string()),
+    ("source", _dict),
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string()), ("action", pa.string())]), flavor="hive")
+
+
+def _to_timestamp(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value: Any) -> Optional[int]:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _to_list(value: Any) -> Optional[List[str]]:
+    return [str(v) for v in value] if isinstance(value, list) else None
+
+
+_CONVERTERS = {pa.timestamp("us"): _to_timestamp, pa.int64(): _to_int, pa.float64(): _to_float,
+               pa.bool_(): lambda v: v if isinstance(v, bool) else None, pa.list_(pa.string()): _to_list}
+
+
+def entries_to_table(entries: Iterable[Dict[str, Any]], source: str) -> Tuple[pa.Table, List[Tuple[str, str]]]:
+    """エントリを SCHEMA のテーブルにし、各行のパーティション (date, action) とともに返す。"""
+    typed = [f for f in SCHEMA if f.name not in ("extra", "source")]
+    columns: Dict[str, List[Any]] = {f.name: [] for f in SCHEMA}
+    partitions = []
+    for entry in entries:
+        extra = {}
+        for key, value in entry.items():
+            if key != "action" and (key not in columns or key in ("extra", "source")):
+                extra[key] = value
+        for f in typed:
+            value = entry.get(f.name)
+            converted = _CONVERTERS.get(f.type, _to_str)(value)
+            # 型が合わない値は失わないように extra に残す
+            if converted is None and value is not None:
+                extra[f.name] = value
+            columns[f.name].append(converted)
+        columns["extra"].append(json.dumps(extra, ensure_ascii=False, default=str) if extra else None)
+        columns["source"].append(source)
+        timestamp = entry.get("timestamp")
+        date = timestamp[:10] if isinstance(timestamp, str) and columns["timestamp"][-1] is not None else UNKNOWN_DATE
+        partitions.append((date, str(entry.get("action"))))
+    arrays = []
+    for f in SCHEMA:
+        if pa.types.is_dictionary(f.type):
+            arrays.append(pa.array(columns[f.name], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[f.name], f.type))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA), partitions
+
+
+class EventStore:
+    """Parquet のイベントストアへの取り込みと読み込み。"""
+
+    def __init__(self, store_dir: str = EVENT_STORE_DIR, log_dir: str = LOG_DIR, live_file: Optional[str] = LOG_FILE):
+        self.store_dir = store_dir
+        self.log_dir = log_dir
+        self.live_file = live_file
+
+    # --- 取り込み ---
+    def _ingested(self) -> Dict[str, Dict[str, Any]]:
+        path = os.path.join(self.store_dir, INGESTED_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_ingested(self, ingested: Dict[str, Dict[str, Any]]):
+        path = os.path.join(self.store_dir, INGESTED_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(ingested, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+    def sources(self) -> List[Tuple[str, str]]:
+        """変更されないソース (ソース名, パス) を古い順に返す。"""
+        archives = [(os.path.basename(os.path.dirname(path)), path)
+                    for path in sorted(glob.glob(os.path.join(self.log_dir, "archive_*", "app_log.jsonl")))]
+        segments = [(m["segment"].split(".", 1)[0], m["path"]) for m in list_segments(self.log_dir)]
+        return archives + segments
+
+    def _source_files(self, source: str) -> List[str]:
+        return glob.glob(os.path.join(self.store_dir, "date=*", "action=*", f"part-{source}.parquet"))
+
+    def _stage_source(self, source: str, entries: Iterable[Dict[str, Any]]) -> Tuple[int, List[Tuple[str, str]]]:
+        """ソースのパーティションを一時ファイルに書き、行数と (一時ファイル, 置き換え先) の一覧を返す。"""
+        table, partitions = entries_to_table(entries, source)
+        if table.num_rows == 0:
+            return 0, []
+        staged = []
+        keys = pd.Series([f"{date}\0{action}" for date, action in partitions])
+        for key, indices in keys.groupby(keys).indices.items():
+            date, action = key.split("\0")
+            directory = os.path.join(self.store_dir, f"date={quote(date, safe='')}", f"action={quote(action, safe='')}")
+            os.makedirs(directory, exist_ok=True)
+            # "." で始まる名前はデータセットの読み込みで無視されるため、書き込み途中のファイルは読まれない
+            tmp_path = os.path.join(directory, f".part-{source}.parquet.tmp")
+            pq.write_table(table.take(indices), tmp_path)
+            staged.append((tmp_path, os.path.join(directory, f"part-{source}.parquet")))
+        return table.num_rows, staged
+
+    def _commit_sources(self, staged: Dict[str, List[Tuple[str, str]]]):
+        """
+        一時ファイルを置き換え先に移し、今回書かなかったパーティションに残るそのソースのファイルを消す。
+        置き換えまでは以前のファイルを残すため、取り込みと並行して読み込んでもイベントが欠けない。
+        """
+        for source, files in staged.items():
+            written = set()
+            for tmp_path, path in files:
+                os.replace(tmp_path, path)
+                written.add(path)
+            for path in self._source_files(source):
+                if path not in written:
+                    os.remove(path)
+
+    def ingest(self) -> Dict[str, Any]:
+        """
+        未取り込みのソースを取り込み、書き込み中のログの part-live を書き直す。
+        セグメントの一覧を読んでから書き込み中のログを読むため、ローテーションと重なっても同じ行を二重には取り込まない。
+        新しいセグメントと part-live はすべて一時ファイルに書いてからまとめて置き換えるため、
+        ローテーションされた行がセグメントと古い part-live の両方から読まれるのは置き換えの間だけになる。
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        # 途中で止まった取り込みの一時ファイルを消す
+        for path in glob.glob(os.path.join(self.store_dir, "date=*", "action=*", ".part-*.parquet.tmp")):
+            os.remove(path)
+        ingested = self._ingested()
+        added = {}
+        staged = {}
+        for source, path in self.sources():
+            if source in ingested:
+                continue
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rb") as f:
+                added[source], staged[source] = self._stage_source(source, parse_lines(f))
+        live_rows = 0
+        if self.live_file is not None:
+            try:
+                with open(self.live_file, "rb") as f:
+                    live_rows, staged[LIVE_SOURCE] = self._stage_source(LIVE_SOURCE, parse_lines(f))
+            except FileNotFoundError:
+                staged[LIVE_SOURCE] = []
+        self._commit_sources(staged)
+        now = datetime.now().isoformat()
+        for source, rows in added.items():
+            ingested[source] = {"rows": rows, "ingested_at": now}
+        if added:
+            self._save_ingested(ingested)
+        return {"added_sources": added, "live_rows": live_rows, "sources": len(ingested)}
+
+    def rebuild(self) -> Dict[str, Any]:
+        """ストアを作り直す (SCHEMA を変更したとき)。"""
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+        return self.ingest()
+
+    # --- 読み込み ---
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(self.store_dir, format="parquet", partitioning=PARTITIONING,
+                          schema=pa.unify_schemas([SCHEMA, PARTITIONING.schema]), exclude_invalid_files=True)
+
+    def load(self, columns: Optional[List[str]] = None, actions: Optional[Iterable[str]] = None, start: TimeBound = None,
+             end: TimeBound = None, users: Optional[Iterable[Any]] = None,
+             dashboard_ids: Optional[Iterable[Any]] = None) -> pd.DataFrame:
+        """
+        条件に合うイベントを timestamp の順に DataFrame で返す。columns で指定した列 (と action) だけを読む。
+        action・期間の条件はパーティション (ディレクトリ) 単位で読み飛ばす。
+        辞書エンコードした列は category 型、整数の列は Int64 型、リストの列は要素ごとの配列になる。
+        """
+        if not os.path.isdir(self.store_dir):
+            return pd.DataFrame(columns=columns or [f.name for f in SCHEMA] + ["action"])
+        condition = None
+
+        def add(expr):
+            nonlocal condition
+            condition = expr if condition is None else condition & expr
+
+        if actions is not None:
+            add(ds.field("action").isin([str(a) for a in actions]))
+        if start is not None:
+            start_dt = start if isinstance(start, datetime) else datetime.fromisoformat(start)
+            add(ds.field("date") >= start_dt.date().isoformat())
+            add(ds.field("timestamp") >= pa.scalar(start_dt, pa.timestamp("us")))
+        if end is not None:
+            end_dt = end if isinstance(end, datetime) else datetime.fromisoformat(end)
+            add(ds.field("date") <= end_dt.date().isoformat())
+            add(ds.field("timestamp") <= pa.scalar(end_dt, pa.timestamp("us")))
+        if users is not None:
+            add(ds.field("user_id").cast(pa.string()).isin([str(u) for u in users]))
+        if dashboard_ids is not None:
+            add(ds.field("dashboard_id").cast(pa.string()).isin([str(d) for d in dashboard_ids]))
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + ["action"] + (["timestamp"] if "timestamp" not in columns else [])))
+        table = self.dataset().to_table(columns=columns, filter=condition)
+        table = table.sort_by("timestamp")
+        # 欠損のある整数の列を float にしない
+        frame = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        frame["action"] = frame["action"].astype("category")
+        return frame
+
+    def info(self) -> Dict[str, Any]:
+        ingested = self._ingested() if os.path.isdir(self.store_dir) else {}
+        files = glob.glob(os.path.join(self.store_dir, "date=*", "action=*", "*.parquet"))
+        return {"sources": len(ingested), "rows": sum(s["rows"] for s in ingested.values()), "files": len(files),
+                "bytes": sum(os.path.getsize(p) for p in files)}
+
+
+def load_events(columns: Optional[List[str]] = None, store_dir: str = EVENT_STORE_DIR, **filters) -> pd.DataFrame:
+    """EventStore(store_dir).load(...) の短縮形。"""
+    return EventStore(store_dir).load(columns, **filters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="操作ログを Parquet のイベントストアに取り込む")
+    parser.add_argument("command", choices=["ingest", "rebuild", "info"])
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    parser.add_argument("--store-dir", default=EVENT_STORE_DIR)
+    parser.add_argument("--watch", type=float, default=0, help="指定した秒数ごとに取り込み続ける")
+    args = parser.parse_args()
+
+    store = EventStore(args.store_dir, args.log_dir, os.path.join(args.log_dir, os.path.basename(LOG_FILE)))
+    if args.command == "info":
+        print(json.dumps(store.info(), indent=2))
+        return
+    result = store.rebuild() if args.command == "rebuild" else store.ingest()
+    print(json.dumps(result, ensure_ascii=False))
+    while args.watch > 0:
+        time.sleep(args.watch)
+        result = store.ingest()
+        if result["added_sources"]:
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
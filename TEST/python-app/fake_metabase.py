@@ -0,0 +1,321 @@
+"""
+Lightweight stand-in for the Metabase API, used to benchmark the app's own
+client overhead without a live Metabase.
+
+    python fake_metabase.py --port 3001 --latency-ms 50 --rows 5000
+    python fake_metabase.py record --url http://metabase:3000 --username root --password root \
+        --path /api/database --path /api/dashboard/5 --out recordings.json
+    python fake_metabase.py --port 3001 --recordings recordings.json
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from api_guard import classify_endpoint
+
+DEFAULT_LATENCY_MS = {"query": 0, "dashboard": 0, "metadata": 0, "write": 0, "other": 0}
+
+
+class FakeMetabase:
+    """
+    In-memory Metabase state plus an HTTP server exposing the subset of the API the app uses.
+    Responses listed in `recordings` ("METHOD /path" -> JSON body) take precedence over generated ones.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: Optional[Dict[str, float]] = None,
+                 jitter_ms: float = 0, num_tables: int = 5, num_fields: int = 10, num_rows: int = 100,
+                 recordings: Optional[Dict[str, Any]] = None, seed: int = 0):
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.jitter_ms = jitter_ms
+        self.num_rows = num_rows
+        self.recordings = recordings or {}
+        self.seed = seed
+        self.sessions = set()
+        self.request_counts: Dict[str, int] = {}
+        self.cards: Dict[int, Dict] = {}
+        self.dashboards: Dict[int, Dict] = {}
+        self._next_id = 1000
+        self._lock = threading.RLock()
+        self.databases = [
+            {"id": 1, "name": "Sample Database", "engine": "h2"},
+            {"id": 2, "name": "Analytics DB", "engine": "postgres"},
+        ]
+        self.tables = self._generate_tables(db_id=2, num_tables=num_tables, num_fields=num_fields)
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    # --- generated payloads ---
+    @staticmethod
+    def _generate_tables(db_id: int, num_tables: int, num_fields: int) -> List[Dict]:
+        base_types = ["type/Integer", "type/Float", "type/Text", "type/DateTime", "type/Text"]
+        tables = []
+        field_id = 1
+        for t in range(num_tables):
+            table_id = t + 1
+            fields = []
+            for f in range(num_fields):
+                fields.append({
+                    "id": field_id, "table_id": table_id, "name": f"column_{f}", "display_name": f"Column {f}",
+                    "base_type": base_types[f % len(base_types)], "semantic_type": "type/PK" if f == 0 else None,
+                })
+                field_id += 1
+            tables.append({
+                "id": table_id, "db_id": db_id, "name": f"table_{t}", "display_name": f"Table {t}",
+                "schema": "public", "entity_type": "entity/GenericTable", "visibility_type": None,
+                "updated_at": "2025-01-01T00:00:00Z", "fields": fields,
+            })
+        return tables
+
+    def _dataset(self, dataset_query: Dict) -> Dict:
+        query = dataset_query.get("query", {})
+        columns = query.get("breakout", []) + query.get("aggregation", []) or query.get("fields", []) or [None, None, None]
+        # Same query -> same rows, so benchmarks are reproducible
+        rng = random.Random(f"{self.seed}:{json.dumps(dataset_query, sort_keys=True)}")
+        cols = [{"name": f"col_{i}", "display_name": f"Col {i}", "base_type": "type/Float"} for i in range(len(columns))]
+        rows = [[round(rng.random() * 1000, 3) for _ in columns] for _ in range(self.num_rows)]
+        return {"status": "completed", "row_count": len(rows), "data": {"cols": cols, "rows": rows}}
+
+    @staticmethod
+    def _csv(result: Dict) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow([c["display_name"] for c in result["data"]["cols"]])
+        writer.writerows(result["data"]["rows"])
+        return out.getvalue()
+
+    def _dashboard(self, dashboard_id: int) -> Dict:
+        with self._lock:
+            return self.dashboards.setdefault(dashboard_id, {
+                "id": dashboard_id, "name": f"Dashboard {dashboard_id}", "description": None, "tabs": [], "dashcards": [],
+            })
+
+    def _new_id(self) -> int:
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    # --- routing ---
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: Any):
+        """Return (status, payload) for a request. Also used directly by in-process benchmarks."""
+        route = path.split("?", 1)[0]
+        with self._lock:
+            self.request_counts[f"{method} {route}"] = self.request_counts.get(f"{method} {route}", 0) + 1
+        latency = self.latency_ms.get(classify_endpoint(method, path), 0) + random.uniform(0, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        recorded = self.recordings.get(f"{method} {path}", self.recordings.get(f"{method} {route}"))
+        if method == "POST" and route == "/api/session":
+            token = str(uuid.uuid4())
+            with self._lock:
+                self.sessions.add(token)
+            return 200, {"id": token}
+        if route == "/api/health":
+            return 200, {"status": "ok"}
+        if headers.get("X-Metabase-Session") not in self.sessions:
+            return 401, "Unauthenticated"
+        if recorded is not None:
+            return 200, recorded
+
+        if method == "GET" and route == "/api/database":
+            return 200, {"data": self.databases, "total": len(self.databases)}
+        match = re.fullmatch(r"/api/database/(\d+)", route)
+        if method == "GET" and match:
+            db = next((d for d in self.databases if d["id"] == int(match.group(1))), None)
+            if db is None:
+                return 404, "Not found."
+            tables = [{k: v for k, v in t.items() if k != "fields"} for t in self.tables if t["db_id"] == db["id"]]
+            return 200, {**db, "tables": tables}
+        match = re.fullmatch(r"/api/database/(\d+)/metadata", route)
+        if method == "GET" and match:
+            db = next((d for d in self.databases if d["id"] == int(match.group(1))), None)
+            if db is None:
+                return 404, "Not found."
+            tables = [t for t in self.tables if t["db_id"] == db["id"]]
+            if "skip_fields=true" in path:
+                tables = [{k: v for k, v in t.items() if k != "fields"} for t in tables]
+            return 200, {**db, "tables": tables}
+        match = re.fullmatch(r"/api/table/(\d+)/query_metadata", route)
+        if method == "GET" and match:
+            table = next((t for t in self.tables if t["id"] == int(match.group(1))), None)
+            return (200, table) if table else (404, "Not found.")
+        if method == "POST" and route == "/api/dataset":
+            return 202, self._dataset(body or {})
+        if method == "POST" and route == "/api/dataset/csv":
+            # Export endpoints take the query as a form field
+            return 200, self._csv(self._dataset(json.loads((body or {}).get("query", "{}"))))
+        match = re.fullmatch(r"/api/card/(\d+)/query/csv", route)
+        if method == "POST" and match:
+            card = self.cards.get(int(match.group(1)))
+            return (200, self._csv(self._dataset(card.get("dataset_query", {})))) if card else (404, "Not found.")
+        match = re.fullmatch(r"/api/card/(\d+)", route)
+        if method == "GET" and match:
+            card = self.cards.get(int(match.group(1)))
+            if card is None:
+                return 404, "Not found."
+            return 200, {**card, "result_metadata": self._dataset(card.get("dataset_query", {}))["data"]["cols"]}
+        if method == "POST" and route == "/api/card":
+            card = {**(body or {}), "id": self._new_id()}
+            with self._lock:
+                self.cards[card["id"]] = card
+            return 200, card
+        if method == "GET" and route == "/api/dashboard":
+            with self._lock:
+                return 200, [{k: v for k, v in d.items() if k != "dashcards"} for d in self.dashboards.values()]
+        match = re.fullmatch(r"/api/dashboard/(\d+)", route)
+        if match:
+            dashboard = self._dashboard(int(match.group(1)))
+            if method == "GET":
+                return 200, dashboard
+            if method == "PUT":
+                with self._lock:
+                    for key in ("name", "description"):
+                        if key in (body or {}):
+                            dashboard[key] = body[key]
+                    for container in ([body] if "dashcards" in (body or {}) else []) + (body or {}).get("tabs", []):
+                        for dashcard in container.get("dashcards", []):
+                            if dashcard.get("id", -1) < 0:
+                                dashcard["id"] = self._new_id()
+                            dashcard["card"] = self.cards.get(dashcard.get("card_id"), {})
+                    if "dashcards" in body:
+                        dashboard["dashcards"] = body["dashcards"]
+                    if "tabs" in body:
+                        dashboard["tabs"] = body["tabs"]
+                return 200, dashboard
+        return 404, "Not found."
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if not raw:
+                    body = None
+                elif self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    body = {k: v[0] for k, v in parse_qs(raw.decode("utf-8")).items()}
+                else:
+                    body = json.loads(raw)
+                status, payload = fake.handle(method, self.path, dict(self.headers), body)
+                route = self.path.split("?", 1)[0]
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if not isinstance(payload, str) else payload.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json" if not isinstance(payload, str) else "text/csv" if route.endswith("/csv") else "text/plain")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+        return Handler
+
+    # --- lifecycle ---
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeMetabase":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-metabase", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeMetabase":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_recordings(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_responses(api_url: str, username: str, password: str, paths: List[str], out_file: str):
+    """Fetch GET responses from a live Metabase and save them as recordings for FakeMetabase."""
+    import requests
+
+    session = requests.post(f"{api_url}/api/session", json={"username": username, "password": password})
+    session.raise_for_status()
+    headers = {"X-Metabase-Session": session.json()["id"]}
+    recordings = {}
+    for path in paths:
+        response = requests.get(f"{api_url}{path}", headers=headers)
+        response.raise_for_status()
+        recordings[f"GET {path}"] = response.json()
+        print(f"Recorded GET {path} ({len(response.content)} bytes)")
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(recordings, f, ensure_ascii=False)
+    print(f"Saved {len(recordings)} recordings to {out_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Metabase API server")
+    sub = parser.add_subparsers(dest="command")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added to every endpoint")
+    parser.add_argument("--query-latency-ms", type=float, default=None, help="Latency for /api/dataset (overrides --latency-ms)")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--tables", type=int, default=5)
+    parser.add_argument("--fields", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=100, help="Rows returned by /api/dataset")
+    parser.add_argument("--recordings", help="JSON file of recorded responses")
+    parser.add_argument("--seed", type=int, default=0)
+    record = sub.add_parser("record", help="Record GET responses from a live Metabase")
+    record.add_argument("--url", required=True)
+    record.add_argument("--username", required=True)
+    record.add_argument("--password", required=True)
+    record.add_argument("--path", action="append", required=True)
+    record.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_responses(args.url, args.username, args.password, args.path, args.out)
+        return
+
+    latency = {name: args.latency_ms for name in DEFAULT_LATENCY_MS}
+    if args.query_latency_ms is not None:
+        latency["query"] = args.query_latency_ms
+    fake = FakeMetabase(
+        host=args.host, port=args.port, latency_ms=latency, jitter_ms=args.jitter_ms,
+        num_tables=args.tables, num_fields=args.fields, num_rows=args.rows,
+        recordings=load_recordings(args.recordings) if args.recordings else None, seed=args.seed,
+    )
+    print(f"Fake Metabase listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
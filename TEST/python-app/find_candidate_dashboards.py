@@ -1,55 +1,47 @@
-import json
 import collections
-
-LOG_FILE = '/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl'
+from analysis_inputs import load_shared_logs
 
 def analyze_dashboards():
     dashboards = {} # (user_id, dashboard_id) -> session_data
 
-    with open(LOG_FILE, 'r') as f:
-        for line in f:
-            try:
-                entry = json.loads(line)
-            except:
-                continue
-            
-            user_id = entry.get('user_id')
-            dashboard_id = entry.get('dashboard_id')
-            if not user_id or not dashboard_id:
-                continue
-            
-            key = (user_id, dashboard_id)
-            if key not in dashboards:
-                dashboards[key] = {
-                    'condition': entry.get('recommendation_enabled'), # boolean
-                    'views': [],
-                    'task': None,
-                    'actions': []
-                }
-            
-            dashboards[key]['actions'].append(entry)
-
-            # Determine task based on table creation or view creation
-            if 'table_name' in entry:
-                table = entry['table_name']
-                if table == 'Wine Review':
-                    dashboards[key]['task'] = 'Wine'
-                elif table == 'Ufo Scrubbed':
-                    dashboards[key]['task'] = 'UFO'
-            
-            # Track views
-            if entry.get('action') == 'create_view':
-                card_type = entry.get('card_type')
-                dashboards[key]['views'].append(card_type)
-            elif entry.get('action') == 'delete_view':
-                # Remove the last matching view if possible, or just track deletions?
-                # For simplicity, let's keep all created views to see what they TRIED to do, 
-                # or strictly parse the final state. 
-                # The user query implies "created View types" (Unique View Types).
-                # Thesis says "Created View types".
-                # I will store all created views for now, but also maybe handle deletions for "Final Dashboard" context?
-                # Let's stick to "Created" as per "Unique View Types" metric usually counts what was stimulated.
-                pass
+    for entry in load_shared_logs():
+        user_id = entry.get('user_id')
+        dashboard_id = entry.get('dashboard_id')
+        if not user_id or not dashboard_id:
+            continue
+
+        key = (user_id, dashboard_id)
+        if key not in dashboards:
+            dashboards[key] = {
+                'condition': entry.get('recommendation_enabled'), # boolean
+                'views': [],
+                'task': None,
+                'actions': []
+            }
+
+        dashboards[key]['actions'].append(entry)
+
+        # Determine task based on table creation or view creation
+        if 'table_name' in entry:
+            table = entry['table_name']
+            if table == 'Wine Review':
+                dashboards[key]['task'] = 'Wine'
+            elif table == 'Ufo Scrubbed':
+                dashboards[key]['task'] = 'UFO'
+
+        # Track views
+        if entry.get('action') == 'create_view':
+            card_type = entry.get('card_type')
+            dashboards[key]['views'].append(card_type)
+        elif entry.get('action') == 'delete_view':
+            # Remove the last matching view if possible, or just track deletions?
+            # For simplicity, let's keep all created views to see what they TRIED to do, 
+            # or strictly parse the final state. 
+            # The user query implies "created View types" (Unique View Types).
+            # Thesis says "Created View types".
+            # I will store all created views for now, but also maybe handle deletions for "Final Dashboard" context?
+            # Let's stick to "Created" as per "Unique View Types" metric usually counts what was stimulated.
+            pass
 
     # Filter and find candidates
     wine_rec_candidates = []
@@ -108,5 +108,8 @@ def generate_markdown():
     
     return md
 
-if __name__ == "__main__":
+def main():
     print(generate_markdown())
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,9 @@
 
 import json
-import csv
 import statistics
 from datetime import datetime
 import collections
-
-# File Paths
-LOG_FILE = "/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl"
-GROUP_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - グループ.csv"
-SURVEY_FILE = "/Users/jin/metabase/TEST/document/アンケート/アンケート（回答） - フォームの回答.csv"
-
-# Name Mapping
-NAME_MAP = {
-    "芹澤尚舜": "せり", "峪紳大朗": "さこ", "佐竹宏紀": "ひろくん", "今村真沙斗": "まさと",
-    "宮澤匠": "たくみ", "鈴木俊詞": "しゅんじ", "永沼翔翼": "つばさ", "田中 翔太郎": "たなか",
-    "岡本悠吾": "ゆうご", "矢野温加": "やん", "塙裕貴": "はなわ", "板井孝樹": "いたい"
-}
+from analysis_inputs import NAME_MAP, load_group_mapping, load_shared_logs, load_survey
 
 # Answer Keys
 ANSWERS = {
@@ -31,37 +19,6 @@ ANSWERS = {
     }
 }
 
-def load_group_mapping():
-    mapping = {} 
-    with open(GROUP_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
-        header_idx = -1
-        for i, row in enumerate(lines):
-            if len(row) > 1 and row[1] == 'id':
-                header_idx = i
-                break
-        if header_idx == -1: return {}
-
-        for row in lines[header_idx+1:]:
-            if len(row) < 7: continue
-            user_name = row[0]
-            if not user_name: continue
-            
-            # Task 1
-            if row[1]: mapping[str(row[1])] = {"user": user_name, "task": row[2], "rec": row[3] == "あり", "order": 1}
-            # Task 2
-            if row[4]: mapping[str(row[4])] = {"user": user_name, "task": row[5], "rec": row[6] == "あり", "order": 2}
-    return mapping
-
-def load_logs(log_file):
-    logs = []
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try: logs.append(json.loads(line))
-            except: continue
-    return logs
-
 def grade_answer(task, q_key, user_text):
     if not user_text: return False
     user_text = user_text.lower()
@@ -74,70 +31,68 @@ def grade_answer(task, q_key, user_text):
 def get_survey_answers():
     user_answers = {} # user -> {task: {A: val, B: val, C: val}}
     
-    with open(SURVEY_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        # Headers are messy, index based
-        # Task 1 QA: 27, 28, 29
-        # Task 2 QA: 33, 34, 35 (Let's verify by checking row length mostly)
-        # Actually, let's look at the row content for headers? No, headers are repeated or weird.
-        # Based on previous `head`, Task 1 answers are approx around col 27.
-        # Let's count properly: 
-        # 0:Timestamp, 1:Name ... 13:Task1Name ... 20:Task2Name ... 
-        # Let's dynamically find answers based on Task name position.
-        
-        # Actually, let's assume specific indices based on typical Google Form structure or the row I saw.
-        # Row 1 (Header): ... 質問Aの回答, 質問Bの回答, 質問Cの回答 ... (Repeated)
-        
-        # Let's refine logic: iterate rows, identify name, identify Task1/Task2, grab corresponding cols.
-        # Task 1 Answers are typically before Task 2 Name.
-        # The `head` output showed:
-        # Col 27: 質問A (Task 1) - "test"
-        # ...
-        # Col 37?: 質問A (Task 2)
-        
-        # Let's use a simpler heuristic:
-        # Task 1 is at index 13.
-        # Task 2 is at index 20 (Wait, 13+metrics+text...).
-        # Let's map indices once I see the first row.
-        
-        # Actually, I'll just hardcode indices based on standard form output if possible, or scan.
-        # Task 1 Qs: 27, 28, 29
-        # Task 2 Qs: 39, 40, 41 (Estimated. Let's look at the head again or be robust)
-        
-        # Robust strategy:
-        # Find column indices for "質問Aの回答". There should be two.
-        # Assign first set to Task 1, second set to Task 2.
+    header, rows = load_survey()
+    # Headers are messy, index based
+    # Task 1 QA: 27, 28, 29
+    # Task 2 QA: 33, 34, 35 (Let's verify by checking row length mostly)
+    # Actually, let's look at the row content for headers? No, headers are repeated or weird.
+    # Based on previous `head`, Task 1 answers are approx around col 27.
+    # Let's count properly: 
+    # 0:Timestamp, 1:Name ... 13:Task1Name ... 20:Task2Name ... 
+    # Let's dynamically find answers based on Task name position.
+    
+    # Actually, let's assume specific indices based on typical Google Form structure or the row I saw.
+    # Row 1 (Header): ... 質問Aの回答, 質問Bの回答, 質問Cの回答 ... (Repeated)
+    
+    # Let's refine logic: iterate rows, identify name, identify Task1/Task2, grab corresponding cols.
+    # Task 1 Answers are typically before Task 2 Name.
+    # The `head` output showed:
+    # Col 27: 質問A (Task 1) - "test"
+    # ...
+    # Col 37?: 質問A (Task 2)
+    
+    # Let's use a simpler heuristic:
+    # Task 1 is at index 13.
+    # Task 2 is at index 20 (Wait, 13+metrics+text...).
+    # Let's map indices once I see the first row.
+    
+    # Actually, I'll just hardcode indices based on standard form output if possible, or scan.
+    # Task 1 Qs: 27, 28, 29
+    # Task 2 Qs: 39, 40, 41 (Estimated. Let's look at the head again or be robust)
+    
+    # Robust strategy:
+    # Find column indices for "質問Aの回答". There should be two.
+    # Assign first set to Task 1, second set to Task 2.
+    
+    qa_indices = [i for i, h in enumerate(header) if "質問Aの回答" in h]
+    qb_indices = [i for i, h in enumerate(header) if "質問Bの回答" in h]
+    qc_indices = [i for i, h in enumerate(header) if "質問Cの回答" in h]
+    
+    for row in rows:
+        name = row[1]
+        if "石埜" in name or "test" in name.lower(): continue
+        nickname = NAME_MAP.get(name)
+        if not nickname: continue
         
-        header = next(reader)
-        qa_indices = [i for i, h in enumerate(header) if "質問Aの回答" in h]
-        qb_indices = [i for i, h in enumerate(header) if "質問Bの回答" in h]
-        qc_indices = [i for i, h in enumerate(header) if "質問Cの回答" in h]
+        task1 = row[13]
+        task2 = row[20] # This might vary. Let's check if col 20 is a task name.
         
-        for row in reader:
-            name = row[1]
-            if "石埜" in name or "test" in name.lower(): continue
-            nickname = NAME_MAP.get(name)
-            if not nickname: continue
+        # Extract Task 1
+        if task1 and len(qa_indices) > 0:
+            t1a = row[qa_indices[0]] if len(row) > qa_indices[0] else ""
+            t1b = row[qb_indices[0]] if len(row) > qb_indices[0] else ""
+            t1c = row[qc_indices[0]] if len(row) > qc_indices[0] else ""
             
-            task1 = row[13]
-            task2 = row[20] # This might vary. Let's check if col 20 is a task name.
+            if nickname not in user_answers: user_answers[nickname] = {}
+            user_answers[nickname][task1] = score_task(task1, t1a, t1b, t1c)
             
-            # Extract Task 1
-            if task1 and len(qa_indices) > 0:
-                t1a = row[qa_indices[0]] if len(row) > qa_indices[0] else ""
-                t1b = row[qb_indices[0]] if len(row) > qb_indices[0] else ""
-                t1c = row[qc_indices[0]] if len(row) > qc_indices[0] else ""
-                
-                if nickname not in user_answers: user_answers[nickname] = {}
-                user_answers[nickname][task1] = score_task(task1, t1a, t1b, t1c)
-                
-            # Extract Task 2
-            if task2 and len(qa_indices) > 1:
-                t2a = row[qa_indices[1]] if len(row) > qa_indices[1] else ""
-                t2b = row[qb_indices[1]] if len(row) > qb_indices[1] else ""
-                t2c = row[qc_indices[1]] if len(row) > qc_indices[1] else ""
-                
-                user_answers[nickname][task2] = score_task(task2, t2a, t2b, t2c)
+        # Extract Task 2
+        if task2 and len(qa_indices) > 1:
+            t2a = row[qa_indices[1]] if len(row) > qa_indices[1] else ""
+            t2b = row[qb_indices[1]] if len(row) > qb_indices[1] else ""
+            t2c = row[qc_indices[1]] if len(row) > qc_indices[1] else ""
+            
+            user_answers[nickname][task2] = score_task(task2, t2a, t2b, t2c)
                 
     return user_answers
 
@@ -150,7 +105,7 @@ def score_task(task, a, b, c):
 
 def main():
     group_map = load_group_mapping() # dash_id -> meta
-    logs = load_logs(LOG_FILE)
+    logs = load_shared_logs()
     survey_scores = get_survey_answers() # user -> task -> score_str
     
     # Debug output
@@ -1,8 +1,7 @@
 import pandas as pd
 import os
 import numpy as np
-
-DATA_DIR = '/Users/jin/metabase/TEST/data_init'
+from analysis_inputs import DATA_DIR
 
 DATASETS = {
     'athlete_events.csv': ['ExperimentTask_Hypothesis_Olympics.md', 'ExperimentTask_Hypothesis_Superpower.md'],
@@ -48,6 +47,9 @@ def generate_description(filename):
         except Exception as e:
             print(f"| {col} | Error | {e} |")
 
-if __name__ == "__main__":
+def main():
     for filename in DATASETS.keys():
         generate_description(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import csv
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dashboard_layout import GRID_COLUMNS
+
+# 同じグループ (同じテーブルのカードなど) が離れて配置されるごとに、高さ何行分の損失とみなすか
+ADJACENCY_WEIGHT = 2.0
+SIZE_PREDICATE = "v_i->size"
+
+Placement = Tuple[int, int]  # (row, col)
+
+
+def preferred_sizes(triples_file: str) -> Dict[str, str]:
+    """トリプル (subject, predicate, object) の v_i->size から、ビュー種別ごとに最も多く使われたサイズ (S/M/L) を返す。"""
+    counts: Dict[str, Counter] = defaultdict(Counter)
+    with open(triples_file, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) >= 3 and row[1].strip() == SIZE_PREDICATE:
+                counts[row[0].strip()][row[2].strip()] += 1
+    # 同数の場合はサイズ名の順で決める (結果を毎回同じにするため)
+    return {view: min(c.items(), key=lambda item: (-item[1], item[0]))[0] for view, c in counts.items()}
+
+
+def bottom_left_pack(cards: Sequence[Dict[str, Any]], columns: int = GRID_COLUMNS) -> List[Placement]:
+    """
+    cards ({"width", "height"}) を順に、上の行・左の列から最初に収まる位置に置き、各カードの (row, col) を返す。
+    各行の占有を整数のビットマスクで持ち、h 行分の論理和で w 列の空きを調べる (隙間にも詰める)。
+    占有は増える一方なので、同じサイズのカードは前回見つかった行から探せばよい。
+    """
+    full = (1 << columns) - 1
+    rows: List[int] = []
+    lowest: Dict[Tuple[int, int], int] = {}
+    placements = []
+    for card in cards:
+        width, height = min(card["width"], columns), card["height"]
+        bits = (1 << width) - 1
+        row, col = lowest.get((width, height), 0), 0
+        num_rows = len(rows)
+        while row < num_rows:
+            combined = 0
+            for r in range(row, min(row + height, num_rows)):
+                combined |= rows[r]
+            if combined != full:
+                col = next((c for c in range(columns - width + 1) if not combined & (bits << c)), None)
+                if col is not None:
+                    break
+            row += 1
+        else:
+            col = 0
+        lowest[(width, height)] = row
+        if len(rows) < row + height:
+            rows.extend([0] * (row + height - len(rows)))
+        for r in range(row, row + height):
+            rows[r] |= bits << col
+        placements.append((row, col))
+    return placements
+
+
+def layout_cost(cards: Sequence[Dict[str, Any]], placements: Sequence[Placement], columns: int = GRID_COLUMNS,
+                adjacency_weight: float = ADJACENCY_WEIGHT) -> Tuple[float, int, int]:
+    """
+    (評価値, 全体の高さ, 離れているグループの数)。
+    グループごとに、辺でつながった塊の数 - 1 を数える (カードの番号を書いたグリッドで隣り合うセルから判定する)。
+    """
+    height = max((row + card["height"] for card, (row, _) in zip(cards, placements)), default=0)
+    groups = [card.get("group") for card in cards]
+    grid = np.full((height, columns), -1, dtype=np.int32)
+    for index, (card, (row, col)) in enumerate(zip(cards, placements)):
+        grid[row:row + card["height"], col:col + card["width"]] = index
+    keys = []
+    for a, b in ((grid[:, :-1], grid[:, 1:]), (grid[:-1, :], grid[1:, :])):
+        mask = (a != b) & (a >= 0) & (b >= 0)
+        keys.append(a[mask].astype(np.int64) * len(cards) + b[mask])
+    # 辺に沿って同じ組が何度も現れるため、組ごとに1つにまとめる
+    pairs = [divmod(int(key), len(cards)) for key in np.unique(np.concatenate(keys))]
+    parent = list(range(len(cards)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    components = Counter(g for g in groups if g is not None)
+    for i, j in pairs:
+        if groups[i] is not None and groups[i] == groups[j]:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[root_i] = root_j
+                components[groups[i]] -= 1
+    separated = sum(count - 1 for count in components.values())
+    return height + adjacency_weight * separated, height, separated
+
+
+def initial_order(cards: Sequence[Dict[str, Any]]) -> List[int]:
+    """グループごとにまとめ、面積の大きいグループ・カードから並べた順序。"""
+    group_area: Dict[Hashable, int] = defaultdict(int)
+    for card in cards:
+        group_area[card.get("group")] += card["width"] * card["height"]
+    return sorted(range(len(cards)), key=lambda i: (-group_area[cards[i].get("group")], str(cards[i].get("group")),
+                                                    -cards[i]["width"] * cards[i]["height"], i))
+
+
+def optimize_layout(cards: Sequence[Dict[str, Any]], columns: int = GRID_COLUMNS) -> Dict[str, Any]:
+    """
+    cards ({"key", "width", "height", "group"}) を columns 列に並べ、同じグループのカードを隣り合わせにする。
+    グループごとにまとめて面積の大きい順に並べ、bottom_left_pack で隙間にも詰める。
+    配置順を入れ替える局所探索は、S/M/L のサイズでは高さが1行も下がらなかったため行わない
+    (benchmark_layout.py で1件ずつの配置と比べられる)。乱数を使わないため、結果は毎回同じになる。
+    戻り値: {"placements": {key: (row, col)}, "height", "separated", "elapsed_sec"}
+    """
+    started = time.monotonic()
+    ordered = [cards[i] for i in initial_order(cards)]
+    placements = bottom_left_pack(ordered, columns)
+    _, height, separated = layout_cost(ordered, placements, columns)
+    return {
+        "placements": {card["key"]: placement for card, placement in zip(ordered, placements)},
+        "height": height, "separated": separated, "elapsed_sec": time.monotonic() - started,
+    }
@@ -0,0 +1,267 @@
+"""
+分析スクリプト (analyze_* など) から操作ログを読み込むための共通モジュール。
+
+書き込み中のログ・セグメント (log_segments)・以前のアーカイブ (logs/archive_*/app_log.jsonl) をすべて探し、
+読み込んだ結果はファイルごとに logs/.cache/ に保存する (ファイルの inode・サイズ・更新時刻が変わるまで再利用する)。
+書き込み中のログは追記されるだけなので、前回読んだ位置から後ろだけを読む。
+ファイルごとに期間・ユーザー・ダッシュボード・操作の要約を持ち、条件に合わないファイルは読み込まない。
+
+    from log_loader import load_logs
+    logs = load_logs(dashboard_ids=["23", "24"], actions=["create_view"])
+"""
+import gc
+import glob
+import gzip
+import hashlib
+import json
+import marshal
+import os
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 標準の json で代用する (低速)
+    orjson = None
+
+from log_segments import (LOG_DIR, LOG_FILE, TimeBound, time_bound_text, list_segments, manifest_matches,
+                          uncompressed_segments)
+
+LOG_CACHE_DIR = os.getenv("LOG_CACHE_DIR", os.path.join(LOG_DIR, ".cache"))
+# marshal の形式は Python のバージョンごとに異なるため、バージョンもキャッシュの版に含める
+CACHE_VERSION = f"1-py{sys.version_info[0]}.{sys.version_info[1]}"
+# 全体を読み直すファイルがこの数以上あれば、複数のプロセスで並列に読む
+PARALLEL_MIN_FILES = 2
+
+
+def discover_log_files(log_dir: str = LOG_DIR) -> List[str]:
+    """操作ログのファイルを古い順に返す: アーカイブ、圧縮済みのセグメント、圧縮前のセグメント、書き込み中のログ。"""
+    live_file = os.path.join(log_dir, os.path.basename(LOG_FILE))
+    files = sorted(glob.glob(os.path.join(log_dir, "archive_*", "app_log.jsonl")))
+    segments = [m["path"] for m in list_segments(log_dir)]
+    files += segments + uncompressed_segments(log_dir, segments)
+    if os.path.exists(live_file):
+        files.append(live_file)
+    return files
+
+
+def _loads(line: bytes) -> Any:
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def parse_log_bytes(data: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    JSONL のバイト列を読み、(エントリ, 読み終えたバイト数) を返す。
+    最後の改行より後ろ (書き込み途中の行) は読まずに残す。壊れた行は読み飛ばす。
+    """
+    end = data.rfind(b"\n") + 1
+    entries = []
+    for line in data[:end].split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            entry = _loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict):
+            entries.append(entry)
+    return entries, end
+
+
+def summarize(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """セグメントのマニフェストと同じ形式の要約 (manifest_matches で使う)。"""
+    timestamps = [e["timestamp"] for e in entries if isinstance(e.get("timestamp"), str)]
+    return {
+        "entries": len(entries), "start": min(timestamps, default=None), "end": max(timestamps, default=None),
+        "users": sorted({str(e["user_id"]) for e in entries if e.get("user_id") is not None}),
+        "dashboard_ids": sorted({str(e["dashboard_id"]) for e in entries if e.get("dashboard_id") not in (None, "")}),
+        "actions": dict(sorted(Counter(str(e.get("action")) for e in entries).items())),
+    }
+
+
+def _merge_summaries(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    starts = [s for s in (a["start"], b["start"]) if s is not None]
+    ends = [e for e in (a["end"], b["end"]) if e is not None]
+    actions = dict(a["actions"])
+    for action, count in b["actions"].items():
+        actions[action] = actions.get(action, 0) + count
+    return {"entries": a["entries"] + b["entries"], "start": min(starts, default=None), "end": max(ends, default=None),
+            "users": sorted(set(a["users"]) | set(b["users"])),
+            "dashboard_ids": sorted(set(a["dashboard_ids"]) | set(b["dashboard_ids"])), "actions": actions}
+
+
+def _read_file(path: str, offset: int) -> Tuple[List[Dict[str, Any]], int, Dict[str, Any]]:
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    with _gc_paused():
+        entries, consumed = parse_log_bytes(data)
+    return entries, offset + consumed, summarize(entries)
+
+
+def _read_into_cache(path: str, signature: Dict[str, Any], cache_dir: str) -> Tuple[None, int, Dict[str, Any]]:
+    # ProcessPoolExecutor から呼ぶ。エントリはプロセス間で受け渡さず、キャッシュに書いて親プロセスで読む
+    entries, consumed, summary = _read_file(path, 0)
+    LogCache(cache_dir).save(path, {**signature, "consumed": consumed, **summary}, entries)
+    return None, consumed, summary
+
+
+@contextmanager
+def _gc_paused():
+    # 大量の dict を作る間は循環参照の検出 (GC) が何度も走り、読み込みが数倍遅くなる
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class LogCache:
+    """
+    ファイルごとの読み込み結果 (<キー>.marshal) と、その署名・要約 (<キー>.meta.json) を保存する。
+    エントリは JSON の値 (dict・list・str・数値) だけなので、pickle より速い marshal で保存する。
+    """
+
+    def __init__(self, cache_dir: str = LOG_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _paths(self, path: str) -> Tuple[str, str]:
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.meta.json"), os.path.join(self.cache_dir, f"{key}.marshal")
+
+    def meta(self, path: str) -> Optional[Dict[str, Any]]:
+        meta_path, _ = self._paths(path)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("version") == CACHE_VERSION else None
+
+    def entries(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        _, data_path = self._paths(path)
+        try:
+            with open(data_path, "rb") as f:
+                data = f.read()
+            with _gc_paused():
+                return marshal.loads(data)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+
+    def save(self, path: str, meta: Dict[str, Any], entries: List[Dict[str, Any]]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta_path, data_path = self._paths(path)
+        # 要約が本体より新しくならないよう、本体を先に書く
+        with open(f"{data_path}.tmp", "wb") as f:
+            f.write(marshal.dumps(entries))
+        os.replace(f"{data_path}.tmp", data_path)
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({**meta, "version": CACHE_VERSION}, f, ensure_ascii=False)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def _signature(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _plan(path: str, meta: Optional[Dict[str, Any]]) -> Tuple[Optional[int], Dict[str, Any]]:
+    """
+    (読み始める位置, 現在の署名)。キャッシュをそのまま使えるなら位置は None、追記分だけを読むなら前回読み終えた位置。
+    署名は読む前に取るため、読んでいる間に追記された分は次回に読み直される。
+    """
+    signature = _signature(path)
+    if meta is None or meta["inode"] != signature["inode"]:
+        return 0, signature
+    if meta["size"] == signature["size"] and meta["mtime_ns"] == signature["mtime_ns"]:
+        return None, signature
+    if not path.endswith(".gz") and signature["size"] >= max(meta["consumed"], meta["size"]):
+        return meta["consumed"], signature
+    return 0, signature
+
+
+def _matches(value: Any, wanted: Optional[set]) -> bool:
+    return wanted is None or value in wanted or str(value) in wanted
+
+
+def _filter_entries(entries: List[Dict[str, Any]], start: Optional[str], end: Optional[str], users: Optional[set],
+                    dashboard_ids: Optional[set], actions: Optional[set]) -> List[Dict[str, Any]]:
+    # log_segments.entry_matches と同じ条件。エントリ数が多いため、条件ごとに順に絞り込む
+    if actions is not None:
+        entries = [e for e in entries if _matches(e.get("action"), actions)]
+    if dashboard_ids is not None:
+        entries = [e for e in entries if _matches(e.get("dashboard_id"), dashboard_ids)]
+    if users is not None:
+        entries = [e for e in entries if _matches(e.get("user_id"), users)]
+    if start is not None:
+        entries = [e for e in entries if isinstance(e.get("timestamp"), str) and e["timestamp"] >= start]
+    if end is not None:
+        entries = [e for e in entries if isinstance(e.get("timestamp"), str) and e["timestamp"] <= end]
+    return entries
+
+
+def load_logs(paths: Optional[Iterable[str]] = None, log_dir: str = LOG_DIR, start: TimeBound = None,
+              end: TimeBound = None, users: Optional[Iterable[Any]] = None, dashboard_ids: Optional[Iterable[Any]] = None,
+              actions: Optional[Iterable[str]] = None, cache_dir: Optional[str] = LOG_CACHE_DIR,
+              workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    操作ログのエントリをファイルの順・ファイル内の順に返す。paths を省略すると log_dir のすべてのログを読む。
+    期間・ユーザー・ダッシュボード・操作の条件に合わないファイルは、キャッシュの要約で判定して読み込まない。
+    cache_dir=None ならキャッシュを使わない。workers は並列に読むプロセス数 (省略時は CPU 数)。
+    """
+    files = discover_log_files(log_dir) if paths is None else [p for p in paths if os.path.exists(p)]
+    filters = dict(start=start, end=end, users=users, dashboard_ids=dashboard_ids, actions=actions)
+    cache = LogCache(cache_dir) if cache_dir is not None else None
+
+    metas = {path: cache.meta(path) if cache else None for path in files}
+    plans, signatures = {}, {}
+    for path in files:
+        plans[path], signatures[path] = _plan(path, metas[path])
+    # 要約が最新のファイルは、読み込む前に条件で絞り込む
+    files = [p for p in files if plans[p] is not None or manifest_matches(metas[p], **filters)]
+    to_read = [p for p in files if plans[p] is not None]
+    workers = workers or os.cpu_count() or 1
+    # 全体を読み直すファイルが複数あれば、別のプロセスで読んでキャッシュに書く (追記分だけの読み込みは小さいのでこのプロセスで読む)
+    full_reads = [p for p in to_read if plans[p] == 0] if cache and workers > 1 else []
+    results = {}
+    if len(full_reads) >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=min(workers, len(full_reads))) as executor:
+            results = dict(zip(full_reads, executor.map(_read_into_cache, full_reads, [signatures[p] for p in full_reads],
+                                                        [cache_dir] * len(full_reads))))
+    for path in to_read:
+        if path not in results:
+            results[path] = _read_file(path, plans[path])
+
+    normalized = {k: None if v is None else {str(x) for x in v}
+                  for k, v in (("users", users), ("dashboard_ids", dashboard_ids), ("actions", actions))}
+    filtered = start is not None or end is not None or any(v is not None for v in normalized.values())
+    start, end = time_bound_text(start), time_bound_text(end)
+    logs = []
+    for path in files:
+        entries = None
+        if path in results:
+            entries, consumed, summary = results[path]
+            if plans[path]:
+                # 追記された分だけを読んだので、前回の結果に続ける
+                previous = cache.entries(path) if cache else None
+                if previous is None:
+                    entries, consumed, summary = _read_file(path, 0)
+                else:
+                    entries, summary = previous + entries, _merge_summaries(metas[path], summary)
+            if cache and entries is not None:
+                cache.save(path, {**signatures[path], "consumed": consumed, **summary}, entries)
+        if entries is None:
+            entries = cache.entries(path) if cache else None
+            if entries is None:
+                entries = _read_file(path, 0)[0]
+        logs.extend(_filter_entries(entries, start, end, **normalized) if filtered else entries)
+    return logs
@@ -0,0 +1,272 @@
+"""
+操作ログ (app_log.jsonl) のセグメントの構成。書き込み側 (log_writer) と分析スクリプトの両方がこの定義を使う。
+
+    logs/app_log.jsonl                                 書き込み中のログ
+    logs/segments/app_log_<日時>_<pid>.jsonl           ローテーション直後 (圧縮前) のセグメント
+    logs/segments/app_log_<日時>_<pid>.jsonl.gz        圧縮済みのセグメント
+    logs/segments/app_log_<日時>_<pid>.manifest.json   セグメントの期間・ユーザー・ダッシュボード・操作ごとの件数
+
+マニフェストは圧縮が終わってから書くため、マニフェストがあればセグメントは完全である。
+圧縮前のファイルはマニフェストを書いた後に消すため、その間は両方が残る。読み込み側はマニフェストのある
+圧縮前のファイルを読まない (uncompressed_segments)。
+読み込み側はマニフェストだけを見て、条件に合わないセグメントを展開せずに読み飛ばす。
+
+    python log_segments.py rotate   # 書き込み中のログをセグメントにする (start_app.sh から起動時に実行)
+    python log_segments.py list
+"""
+import argparse
+import fcntl
+import glob
+import gzip
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+LOG_DIR = "logs"
+LOG_FILE = os.path.join(LOG_DIR, "app_log.jsonl")
+SEGMENT_SUBDIR = "segments"
+SEGMENT_PREFIX = "app_log_"
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+TimeBound = Union[str, datetime, None]
+
+
+def segment_dir(log_dir: str = LOG_DIR) -> str:
+    return os.path.join(log_dir, SEGMENT_SUBDIR)
+
+
+def lock_path(live_file: str) -> str:
+    """書き込み中のログへの追記とローテーションを排他するロックファイル。"""
+    return f"{live_file}.lock"
+
+
+def new_segment_path(log_dir: str = LOG_DIR) -> str:
+    """ローテーションしたログの移動先 (圧縮前)。名前の順が時刻の順になる。"""
+    name = f"{SEGMENT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}.jsonl"
+    return os.path.join(segment_dir(log_dir), name)
+
+
+def _base(path: str) -> str:
+    for suffix in (".jsonl.gz", ".jsonl", MANIFEST_SUFFIX):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def parse_lines(lines: Iterable[Union[str, bytes]]) -> Iterator[Dict[str, Any]]:
+    """JSONL の行を読み、壊れた行 (書き込み途中の行など) は読み飛ばす。"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict):
+            yield entry
+
+
+class ManifestBuilder:
+    """セグメントのエントリを1件ずつ受け取り、マニフェストを作る。"""
+
+    def __init__(self):
+        self.entries = 0
+        self.start: Optional[str] = None
+        self.end: Optional[str] = None
+        self.users = set()
+        self.dashboard_ids = set()
+        self.actions: Counter = Counter()
+
+    def add(self, entry: Dict[str, Any]):
+        self.entries += 1
+        timestamp = entry.get("timestamp")
+        if isinstance(timestamp, str):
+            self.start = timestamp if self.start is None else min(self.start, timestamp)
+            self.end = timestamp if self.end is None else max(self.end, timestamp)
+        if entry.get("user_id") is not None:
+            self.users.add(str(entry["user_id"]))
+        if entry.get("dashboard_id") not in (None, ""):
+            self.dashboard_ids.add(str(entry["dashboard_id"]))
+        self.actions[str(entry.get("action"))] += 1
+
+    def to_dict(self, segment: str, raw_bytes: int, compressed_bytes: int) -> Dict[str, Any]:
+        return {
+            "version": MANIFEST_VERSION, "segment": segment, "entries": self.entries,
+            "start": self.start, "end": self.end,
+            "users": sorted(self.users), "dashboard_ids": sorted(self.dashboard_ids),
+            "actions": dict(sorted(self.actions.items())),
+            "raw_bytes": raw_bytes, "compressed_bytes": compressed_bytes,
+        }
+
+
+def compress_segment(path: str) -> Dict[str, Any]:
+    """圧縮前のセグメントを gzip で圧縮してマニフェストを書き、元のファイルを削除する。マニフェストを返す。"""
+    base = _base(path)
+    gz_path = f"{base}.jsonl.gz"
+    builder = ManifestBuilder()
+    with open(path, "rb") as src, gzip.open(f"{gz_path}.tmp", "wb") as dst:
+        for line in src:
+            dst.write(line)
+            for entry in parse_lines([line]):
+                builder.add(entry)
+    os.replace(f"{gz_path}.tmp", gz_path)
+    manifest = builder.to_dict(os.path.basename(gz_path), os.path.getsize(path), os.path.getsize(gz_path))
+    with open(f"{base}{MANIFEST_SUFFIX}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(f"{base}{MANIFEST_SUFFIX}.tmp", f"{base}{MANIFEST_SUFFIX}")
+    os.remove(path)
+    return manifest
+
+
+def detach_live_file(live_file: str, log_dir: str = LOG_DIR) -> Optional[str]:
+    """
+    書き込み中のログをセグメントのディレクトリへ移し、移動先を返す (空なら何もしない)。
+    呼び出し元はロックファイルを排他ロックしていること。他のプロセスは次の書き込みで新しいファイルを開く。
+    """
+    if not os.path.exists(live_file) or os.path.getsize(live_file) == 0:
+        return None
+    os.makedirs(segment_dir(log_dir), exist_ok=True)
+    path = new_segment_path(log_dir)
+    os.rename(live_file, path)
+    return path
+
+
+def rotate(live_file: str = LOG_FILE, log_dir: str = LOG_DIR) -> Optional[Dict[str, Any]]:
+    """ロックを取得して書き込み中のログをセグメントにし、圧縮する。マニフェストを返す (空なら None)。"""
+    os.makedirs(os.path.dirname(live_file) or ".", exist_ok=True)
+    with open(lock_path(live_file), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            path = detach_live_file(live_file, log_dir)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return compress_segment(path) if path else None
+
+
+def recover(log_dir: str = LOG_DIR) -> List[Dict[str, Any]]:
+    """圧縮の途中で止まったセグメント (圧縮前のファイルが残っているもの) を圧縮し直す。"""
+    return [compress_segment(path) for path in sorted(glob.glob(os.path.join(segment_dir(log_dir), f"{SEGMENT_PREFIX}*.jsonl")))]
+
+
+def list_segments(log_dir: str = LOG_DIR) -> List[Dict[str, Any]]:
+    """圧縮済みのセグメントのマニフェストを古い順に返す。"path" にセグメントのパスを加える。"""
+    manifests = []
+    for manifest_path in sorted(glob.glob(os.path.join(segment_dir(log_dir), f"{SEGMENT_PREFIX}*{MANIFEST_SUFFIX}"))):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read segment manifest {manifest_path}: {e}")
+            continue
+        manifests.append({**manifest, "path": os.path.join(os.path.dirname(manifest_path), manifest["segment"])})
+    return manifests
+
+
+def uncompressed_segments(log_dir: str = LOG_DIR, listed: Iterable[str] = ()) -> List[str]:
+    """
+    圧縮前のセグメントを古い順に返す。list_segments の後に呼び、listed にはそこで得たセグメントのパスを渡す。
+    マニフェストが既にあるもの (圧縮済みで削除前) は読まず、list_segments の後に圧縮が終わったものは圧縮済みのパスを返す。
+    """
+    listed = set(listed)
+    paths = []
+    for path in sorted(glob.glob(os.path.join(segment_dir(log_dir), f"{SEGMENT_PREFIX}*.jsonl"))):
+        if not os.path.exists(f"{_base(path)}{MANIFEST_SUFFIX}"):
+            paths.append(path)
+        elif f"{_base(path)}.jsonl.gz" not in listed:
+            paths.append(f"{_base(path)}.jsonl.gz")
+    return paths
+
+
+def time_bound_text(bound: TimeBound) -> Optional[str]:
+    return bound.isoformat() if isinstance(bound, datetime) else bound
+
+
+def _normalize(values: Optional[Iterable[Any]]) -> Optional[set]:
+    return None if values is None else {str(v) for v in values}
+
+
+def manifest_matches(manifest: Dict[str, Any], start: TimeBound = None, end: TimeBound = None,
+                     users: Optional[Iterable[Any]] = None, dashboard_ids: Optional[Iterable[Any]] = None,
+                     actions: Optional[Iterable[str]] = None) -> bool:
+    """条件に合うエントリがセグメントに含まれうるか (False なら読み飛ばしてよい)。"""
+    start, end = time_bound_text(start), time_bound_text(end)
+    if manifest.get("start") is not None:
+        if end is not None and manifest["start"] > end:
+            return False
+        if start is not None and manifest["end"] < start:
+            return False
+    for wanted, present in ((_normalize(users), manifest.get("users")), (_normalize(dashboard_ids), manifest.get("dashboard_ids")),
+                            (_normalize(actions), manifest.get("actions"))):
+        if wanted is not None and present is not None and not wanted.intersection(present):
+            return False
+    return True
+
+
+def entry_matches(entry: Dict[str, Any], start: TimeBound = None, end: TimeBound = None, users: Optional[set] = None,
+                  dashboard_ids: Optional[set] = None, actions: Optional[set] = None) -> bool:
+    timestamp = entry.get("timestamp")
+    start, end = time_bound_text(start), time_bound_text(end)
+    if start is not None and (timestamp is None or timestamp < start):
+        return False
+    if end is not None and (timestamp is None or timestamp > end):
+        return False
+    return ((users is None or str(entry.get("user_id")) in users)
+            and (dashboard_ids is None or str(entry.get("dashboard_id")) in dashboard_ids)
+            and (actions is None or str(entry.get("action")) in actions))
+
+
+def iter_entries(log_dir: str = LOG_DIR, live_file: Optional[str] = LOG_FILE, start: TimeBound = None, end: TimeBound = None,
+                 users: Optional[Iterable[Any]] = None, dashboard_ids: Optional[Iterable[Any]] = None,
+                 actions: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    セグメント (古い順)・圧縮前のセグメント・書き込み中のログの順に、条件に合うエントリを返す。
+    マニフェストで条件に合わないと分かるセグメントは展開しない。live_file=None なら書き込み中のログは読まない。
+    """
+    filters = dict(start=start, end=end, users=_normalize(users), dashboard_ids=_normalize(dashboard_ids), actions=_normalize(actions))
+    manifests = list_segments(log_dir)
+    sources = [m["path"] for m in manifests if manifest_matches(m, start, end, users, dashboard_ids, actions)]
+    sources += uncompressed_segments(log_dir, [m["path"] for m in manifests])
+    if live_file is not None:
+        sources.append(live_file)
+    for path in sources:
+        segment = path != live_file and path.endswith(".jsonl")
+        try:
+            f = (gzip.open if path.endswith(".gz") else open)(path, "rb")
+        except FileNotFoundError:
+            if not segment:
+                # 読んでいる間にローテーションされた書き込み中のログ
+                continue
+            # 開く前に圧縮が終わったセグメントは、圧縮済みのファイルを読む
+            try:
+                f = gzip.open(f"{_base(path)}.jsonl.gz", "rb")
+            except FileNotFoundError:
+                continue
+        with f:
+            for entry in parse_lines(f):
+                if entry_matches(entry, **filters):
+                    yield entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="操作ログのセグメントを作成・一覧表示する")
+    parser.add_argument("command", choices=["rotate", "list"])
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    args = parser.parse_args()
+
+    if args.command == "rotate":
+        for manifest in recover(args.log_dir):
+            print(f"Recovered segment {manifest['segment']} ({manifest['entries']} entries)")
+        manifest = rotate(os.path.join(args.log_dir, os.path.basename(LOG_FILE)), args.log_dir)
+        if manifest:
+            print(f"Rotated {manifest['entries']} entries into {manifest['segment']}")
+    else:
+        for manifest in list_segments(args.log_dir):
+            print(f"{manifest['segment']}: {manifest['entries']} entries, {manifest['start']} - {manifest['end']}, "
+                  f"{len(manifest['users'])} users, {manifest['raw_bytes']:,} -> {manifest['compressed_bytes']:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
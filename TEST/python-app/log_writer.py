@@ -0,0 +1,218 @@
+import atexit
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from log_segments import LOG_DIR, LOG_FILE, compress_segment, detach_live_file, lock_path
+
+# --- 操作ログの書き込み設定 ---
+# キューに溜められるエントリ数。満杯の場合は呼び出し元を待たせずにエントリを捨てる
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# 書き込みスレッドがまとめて書く最大件数と、溜まるのを待つ最長の時間
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_SEC = float(os.getenv("LOG_FLUSH_SEC", 0.5))
+# fsync の方針: "off" (OSに任せる) / "batch" (まとめて書くたび) / "interval" (LOG_FSYNC_INTERVAL_SEC ごと)
+LOG_FSYNC = os.getenv("LOG_FSYNC", "interval")
+LOG_FSYNC_INTERVAL_SEC = float(os.getenv("LOG_FSYNC_INTERVAL_SEC", 5))
+# 書き込んだエントリを標準出力にも出す (docker logs で確認するため)
+LOG_ECHO = os.getenv("LOG_ECHO", "1") == "1"
+FSYNC_POLICIES = ("off", "batch", "interval")
+# 書き込み中のログがこのサイズ・経過時間 (最初のエントリから) を超えたら、圧縮したセグメントに切り替える。0 なら切り替えない
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", 64 * 1024 * 1024))
+LOG_ROTATE_SEC = float(os.getenv("LOG_ROTATE_SEC", 24 * 3600))
+
+_STOP = object()
+
+
+class JsonlLogWriter:
+    """
+    JSONL の操作ログをバックグラウンドのスレッドでまとめて追記する。
+    write() はキューに入れるだけで、JSON への変換・ファイルへの書き込み・fsync は書き込みスレッドが行う。
+    同じファイルに複数のプロセス (Streamlit のワーカーや分析スクリプト) が追記するため、
+    1回分の行をまとめてロックファイルを排他ロック (flock) したうえで1度の write で書き、行が混ざらないようにする。
+    ログが LOG_ROTATE_BYTES・LOG_ROTATE_SEC を超えたら、ロック中にセグメントのディレクトリへ移し、ロックを外してから圧縮する
+    (log_segments.py)。他のプロセスは、ファイルが移動・削除されていれば次の書き込みで開き直す。
+    """
+
+    def __init__(self, path: str = LOG_FILE, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_sec: float = LOG_FLUSH_SEC, fsync: str = LOG_FSYNC,
+                 fsync_interval_sec: float = LOG_FSYNC_INTERVAL_SEC, echo: bool = LOG_ECHO, log_dir: str = LOG_DIR,
+                 rotate_bytes: int = LOG_ROTATE_BYTES, rotate_sec: float = LOG_ROTATE_SEC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}: {fsync}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.fsync = fsync
+        self.fsync_interval_sec = fsync_interval_sec
+        self.echo = echo
+        self.log_dir = log_dir
+        self.rotate_bytes = rotate_bytes
+        self.rotate_sec = rotate_sec
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._started: Optional[datetime] = None  # 書き込み中のログの最初のエントリの時刻
+        self._last_fsync = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.rotations = 0
+
+    def write(self, entry: Dict[str, Any]) -> bool:
+        """エントリを書き込みキューに入れる。キューが満杯の場合は捨てて False を返す (待たない)。"""
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    # --- 書き込みスレッド ---
+    def _next_batch(self) -> List[Any]:
+        """最初のエントリを待ち、その後 flush_sec の間か batch_size 件に達するまで溜める。"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_sec
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _open(self):
+        # ローテーションなどでファイルが置き換わっていれば開き直す
+        if self._file is not None:
+            try:
+                if os.fstat(self._file.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return self._file
+            except OSError:
+                pass
+            self._file.close()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._started = self._first_timestamp()
+        return self._file
+
+    def _first_timestamp(self) -> Optional[datetime]:
+        try:
+            with open(self.path, "rb") as f:
+                return datetime.fromisoformat(json.loads(f.readline())["timestamp"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _should_rotate(self, f) -> bool:
+        if self.rotate_bytes and f.tell() >= self.rotate_bytes:
+            return True
+        if self._started is None:
+            self._started = self._first_timestamp()
+        return bool(self.rotate_sec and self._started
+                    and (datetime.now() - self._started).total_seconds() >= self.rotate_sec)
+
+    def _write_lines(self, entries: List[Dict[str, Any]]):
+        lines = []
+        for entry in entries:
+            try:
+                lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+            except (TypeError, ValueError) as e:
+                print(f"Failed to serialize log entry: {e}")
+                with self._lock:
+                    self.errors += 1
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        detached = None
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(lock_path(self.path), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # ロックを待つ間に他のプロセスがローテーションしていれば、新しいファイルに書く
+                    f = self._open()
+                    f.write(data)
+                    f.flush()
+                    now = time.monotonic()
+                    if self.fsync == "batch" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval_sec):
+                        os.fsync(f.fileno())
+                        self._last_fsync = now
+                    if self._should_rotate(f):
+                        if self.fsync != "off":
+                            os.fsync(f.fileno())
+                        detached = detach_live_file(self.path, self.log_dir)
+                        self._file.close()
+                        self._file, self._started = None, None
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError as e:
+            print(f"Failed to write log to file: {e}")
+            with self._lock:
+                self.errors += len(lines)
+            return
+        if detached:
+            self._compress(detached)
+        with self._lock:
+            self.written += len(lines)
+            self.batches += 1
+        if self.echo:
+            for line in lines:
+                print(f"LOG: {line}")
+
+    def _compress(self, path: str):
+        # 圧縮は時間がかかるためロックの外で行う (失敗しても log_segments.py rotate の起動時に圧縮し直す)
+        try:
+            compress_segment(path)
+            with self._lock:
+                self.rotations += 1
+        except OSError as e:
+            print(f"Failed to compress log segment {path}: {e}")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            self._write_lines([entry for entry in batch if entry is not _STOP])
+            if stop:
+                break
+        if self._file is not None:
+            if self.fsync != "off":
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def start(self) -> "JsonlLogWriter":
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout_sec: float = 5.0):
+        """
+        キューに残ったエントリを書き出してから書き込みスレッドを止める。
+        atexit から呼ばれるため、timeout_sec を過ぎたら待たずに戻り、書き出せなかった件数を表示する。
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout_sec
+        try:
+            # 満杯の場合は書き込みスレッドが空けるのを待つ (他のプロセスのロックで止まっていれば諦める)
+            self._queue.put(_STOP, timeout=timeout_sec)
+        except queue.Full:
+            print(f"Log writer did not drain within {timeout_sec}s; {self._queue.qsize()} entries were not written")
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            print(f"Log writer did not stop within {timeout_sec}s; {self._queue.qsize()} entries were not written")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"path": self.path, "queued": self._queue.qsize(), "written": self.written,
+                    "dropped": self.dropped, "batches": self.batches, "errors": self.errors, "rotations": self.rotations, "fsync": self.fsync}
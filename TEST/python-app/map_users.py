@@ -1,12 +1,7 @@
 
-import json
 import collections
-import glob
-import os
 from datetime import datetime
-
-# Include current and archived logs
-LOG_FILES = glob.glob('/Users/jin/metabase/TEST/python-app/logs/**/app_log.jsonl', recursive=True)
+from analysis_inputs import load_shared_logs
 
 def parse_time(ts_str):
     if '.' in ts_str:
@@ -16,56 +11,49 @@ def parse_time(ts_str):
 def analyze_participants():
     dashboards = {} 
 
-    for log_file in LOG_FILES:
-        with open(log_file, 'r') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line)
-                except:
-                    continue
-                
-                db_id = entry.get('dashboard_id')
-                if not db_id:
-                    continue
-                
-                if db_id not in dashboards:
-                    dashboards[db_id] = {
-                        'id': db_id,
-                        'timestamps': [],
-                        'task': None,
-                        'rec_enabled': None,
-                        'views_created': [],
-                        'views_deleted': 0,
-                        'final_view_count': 0
-                    }
-                
-                db = dashboards[db_id]
-                db['timestamps'].append(entry.get('timestamp'))
-                
-                # Identify Task
-                if 'table_name' in entry:
-                    tname = entry['table_name']
-                    if tname == 'Wine Review':
-                        db['task'] = 'Wine'
-                    elif tname == 'Ufo Scrubbed':
-                        db['task'] = 'UFO'
-                
-                # Identify Condition
-                if 'recommendation_enabled' in entry:
-                    db['rec_enabled'] = entry['recommendation_enabled']
-                
-                # Count Views
-                if entry.get('action') == 'create_view':
-                    c_type = entry.get('card_type')
-                    # normalize
-                    if c_type == 'pivot-table': c_type = 'pivot'
-                    if c_type == 'scalar': c_type = 'value'
-                    db['views_created'].append(c_type)
-                    db['final_view_count'] += 1
-                
-                if entry.get('action') == 'delete_view':
-                    db['views_deleted'] += 1
-                    db['final_view_count'] -= 1
+    for entry in load_shared_logs():
+        db_id = entry.get('dashboard_id')
+        if not db_id:
+            continue
+
+        if db_id not in dashboards:
+            dashboards[db_id] = {
+                'id': db_id,
+                'timestamps': [],
+                'task': None,
+                'rec_enabled': None,
+                'views_created': [],
+                'views_deleted': 0,
+                'final_view_count': 0
+            }
+
+        db = dashboards[db_id]
+        db['timestamps'].append(entry.get('timestamp'))
+
+        # Identify Task
+        if 'table_name' in entry:
+            tname = entry['table_name']
+            if tname == 'Wine Review':
+                db['task'] = 'Wine'
+            elif tname == 'Ufo Scrubbed':
+                db['task'] = 'UFO'
+
+        # Identify Condition
+        if 'recommendation_enabled' in entry:
+            db['rec_enabled'] = entry['recommendation_enabled']
+
+        # Count Views
+        if entry.get('action') == 'create_view':
+            c_type = entry.get('card_type')
+            # normalize
+            if c_type == 'pivot-table': c_type = 'pivot'
+            if c_type == 'scalar': c_type = 'value'
+            db['views_created'].append(c_type)
+            db['final_view_count'] += 1
+
+        if entry.get('action') == 'delete_view':
+            db['views_deleted'] += 1
+            db['final_view_count'] -= 1
 
     print("ID | Task | Cond | Time(m) | Add | Del | Final | Unique | Types")
     print("---|---|---|---|---|---|---|---|---")
@@ -2,27 +2,31 @@ import urllib.request
 import json
 import os
 
+import requests
+
+from metabase_session import TokenManager
+
 METABASE_URL = "http://metabase:3000"
 METABASE_USERNAME = os.environ.get('METABASE_USERNAME')
 METABASE_PASSWORD = os.environ.get('METABASE_PASSWORD')
 
-def get_session_token(username, password):
-    data = json.dumps({'username': username, 'password': password}).encode('utf-8')
-    req = urllib.request.Request(f'{METABASE_URL}/api/session', data=data, headers={'Content-Type': 'application/json'})
+# Session tokens are cached on disk and shared with the app and other tools
+token_manager = TokenManager(METABASE_URL)
+
+def get_session_token(username, password, force_refresh=False):
     try:
-        with urllib.request.urlopen(req) as response:
-            session_token = json.load(response).get('id')
-            print(f"Session token: {session_token}")
-            return session_token
-    except urllib.error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason}")
-        print(e.read().decode())
+        session_token = token_manager.get_token(username, password, force_refresh=force_refresh)
+        print(f"Session token: {session_token}")
+        return session_token
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP Error: {e.response.status_code} - {e.response.reason}")
+        print(e.response.text)
         raise
-    except urllib.error.URLError as e:
-        print(f"URL Error: {e.reason}")
+    except requests.exceptions.RequestException as e:
+        print(f"Request Error: {e}")
         raise
 
-def get_dashboards(session_token):
+def get_dashboards(session_token, _retried=False):
     url = f"{METABASE_URL}/api/dashboard"
     req = urllib.request.Request(url, headers={
         'Content-Type': 'application/json',
@@ -34,6 +38,11 @@ def get_dashboards(session_token):
             print(f"Dashboards: {json.dumps(dashboards, indent=2)}")
             return dashboards
     except urllib.error.HTTPError as e:
+        # Expired session: re-authenticate once and retry
+        if e.code == 401 and not _retried and METABASE_USERNAME and METABASE_PASSWORD:
+            print("Session expired. Re-authenticating...")
+            new_token = get_session_token(METABASE_USERNAME, METABASE_PASSWORD, force_refresh=True)
+            return get_dashboards(new_token, _retried=True)
         print(f"HTTP Error: {e.code} - {e.reason}")
         print(e.read().decode())
         raise
@@ -0,0 +1,220 @@
+import fcntl
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import requests
+
+# --- セッショントークンキャッシュ設定 ---
+TOKEN_CACHE_FILE = os.getenv("METABASE_TOKEN_CACHE_FILE", os.path.join("cache", "session_tokens.json"))
+# Metabase の MAX_SESSION_AGE の既定値 (14日) に合わせる
+SESSION_TTL_SEC = int(os.getenv("METABASE_SESSION_TTL_SEC", 14 * 24 * 60 * 60))
+# 期限切れの少し前に先回りして再ログインする
+REFRESH_MARGIN_SEC = int(os.getenv("METABASE_SESSION_REFRESH_MARGIN_SEC", 60 * 60))
+# キャッシュ済みトークンを返す前にパスワードを照合するためのハッシュの反復回数
+PASSWORD_HASH_ITERATIONS = 100_000
+# POST /api/session のタイムアウト (応答しないログインで他のリクエストを止めない)
+LOGIN_TIMEOUT_SEC = float(os.getenv("METABASE_LOGIN_TIMEOUT_SEC", 30))
+
+
+class TokenManager:
+    """
+    Metabase のセッショントークンをホストとユーザーごとに有効期限付きでキャッシュする。
+    トークンはファイルロック付きのローカルファイルでワーカープロセス間に共有する。
+    パスワードはプロセス内のメモリにのみ保持し、401 時の再認証に使用する。
+    ファイルにはパスワードのソルト付きハッシュをトークンと共に保存し、ログイン時にパスワードが一致する場合だけ
+    キャッシュ済みのトークンを返す (一致しなければ Metabase に問い合わせる)。
+    有効なトークンはファイルロックを取らずに読む (書き込みは os.replace で置き換えるため、読み込み途中に壊れない)。
+    ログインはユーザーごとのロックだけを取って行い、他のユーザーのリクエストやファイルロックを待たせない。
+    """
+
+    def __init__(self, api_url: str, cache_file: str = TOKEN_CACHE_FILE,
+                 ttl_sec: int = SESSION_TTL_SEC, refresh_margin_sec: int = REFRESH_MARGIN_SEC):
+        self.api_url = api_url
+        self.cache_file = cache_file
+        self.ttl_sec = ttl_sec
+        self.refresh_margin_sec = refresh_margin_sec
+        self._lock = threading.RLock()
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._store_cache: Optional[tuple] = None  # (ファイルの状態, 内容)
+        self._credentials: Dict[str, str] = {}  # key -> password
+        self._owners: Dict[str, str] = {}  # token -> key
+        self._replaced: Dict[str, str] = {}  # 失効したトークン -> 再認証後のトークン
+
+    def _key(self, username: str) -> str:
+        return f"{self.api_url}|{username}"
+
+    def _user_lock(self, key: str) -> threading.RLock:
+        with self._lock:
+            return self._user_locks.setdefault(key, threading.RLock())
+
+    # --- 共有ファイル ---
+    @contextmanager
+    def _locked_store(self):
+        """トークンファイルを排他ロックした上で読み込み、変更があれば書き戻す。"""
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(f"{self.cache_file}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                store = self._read_store()
+                before = json.dumps(store, sort_keys=True)
+                yield store
+                if json.dumps(store, sort_keys=True) != before:
+                    self._write_store(store)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_store(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read token cache {self.cache_file}: {e}")
+            return {}
+
+    def _peek_store(self) -> Dict[str, Dict[str, Any]]:
+        """ロックを取らずにトークンファイルを読む。ファイルが変わっていなければ前回読んだ内容を返す (変更しないこと)。"""
+        try:
+            stat = os.stat(self.cache_file)
+        except FileNotFoundError:
+            return {}
+        state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._store_cache
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        store = self._read_store()
+        self._store_cache = (state, store)
+        return store
+
+    def _write_store(self, store: Dict[str, Dict[str, Any]]):
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        # トークンを含むため所有者のみ読み書き可能にする
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(store, f)
+        os.replace(tmp_path, self.cache_file)
+
+    # --- 認証 ---
+    def _login(self, username: str, password: str) -> str:
+        response = requests.post(f"{self.api_url}/api/session", json={"username": username, "password": password},
+                                 timeout=LOGIN_TIMEOUT_SEC)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    @staticmethod
+    def _hash_password(password: str, salt: bytes) -> str:
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PASSWORD_HASH_ITERATIONS).hex()
+
+    def _password_matches(self, cached: Dict[str, Any], password: str) -> bool:
+        if "password_hash" not in cached or "salt" not in cached:
+            return False
+        expected = self._hash_password(password, bytes.fromhex(cached["salt"]))
+        return hmac.compare_digest(expected, cached["password_hash"])
+
+    def _remember(self, key: str, token: str, password: Optional[str] = None):
+        with self._lock:
+            self._owners[token] = key
+            if password is not None:
+                self._credentials[key] = password
+
+    def _usable(self, cached: Optional[Dict[str, Any]], password: Optional[str], verified: bool) -> Optional[Dict[str, Any]]:
+        # パスワードを確認できないトークンは返さない
+        if cached and verified and not self._password_matches(cached, password):
+            return None
+        return cached
+
+    def get_token(self, username: str, password: Optional[str] = None, force_refresh: bool = False) -> str:
+        """
+        キャッシュ済みのトークンを返す。期限切れ・期限間近・強制更新の場合は再ログインする。
+        password を渡した場合 (対話的なログイン) は、キャッシュに保存したハッシュと一致するときだけ
+        キャッシュ済みのトークンを返し、一致しなければ POST /api/session で認証する。
+        再ログインが必要なのにパスワードが不明な場合は KeyError を送出する。
+        """
+        key = self._key(username)
+        verified = password is not None
+        if password is None:
+            with self._lock:
+                password = self._credentials.get(key)
+        if not force_refresh:
+            cached = self._usable(self._peek_store().get(key), password, verified)
+            if cached and time.time() < cached["expires_at"] - self.refresh_margin_sec:
+                self._remember(key, cached["id"], password if verified else None)
+                return cached["id"]
+        with self._user_lock(key):
+            # ロックを待つ間に他のスレッド・プロセスが更新したトークンはそのまま再利用される
+            cached = self._usable(self._peek_store().get(key), password, verified)
+            now = time.time()
+            if cached and not force_refresh and now < cached["expires_at"] - self.refresh_margin_sec:
+                self._remember(key, cached["id"], password if verified else None)
+                return cached["id"]
+            if password is None:
+                if cached and not force_refresh and now < cached["expires_at"]:
+                    return cached["id"]
+                raise KeyError(f"No credentials for Metabase user '{username}'")
+            try:
+                token = self._login(username, password)
+            except requests.exceptions.RequestException as e:
+                # 先回りの更新に失敗しても、有効期限内の旧トークンは使い続ける (認証の失敗は除く)
+                rejected = getattr(e.response, "status_code", None) in (400, 401, 403)
+                if cached and not force_refresh and not rejected and now < cached["expires_at"]:
+                    return cached["id"]
+                raise
+            salt = os.urandom(16)
+            with self._locked_store() as store:
+                previous = store.get(key)
+                store[key] = {"id": token, "created_at": now, "expires_at": now + self.ttl_sec,
+                              "salt": salt.hex(), "password_hash": self._hash_password(password, salt)}
+            with self._lock:
+                if previous and previous["id"] != token:
+                    self._replaced[previous["id"]] = token
+            self._remember(key, token, password)
+            return token
+
+    def invalidate(self, username: str):
+        key = self._key(username)
+        with self._lock, self._locked_store() as store:
+            store.pop(key, None)
+
+    def resolve(self, session_id: str) -> str:
+        """再認証で置き換えられたトークンであれば最新のトークンを返す。"""
+        with self._lock:
+            while session_id in self._replaced:
+                session_id = self._replaced[session_id]
+            return session_id
+
+    # --- リクエスト ---
+    def request(self, method: str, path: str, session_id: str, **kwargs) -> requests.Response:
+        """
+        セッショントークン付きでリクエストを送る。
+        401 が返り、トークンの持ち主の認証情報が分かる場合は一度だけ再認証して再送する。
+        """
+        session_id = self.resolve(session_id)
+        headers = {**kwargs.pop("headers", {}), "X-Metabase-Session": session_id}
+        response = requests.request(method, f"{self.api_url}{path}", headers=headers, **kwargs)
+        if response.status_code != 401:
+            return response
+        with self._lock:
+            key = self._owners.get(session_id)
+            if key is None or key not in self._credentials:
+                return response
+        username = key.split("|", 1)[1]
+        with self._user_lock(key):
+            current = self.resolve(session_id)
+            # 他スレッドが既に再認証済みでなければ再ログインする
+            new_token = current if current != session_id else self.get_token(username, force_refresh=True)
+            if new_token != session_id:
+                with self._lock:
+                    self._replaced[session_id] = new_token
+        headers["X-Metabase-Session"] = new_token
+        retried = requests.request(method, f"{self.api_url}{path}", headers=headers, **kwargs)
+        retried.retry_count = 1  # RequestTracer が参照する
+        return retried
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+# --- メタデータキャッシュ設定 ---
+METADATA_CACHE_DIR = os.getenv("METADATA_CACHE_DIR", os.path.join("cache", "metadata"))
+METADATA_TTL_SEC = int(os.getenv("METADATA_TTL_SEC", 600))
+
+# テーブル一覧 (軽量インデックス) として保持するキー
+TABLE_INDEX_KEYS = ["id", "db_id", "name", "display_name", "schema", "description", "entity_type", "visibility_type", "updated_at"]
+
+
+class MetadataCache:
+    """
+    データベースIDをキーとしたテーブルメタデータのキャッシュ。
+    セッション間で共有し、ローカルディスクに永続化する。
+    テーブル一覧は軽量なインデックスとして保持し、フィールドはテーブル選択時に個別に読み込む。
+    TTLを過ぎたエントリは古い値を返しつつバックグラウンドで更新する。
+    """
+
+    def __init__(self, api_url: str, cache_dir: str = METADATA_CACHE_DIR, ttl_sec: int = METADATA_TTL_SEC,
+                 request: Optional[Callable[..., requests.Response]] = None):
+        self.api_url = api_url
+        # request(method, path, session_id) -> Response。省略時は requests で直接送信する
+        self._request = request or self._direct_request
+        self.cache_dir = cache_dir
+        self.ttl_sec = ttl_sec
+        self._lock = threading.RLock()
+        self._entries: Dict[int, Dict[str, Any]] = {}  # db_id -> {"fetched_at", "tables", "fields"}
+        self._refreshing = set()
+        self._target_db: Optional[Dict[str, Any]] = None  # {"id", "fetched_at"}
+        # 同じキーの取得が同時に起きても API を1度だけ呼ぶためのキーごとのロック
+        self._key_locks: Dict[Any, threading.Lock] = {}
+
+    # --- HTTP ---
+    def _direct_request(self, method: str, path: str, session_id: str, **kwargs) -> requests.Response:
+        return requests.request(method, f"{self.api_url}{path}", headers={"X-Metabase-Session": session_id}, **kwargs)
+
+    def _get_json(self, path: str, session_id: str) -> Any:
+        response = self._request("GET", path, session_id)
+        response.raise_for_status()
+        return response.json()
+
+    # --- ディスク永続化 ---
+    def _cache_path(self, db_id: int) -> str:
+        return os.path.join(self.cache_dir, f"db_{db_id}.json")
+
+    def _load_from_disk(self, db_id: int) -> Optional[Dict[str, Any]]:
+        path = self._cache_path(db_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # JSONのキーは文字列になるため、テーブルIDを数値に戻す
+            entry["fields"] = {int(k): v for k, v in entry.get("fields", {}).items()}
+            return entry
+        except (OSError, ValueError) as e:
+            print(f"Failed to read metadata cache {path}: {e}")
+            return None
+
+    def _save_to_disk(self, db_id: int, entry: Dict[str, Any]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(db_id)
+        # 他プロセスが読み込み中でも壊れたファイルを見ないよう、一時ファイル経由で置き換える
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write metadata cache {path}: {e}")
+
+    def _get_entry(self, db_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(db_id)
+            if entry is None:
+                entry = self._load_from_disk(db_id)
+                if entry is not None:
+                    self._entries[db_id] = entry
+            return entry
+
+    def _is_stale(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at > self.ttl_sec
+
+    def _key_lock(self, key: Any) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # --- 取得処理 ---
+    def _fetch_table_index(self, session_id: str, db_id: int) -> List[Dict]:
+        # skip_fields=true でフィールドを含まない軽量なテーブル一覧にする (非表示のテーブルも含める)
+        database = self._get_json(f"/api/database/{db_id}/metadata?include_hidden=true&skip_fields=true", session_id)
+        return [{k: tbl.get(k) for k in TABLE_INDEX_KEYS} for tbl in database.get("tables", [])]
+
+    def _fetch_table(self, session_id: str, table_id: int) -> Dict:
+        return self._get_json(f"/api/table/{table_id}/query_metadata?include_hidden_fields=true", session_id)
+
+    def _refresh_index(self, session_id: str, db_id: int):
+        tables = self._fetch_table_index(session_id, db_id)
+        with self._lock:
+            entry = self._entries.get(db_id) or {"fields": {}}
+            entry["tables"] = tables
+            entry["fetched_at"] = time.time()
+            # 同期時刻が変わったテーブルのフィールドは破棄する
+            updated_at = {t["id"]: t.get("updated_at") for t in tables}
+            entry["fields"] = {
+                table_id: cached for table_id, cached in entry["fields"].items()
+                if table_id in updated_at and cached["table"].get("updated_at") == updated_at[table_id]
+            }
+            self._entries[db_id] = entry
+            self._save_to_disk(db_id, entry)
+
+    def _refresh_in_background(self, session_id: str, db_id: int):
+        with self._lock:
+            if db_id in self._refreshing:
+                return
+            self._refreshing.add(db_id)
+
+        def run():
+            try:
+                self._refresh_index(session_id, db_id)
+            except requests.exceptions.RequestException as e:
+                print(f"Background metadata refresh failed for DB {db_id}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(db_id)
+
+        threading.Thread(target=run, name=f"metadata-refresh-{db_id}", daemon=True).start()
+
+    def get_target_database_id(self, session_id: str) -> Optional[int]:
+        """Sample Database以外の最初のデータベースIDを返す。結果はTTLの間だけ再利用する。"""
+        with self._key_lock("target_db"):
+            cached = self._target_db
+            if cached is not None and not self._is_stale(cached["fetched_at"]):
+                return cached["id"]
+            databases = self._get_json("/api/database", session_id).get("data", [])
+            target_db = next((db for db in databases if db["name"] != "Sample Database"), None)
+            self._target_db = {"id": target_db["id"], "fetched_at": time.time()} if target_db else None
+            return target_db["id"] if target_db else None
+
+    def get_table_index(self, session_id: str, db_id: int) -> List[Dict]:
+        """フィールドを含まないテーブル一覧を返す。期限切れの場合はバックグラウンドで更新する。"""
+        entry = self._get_entry(db_id)
+        if entry is None or "tables" not in entry:
+            with self._key_lock(("index", db_id)):
+                # 待っている間に他のスレッドが取得していれば、それを使う
+                entry = self._get_entry(db_id)
+                if entry is None or "tables" not in entry:
+                    self._refresh_index(session_id, db_id)
+                    entry = self._get_entry(db_id)
+        elif self._is_stale(entry.get("fetched_at", 0)):
+            self._refresh_in_background(session_id, db_id)
+        return entry["tables"]
+
+    def get_table(self, session_id: str, db_id: int, table_id: int) -> Optional[Dict]:
+        """フィールドを含むテーブルメタデータを返す。未取得の場合のみAPIから読み込む。"""
+        cached = self._cached_table(db_id, table_id)
+        if cached is not None:
+            return cached
+        with self._key_lock(("table", table_id)):
+            cached = self._cached_table(db_id, table_id)
+            if cached is not None:
+                return cached
+            table = self._fetch_table(session_id, table_id)
+            with self._lock:
+                entry = self._entries.setdefault(db_id, {"fields": {}})
+                entry["fields"][table_id] = {"fetched_at": time.time(), "table": table}
+                if "tables" in entry:
+                    self._save_to_disk(db_id, entry)
+            return table
+
+    def _cached_table(self, db_id: int, table_id: int) -> Optional[Dict]:
+        entry = self._get_entry(db_id)
+        if entry is not None:
+            cached = entry["fields"].get(table_id)
+            if cached is not None and not self._is_stale(cached["fetched_at"]):
+                return cached["table"]
+        return None
+
+    def invalidate(self, db_id: int):
+        with self._lock:
+            self._entries.pop(db_id, None)
+            try:
+                os.remove(self._cache_path(db_id))
+            except OSError:
+                pass
@@ -0,0 +1,126 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- プレビュー描画点数の上限 ---
+SCATTER_MAX_POINTS = int(os.getenv("PREVIEW_SCATTER_MAX_POINTS", 1000))
+LINE_MAX_POINTS = int(os.getenv("PREVIEW_LINE_MAX_POINTS", 500))
+# 散布図の密度を保つための格子の分割数 (各軸)
+SCATTER_GRID_SIZE = 64
+
+
+def _as_numeric(values: pd.Series) -> Optional[np.ndarray]:
+    """数値・日時の列を float 配列に変換する。変換できない (カテゴリなど) 場合は None。"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(values):
+        # Arrow / nullable 型の欠損値は NaN にする
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    if not (pd.api.types.is_string_dtype(values) or values.dtype == object):
+        return None
+    # Metabase は日時を ISO 8601 文字列で返す
+    converted = pd.to_datetime(values, errors="coerce", format="ISO8601", utc=True)
+    if converted.notna().all():
+        return converted.astype("int64").to_numpy(dtype=float)
+    return None
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets で残す点のインデックスを返す (x は昇順であること)。
+    前のバケツの選択点ではなく平均点を頂点に使う変種で、ループなしで全バケツを一度に計算する。
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # 先頭・末尾の点は常に残し、残りを threshold-2 個のバケツに分ける
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    bucket = np.searchsorted(edges, np.arange(1, n - 1), side="right") - 1
+    counts = np.bincount(bucket, minlength=threshold - 2)
+    mean_x = np.bincount(bucket, weights=x[1:-1], minlength=threshold - 2) / np.maximum(counts, 1)
+    mean_y = np.bincount(bucket, weights=y[1:-1], minlength=threshold - 2) / np.maximum(counts, 1)
+    # 各バケツの前後の頂点: 前のバケツの平均 (最初は先頭点) と次のバケツの平均 (最後は末尾点)
+    prev_x = np.concatenate([[x[0]], mean_x[:-1]])[bucket]
+    prev_y = np.concatenate([[y[0]], mean_y[:-1]])[bucket]
+    next_x = np.concatenate([mean_x[1:], [x[-1]]])[bucket]
+    next_y = np.concatenate([mean_y[1:], [y[-1]]])[bucket]
+    area = np.abs((prev_x - next_x) * (y[1:-1] - prev_y) - (prev_x - x[1:-1]) * (next_y - prev_y))
+    # バケツごとに面積最大の点を選ぶ (同じバケツ内では面積の降順に並べて先頭を取る)
+    order = np.lexsort((-area, bucket))
+    first = np.concatenate([[True], bucket[order][1:] != bucket[order][:-1]])
+    return np.concatenate([[0], order[first] + 1, [n - 1]])
+
+
+def density_sample_indices(x: np.ndarray, y: np.ndarray, max_points: int, seed: int = 0,
+                           grid_size: int = SCATTER_GRID_SIZE) -> np.ndarray:
+    """
+    散布図の点を格子に割り当て、各セルから同じ上限数まで無作為に残す。
+    密集した領域は間引かれ、外れ値などの疎な領域の点は残る。
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(n)
+
+    def cell_coord(values: np.ndarray) -> np.ndarray:
+        finite = np.isfinite(values)
+        low, high = (values[finite].min(), values[finite].max()) if finite.any() else (0.0, 0.0)
+        scaled = (values - low) / (high - low) * (grid_size - 1) if high > low else np.zeros(n)
+        return np.nan_to_num(scaled, nan=0.0).astype(int)
+
+    cell = (cell_coord(x) * grid_size + cell_coord(y))[shuffled]
+    # セル内の順位 (シャッフル済みなので無作為な順位になる)
+    order = np.argsort(cell, kind="stable")
+    sorted_cells = cell[order]
+    starts = np.concatenate([[0], np.flatnonzero(sorted_cells[1:] != sorted_cells[:-1]) + 1])
+    sizes = np.diff(np.concatenate([starts, [n]]))
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n) - np.repeat(starts, sizes)
+    # 合計が max_points 以下になる最大のセルあたり上限を求める (totals[q-1] = sum(min(size, q)))
+    sorted_sizes = np.sort(sizes)
+    quotas = np.arange(1, sorted_sizes[-1] + 1)
+    below = np.searchsorted(sorted_sizes, quotas, side="left")
+    totals = np.concatenate([[0], np.cumsum(sorted_sizes)])[below] + quotas * (len(sorted_sizes) - below)
+    quota = max(1, int(np.searchsorted(totals, max_points, side="right")))
+    keep = shuffled[rank < quota]
+    if len(keep) > max_points:
+        # セル数自体が上限を超える場合は、残った点からさらに無作為に選ぶ
+        keep = rng.choice(keep, max_points, replace=False)
+    return np.sort(keep)
+
+
+def downsample_for_chart(df: pd.DataFrame, chart_type: str) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    描画前にプレビュー用 DataFrame を間引き、(描画用 DataFrame, 元の行数) を返す。
+    間引かなかった場合の元の行数は None。
+    """
+    if len(df.columns) < 2:
+        return df, None
+    if chart_type == "scatter" and len(df) > SCATTER_MAX_POINTS:
+        x, y = _as_numeric(df.iloc[:, 0]), _as_numeric(df.iloc[:, 1])
+        if x is None or y is None:
+            # 数値でない軸は格子に割り当てられないため、単純な無作為抽出にする
+            indices = np.sort(np.random.default_rng(0).choice(len(df), SCATTER_MAX_POINTS, replace=False))
+        else:
+            indices = density_sample_indices(x, y, SCATTER_MAX_POINTS)
+        return df.iloc[indices].reset_index(drop=True), len(df)
+    if chart_type in ("line", "area") and len(df) > LINE_MAX_POINTS:
+        x = _as_numeric(df.iloc[:, 0])
+        if x is None:
+            x = np.arange(len(df), dtype=float)
+        order = np.argsort(x, kind="stable")
+        sorted_df = df.iloc[order].reset_index(drop=True)
+        x = x[order]
+        # 系列ごとに LTTB を行い、選ばれた点の和集合を残す (系列数で割って合計点数を抑える)
+        y_cols: List[str] = list(sorted_df.columns[1:])
+        per_series = max(3, LINE_MAX_POINTS // len(y_cols))
+        selected = [lttb_indices(x, np.nan_to_num(sorted_df[col].to_numpy(dtype=float, na_value=np.nan)), per_series)
+                    for col in y_cols if pd.api.types.is_numeric_dtype(sorted_df[col])]
+        if not selected:
+            return df, None
+        indices = np.unique(np.concatenate(selected))
+        return sorted_df.iloc[indices].reset_index(drop=True), len(df)
+    return df, None
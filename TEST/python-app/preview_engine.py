@@ -0,0 +1,339 @@
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import ConnectionPool
+except ImportError:  # 直接接続は任意機能のため、未インストールでもアプリは動作させる
+    psycopg = None
+
+from result_decoder import TEMPORAL_TYPES
+
+# --- プレビューエンジン設定 ---
+# "postgres" の場合、プレビュー・統計クエリを data_db に直接発行する (保存カードは常にMetabase経由)
+PREVIEW_ENGINE = os.getenv("PREVIEW_ENGINE", "metabase")
+PREVIEW_POOL_MAX_SIZE = int(os.getenv("PREVIEW_POOL_MAX_SIZE", 5))
+# Metabase の /api/dataset (アドホッククエリ) と同じ行数上限
+PREVIEW_ROW_LIMIT = 2000
+FETCH_CHUNK_ROWS = 500
+# プレビューで描画するセル数 (行数 x 列数) の目安。列が多いほど行数の上限を下げる
+PREVIEW_CELL_BUDGET = int(os.getenv("PREVIEW_CELL_BUDGET", 20000))
+PREVIEW_MIN_ROWS = 100
+# 全体がこの倍数以上ある場合は TABLESAMPLE で先に間引いてから無作為に並べる
+TABLESAMPLE_MIN_RATIO = 10
+
+TEMPORAL_UNITS = {"year", "quarter", "month", "week", "day", "hour", "minute"}
+TEMPORAL_UNIT_DISPLAY = {"year": "Year", "quarter": "Quarter", "month": "Month", "week": "Week", "day": "Day", "hour": "Hour", "minute": "Minute"}
+
+# MBQL集約 -> (SQL, Metabaseの列名, 表示名の書式)
+AGGREGATIONS = {
+    "count": ("COUNT(*)", "count", "Count"),
+    "sum": ("SUM({col})", "sum", "Sum of {name}"),
+    "avg": ("AVG({col})", "avg", "Average of {name}"),
+    "distinct": ("COUNT(DISTINCT {col})", "count", "Distinct values of {name}"),
+    "min": ("MIN({col})", "min", "Min of {name}"),
+    "max": ("MAX({col})", "max", "Max of {name}"),
+    "stddev": ("STDDEV_POP({col})", "stddev", "Standard deviation of {name}"),
+    "median": ("PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {col})", "median", "Median of {name}"),
+    "cum-sum": ("SUM(SUM({col})) OVER ({window})", "sum", "Cumulative sum of {name}"),
+    "cum-count": ("SUM(COUNT(*)) OVER ({window})", "count", "Cumulative count"),
+}
+# 列の型によらず小数になる集約 (Metabase も type/Float を返す)。sum / min / max は列の型を引き継ぐ
+FLOAT_AGGREGATIONS = {"avg", "stddev", "median", "percentile"}
+COMPARISON_OPERATORS = {"=": "=", "!=": "<>", ">": ">", "<": "<", ">=": ">=", "<=": "<="}
+
+
+class UnsupportedQueryError(Exception):
+    """直接実行できないMBQL (結合・式・ネイティブクエリなど)。Metabase経由で実行する。"""
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def preview_row_cap(num_columns: int) -> int:
+    """列数に応じたプレビューの行数上限。"""
+    return max(PREVIEW_MIN_ROWS, min(PREVIEW_ROW_LIMIT, PREVIEW_CELL_BUDGET // max(num_columns, 1)))
+
+
+def parse_filter_date(value: Any) -> Optional[date]:
+    """日付だけの値 ("2020-01-01") なら date、時刻付きの日時なら None を返す。どちらでもなければ UnsupportedQueryError。"""
+    if isinstance(value, str):
+        try:
+            if len(value) == 10:
+                return date.fromisoformat(value)
+            datetime.fromisoformat(value)
+            return None
+        except ValueError:
+            pass
+    raise UnsupportedQueryError(f"Unsupported temporal filter value: {value!r}")
+
+
+def is_raw_row_query(query: Dict[str, Any]) -> bool:
+    """集約もグループ化もない、行をそのまま返すクエリ (テーブル・散布図・ピンマップ) か。"""
+    return not query.get("aggregation") and not query.get("breakout")
+
+
+class MbqlCompiler:
+    """
+    クエリビルダーが生成するMBQLのサブセット (集約・時間粒度付きグループ化・フィルター・並び替え) を
+    PostgreSQL のパラメータ付きSQLに変換する。
+    """
+
+    def __init__(self, table: Dict[str, Any], fields: List[Dict[str, Any]]):
+        self.table = table
+        self.fields_by_id = {f["id"]: f for f in fields}
+        self.fields = fields
+        self.params: List[Any] = []
+
+    def _field(self, ref: Any) -> Tuple[str, Dict[str, Any], Optional[str]]:
+        """["field", id, options] -> (SQL式, フィールド情報, 時間粒度)"""
+        if not (isinstance(ref, list) and len(ref) >= 2 and ref[0] == "field" and isinstance(ref[1], int)):
+            raise UnsupportedQueryError(f"Unsupported field reference: {ref}")
+        options = ref[2] if len(ref) > 2 and ref[2] else {}
+        if "join-alias" in options or "binning" in options:
+            raise UnsupportedQueryError(f"Unsupported field options: {options}")
+        field = self.fields_by_id.get(ref[1])
+        if field is None:
+            raise UnsupportedQueryError(f"Unknown field id: {ref[1]}")
+        column = quote_ident(field["name"])
+        unit = options.get("temporal-unit")
+        if unit is None:
+            return column, field, None
+        if unit not in TEMPORAL_UNITS:
+            raise UnsupportedQueryError(f"Unsupported temporal unit: {unit}")
+        if unit == "week":
+            # Metabase の週は日曜始まり
+            return f"(DATE_TRUNC('week', {column} + INTERVAL '1 day') - INTERVAL '1 day')", field, unit
+        return f"DATE_TRUNC('{unit}', {column})", field, unit
+
+    def _filter(self, clause: List[Any]) -> str:
+        op = clause[0]
+        if op in ("and", "or"):
+            return "(" + f" {op.upper()} ".join(self._filter(c) for c in clause[1:]) + ")"
+        if op == "not":
+            return f"(NOT {self._filter(clause[1])})"
+        column, field, unit = self._field(clause[1])
+        if op == "is-null":
+            return f"{column} IS NULL"
+        if op == "not-null":
+            return f"{column} IS NOT NULL"
+        if unit is None and (field.get("effective_type") or field.get("base_type")) in TEMPORAL_TYPES:
+            return self._temporal_filter(op, column, clause[2:])
+        if op == "between":
+            self.params += [clause[2], clause[3]]
+            return f"{column} BETWEEN %s AND %s"
+        if op in COMPARISON_OPERATORS:
+            values = clause[2:]
+            self.params += values
+            if len(values) == 1:
+                return f"{column} {COMPARISON_OPERATORS[op]} %s"
+            # ["=", field, a, b] は IN 相当
+            placeholders = ", ".join(["%s"] * len(values))
+            return f"{column} {'NOT IN' if op == '!=' else 'IN'} ({placeholders})"
+        raise UnsupportedQueryError(f"Unsupported filter operator: {op}")
+
+    def _temporal_filter(self, op: str, column: str, values: List[Any]) -> str:
+        """
+        時間粒度のない日付・日時列のフィルター。Metabase と同じく日付だけの値はその日全体に一致させる
+        (= は [d, d+1日)、between の終わりはその日の終わりまで)。時刻付きの値はそのまま比較する。
+        """
+        days = [parse_filter_date(v) for v in values]
+        if op == "between":
+            start, end = days
+            self.params += [start or values[0], end + timedelta(days=1) if end else values[1]]
+            return f"({column} >= %s AND {column} {'<' if end else '<='} %s)"
+        if op in ("=", "!="):
+            conditions = []
+            for value, day in zip(values, days):
+                if day is None:
+                    self.params.append(value)
+                    conditions.append(f"{column} = %s")
+                else:
+                    self.params += [day, day + timedelta(days=1)]
+                    conditions.append(f"({column} >= %s AND {column} < %s)")
+            condition = conditions[0] if len(conditions) == 1 else "(" + " OR ".join(conditions) + ")"
+            return f"(NOT {condition})" if op == "!=" else condition
+        if op in COMPARISON_OPERATORS and len(values) == 1:
+            day = days[0]
+            if day is not None and op in (">", "<="):
+                # 「その日より後」は翌日以降、「その日以前」は翌日より前
+                self.params.append(day + timedelta(days=1))
+                return f"{column} {'>=' if op == '>' else '<'} %s"
+            self.params.append(day if day is not None else values[0])
+            return f"{column} {COMPARISON_OPERATORS[op]} %s"
+        raise UnsupportedQueryError(f"Unsupported temporal filter: {op} {values}")
+
+    def compile(self, query: Dict[str, Any], limit: Optional[int] = PREVIEW_ROW_LIMIT,
+                sample: Optional[Dict[str, int]] = None) -> Tuple[str, List[Any], List[Dict[str, Any]]]:
+        """
+        (SQL, パラメータ, Metabase形式の cols) を返す。
+        sample={"rows": N, "total": M} の場合、集約なしのクエリから N 行を無作為に抽出する。
+        limit=None の場合は行数を制限しない (エクスポート用)。
+        """
+        unsupported = set(query) - {"source-table", "aggregation", "breakout", "filter", "order-by", "fields", "limit"}
+        if unsupported:
+            raise UnsupportedQueryError(f"Unsupported query clauses: {sorted(unsupported)}")
+        self.params = []
+        select, cols, group_by = [], [], []
+
+        breakouts = [self._field(ref) for ref in query.get("breakout", [])]
+        for expr, field, unit in breakouts:
+            select.append(expr)
+            group_by.append(expr)
+            display = f"{field['display_name']}: {TEMPORAL_UNIT_DISPLAY[unit]}" if unit else field["display_name"]
+            cols.append({"name": field["name"], "display_name": display, "base_type": field.get("base_type"), "unit": unit})
+        window = "ORDER BY " + ", ".join(group_by) if group_by else ""
+
+        for aggregation in query.get("aggregation", []):
+            if aggregation[0] not in AGGREGATIONS:
+                raise UnsupportedQueryError(f"Unsupported aggregation: {aggregation[0]}")
+            sql_template, name, display_template = AGGREGATIONS[aggregation[0]]
+            column, field = None, None
+            if len(aggregation) > 1:
+                column, field, _ = self._field(aggregation[1])
+            elif "{col}" in sql_template:
+                raise UnsupportedQueryError(f"Aggregation needs a field: {aggregation}")
+            select.append(sql_template.format(col=column, window=window))
+            display = display_template.format(name=field["display_name"] if field else "")
+            if name == "count":
+                base_type = "type/Integer"
+            elif aggregation[0] in FLOAT_AGGREGATIONS:
+                base_type = "type/Float"
+            else:
+                base_type = (field or {}).get("base_type", "type/Float")
+            cols.append({"name": name, "display_name": display, "base_type": base_type})
+
+        if not select:
+            # 集約なし: 指定列 (未指定なら全列) をそのまま取得する
+            refs = query.get("fields") or [["field", f["id"], None] for f in self.fields if f.get("visibility_type") not in ("sensitive", "retired")]
+            for ref in refs:
+                expr, field, unit = self._field(ref)
+                select.append(expr)
+                cols.append({"name": field["name"], "display_name": field["display_name"], "base_type": field.get("base_type"), "unit": unit})
+
+        table = quote_ident(self.table["name"])
+        if self.table.get("schema"):
+            table = f"{quote_ident(self.table['schema'])}.{table}"
+        if sample and group_by:
+            raise UnsupportedQueryError("Sampling is only supported for raw-row queries")
+        if sample and sample["total"] >= sample["rows"] * TABLESAMPLE_MIN_RATIO:
+            # 必要行数の2倍程度をブロック単位ではなく行単位で抽出する (フィルターで減る分の余裕を含む)
+            percent = min(100.0, 200.0 * sample["rows"] / sample["total"])
+            table += f" TABLESAMPLE BERNOULLI ({percent:.4f}) REPEATABLE (0)"
+        sql = f"SELECT {', '.join(select)} FROM {table}"
+        if query.get("filter"):
+            sql += f" WHERE {self._filter(query['filter'])}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+
+        order_by = []
+        for direction, ref in query.get("order-by", []):
+            if isinstance(ref, list) and ref[0] == "aggregation":
+                target = len(breakouts) + ref[1] + 1
+            else:
+                target = self._field(ref)[0]
+            order_by.append(f"{target} {'DESC' if direction == 'desc' else 'ASC'}")
+        if not order_by and group_by:
+            # Metabase はグループ化列の昇順で返す
+            order_by = [f"{i + 1} ASC" for i in range(len(group_by))]
+        if sample:
+            order_by = ["RANDOM()"]
+            limit = sample["rows"]
+        if order_by:
+            sql += f" ORDER BY {', '.join(order_by)}"
+        if limit is not None:
+            sql += f" LIMIT {int(min(query.get('limit', limit), limit))}"
+        elif "limit" in query:
+            sql += f" LIMIT {int(query['limit'])}"
+        return sql, list(self.params), deduplicate_names(cols)
+
+
+def deduplicate_names(cols: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Metabase と同様、重複した列名には _2, _3 ... を付ける
+    counts: Dict[str, int] = {}
+    for col in cols:
+        counts[col["name"]] = counts.get(col["name"], 0) + 1
+        if counts[col["name"]] > 1:
+            col["name"] = f"{col['name']}_{counts[col['name']]}"
+    return cols
+
+
+class PreviewEngine:
+    """data_db にコネクションプール経由で接続し、サーバーサイドカーソルで結果を列指向に取得する。"""
+
+    def __init__(self, db_details: Dict[str, Any], max_size: int = PREVIEW_POOL_MAX_SIZE):
+        if psycopg is None:
+            raise RuntimeError("psycopg / psycopg_pool is not installed")
+        conninfo = make_conninfo(
+            host=db_details["host"], port=db_details["port"], dbname=db_details["dbname"],
+            user=db_details["user"], password=db_details["password"],
+        )
+        self.pool = ConnectionPool(conninfo, min_size=1, max_size=max_size, open=True, name="preview")
+        # 集計キューブのルーター (aggregate_cube.CubeRouter)。設定されていれば、該当する集約クエリをキューブから返す
+        self.router = None
+
+    def execute(self, dataset_query: Dict[str, Any], table: Dict[str, Any], fields: List[Dict[str, Any]],
+                sample: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """
+        MBQLをSQLに変換して実行し、Metabaseの /api/dataset と同じ構造の結果を返す。
+        ただし行データは data.rows ではなく列ごとのリスト data.columns に格納する。
+        """
+        if dataset_query.get("type") != "query" or "query" not in dataset_query:
+            raise UnsupportedQueryError("Only MBQL queries are supported")
+        compiled, source = None, "postgres"
+        if self.router is not None and sample is None:
+            compiled = self.router.route(dataset_query["query"], table, fields, limit=PREVIEW_ROW_LIMIT)
+            source = "cube"
+        if compiled is None:
+            compiled, source = MbqlCompiler(table, fields).compile(dataset_query["query"], sample=sample), "postgres"
+        sql, params, cols = compiled
+        columns: List[List[Any]] = [[] for _ in cols]
+        with self.pool.connection() as conn:
+            with conn.cursor(name=f"preview_{uuid.uuid4().hex}") as cur:
+                cur.itersize = FETCH_CHUNK_ROWS
+                cur.execute(sql, params)
+                while True:
+                    chunk = cur.fetchmany(FETCH_CHUNK_ROWS)
+                    if not chunk:
+                        break
+                    for i, values in enumerate(zip(*chunk)):
+                        columns[i].extend(values)
+        row_count = len(columns[0]) if columns else 0
+        return {"status": "completed", "row_count": row_count, "engine": source, "data": {"cols": cols, "columns": columns, "native_form": {"query": sql}}}
+
+    def explain(self, dataset_query: Dict[str, Any], table: Dict[str, Any], fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """実行せずに EXPLAIN で PostgreSQL の推定結果行数とコストを返す ({"rows", "total_cost"})。"""
+        if dataset_query.get("type") != "query" or "query" not in dataset_query:
+            raise UnsupportedQueryError("Only MBQL queries are supported")
+        sql, params, _ = MbqlCompiler(table, fields).compile(dataset_query["query"], limit=None)
+        with self.pool.connection() as conn:
+            plan = conn.execute(f"EXPLAIN (FORMAT JSON) {sql}", params).fetchone()[0][0]["Plan"]
+        return {"rows": int(plan["Plan Rows"]), "total_cost": float(plan["Total Cost"])}
+
+    def fetch_all(self, sql: str, params: Optional[List[Any]] = None) -> List[Tuple[Any, ...]]:
+        """集計など結果が小さいSQLを実行して全行を返す。"""
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.pool.close()
+
+
+def result_rows(result: Dict[str, Any]) -> List[List[Any]]:
+    """行指向 (Metabase) と列指向 (PreviewEngine) のどちらの結果からも行のリストを返す。"""
+    data = result["data"]
+    if "columns" in data:
+        return [list(row) for row in zip(*data["columns"])]
+    return data["rows"]
+
+
+def estimate_result_bytes(result: Dict[str, Any]) -> int:
+    """キャッシュの容量計算用の概算サイズ。"""
+    data = result["data"]
+    if "columns" in data:
+        return sum(len(col) for col in data["columns"]) * 16 + 1024
+    return sum(len(row) for row in data["rows"]) * 16 + 1024
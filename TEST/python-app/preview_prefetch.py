@@ -0,0 +1,188 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# --- プレビュー先読み設定 ---
+PREFETCH_MAX_WORKERS = int(os.getenv("PREFETCH_MAX_WORKERS", 2))
+# 1回の推薦で先読みするクエリ数の上限
+PREFETCH_MAX_QUERIES = int(os.getenv("PREFETCH_MAX_QUERIES", 6))
+# 前面のクエリ実行中は先読みを待たせ、この秒数を超えたら諦める
+PREFETCH_FOREGROUND_WAIT_SEC = float(os.getenv("PREFETCH_FOREGROUND_WAIT_SEC", 10))
+# 前面で実行するクエリを先読み中の場合、同じクエリを二重に送らずに完了を待つ秒数
+PREFETCH_INFLIGHT_WAIT_SEC = float(os.getenv("PREFETCH_INFLIGHT_WAIT_SEC", 30))
+
+NUMERIC_TYPES = ("integer", "float", "double", "decimal")
+TEMPORAL_TYPES = ("date", "time", "timestamp")
+# ビルダーの「時間粒度」の初期値 (日)
+DEFAULT_GRANULARITY = "day"
+# 行数カウント + グループ化で作るグラフ (ビルダーの集約方法の初期値が「行のカウント」のため)
+BREAKOUT_CHARTS = {"bar", "line", "area", "pie", "funnel", "waterfall"}
+TEMPORAL_FIRST_CHARTS = {"line", "area"}
+
+
+def _has_type(field: Dict[str, Any], types) -> bool:
+    return any(t in (field.get("base_type") or "").lower() for t in types)
+
+
+def _is_key(field: Dict[str, Any]) -> bool:
+    return field.get("semantic_type") in ("type/PK", "type/FK")
+
+
+def _breakout_ref(field: Dict[str, Any]) -> List[Any]:
+    # ビルダーと同じく、日時の列には既定の時間粒度を付ける
+    if _has_type(field, TEMPORAL_TYPES):
+        return ["field", field["id"], {"temporal-unit": DEFAULT_GRANULARITY}]
+    return ["field", field["id"], None]
+
+
+def recent_field_ids(recent_queries: List[Dict[str, Any]], table_id: int) -> List[int]:
+    """ログの直近のクエリ ({"display", "query"} のリスト) で使われた列IDを、新しいものから重複なしで返す。"""
+    field_ids: List[int] = []
+    for entry in reversed(recent_queries):
+        query = entry.get("query", {})
+        if query.get("source-table") != table_id:
+            continue
+        refs = query.get("breakout", []) + query.get("fields", []) + [a[1] for a in query.get("aggregation", []) if len(a) > 1]
+        for ref in refs:
+            if isinstance(ref, list) and len(ref) >= 2 and ref[0] == "field" and isinstance(ref[1], int) and ref[1] not in field_ids:
+                field_ids.append(ref[1])
+    return field_ids
+
+
+def candidate_queries(displays: List[str], table: Dict[str, Any], fields: List[Dict[str, Any]],
+                      recent_queries: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    推薦されたグラフ種別 (Metabaseの display) ごとに、ビルダーの初期設定で作られるクエリを推定する。
+    直近に同じ種別で作成したクエリがあればそれを、なければ直近に使った列・種別ごとに典型的な列を使う。
+    結合・フィルターは付けない。ピボットテーブル・地図のように列の指定が多い種別は対象外。
+    """
+    recent_queries = recent_queries or []
+    recent_ids = recent_field_ids(recent_queries, table["id"])
+    usable = [f for f in fields if not _is_key(f) and f.get("visibility_type") not in ("sensitive", "retired")]
+    # 直近に使った列を優先し、残りはテーブルの列順
+    ranked = sorted(usable, key=lambda f: recent_ids.index(f["id"]) if f["id"] in recent_ids else len(recent_ids))
+    numeric = [f for f in ranked if _has_type(f, NUMERIC_TYPES)]
+    temporal = [f for f in ranked if _has_type(f, TEMPORAL_TYPES)]
+    categorical = [f for f in ranked if not _has_type(f, NUMERIC_TYPES + TEMPORAL_TYPES)]
+
+    queries: List[Dict[str, Any]] = []
+    for display in displays:
+        replay = next((q.get("query") for q in reversed(recent_queries)
+                       if q.get("display") == display and q.get("query", {}).get("source-table") == table["id"]), None)
+        if replay:
+            queries.append(replay)
+            continue
+        base = {"source-table": table["id"]}
+        if display in BREAKOUT_CHARTS:
+            preferred = temporal + categorical if display in TEMPORAL_FIRST_CHARTS else categorical + temporal
+            if not preferred:
+                continue
+            query = {**base, "aggregation": [["count"]], "breakout": [_breakout_ref(preferred[0])]}
+            if display == "funnel":
+                query["order-by"] = [["desc", ["aggregation", 0]]]
+            queries.append(query)
+        elif display in ("scalar", "gauge"):
+            queries.append({**base, "aggregation": [["count"]]})
+        elif display == "scatter" and len(numeric) >= 2:
+            # ビルダーは [X軸, Y軸] の順で fields を作る
+            queries.append({**base, "fields": [["field", numeric[1]["id"], None], ["field", numeric[0]["id"], None]]})
+        elif display == "table":
+            queries.append(base)
+    unique: List[Dict[str, Any]] = []
+    for query in queries:
+        if query not in unique:
+            unique.append(query)
+    return unique[:PREFETCH_MAX_QUERIES]
+
+
+class PreviewPrefetcher:
+    """
+    推薦されたグラフのプレビュークエリを小さなスレッドプールで先読みし、結果をクエリキャッシュに入れる。
+    セッションごとに最新の予約だけを有効とし、前面 (ユーザー操作) のクエリ実行中は開始を待たせる。
+    実行中のクエリのキーを記録し、前面で同じクエリを実行する前に wait_for() で先読みの完了を待てるようにする。
+    """
+
+    def __init__(self, max_workers: int = PREFETCH_MAX_WORKERS, foreground_wait_sec: float = PREFETCH_FOREGROUND_WAIT_SEC):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview-prefetch")
+        self.foreground_wait_sec = foreground_wait_sec
+        self._cond = threading.Condition()
+        self._foreground = 0
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, int] = {}  # 実行中のクエリのキー -> 実行数
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def schedule(self, session_key: str, queries: List[Dict[str, Any]], run: Callable[[Dict[str, Any]], Any],
+                 key: Optional[Callable[[Dict[str, Any]], str]] = None):
+        """
+        session_key の既存の予約を取り消し、queries を run(query) で先読みする。
+        key(query) を渡すと、実行中はそのキーで wait_for() できる。
+        """
+        self.cancel(session_key)
+        cancelled = threading.Event()
+        futures = [self.executor.submit(self._run, cancelled, run, query, key(query) if key else None) for query in queries]
+        with self._cond:
+            self._jobs[session_key] = {"cancelled": cancelled, "futures": futures}
+
+    def cancel(self, session_key: str):
+        with self._cond:
+            job = self._jobs.pop(session_key, None)
+            if job:
+                job["cancelled"].set()
+                self._cond.notify_all()
+        if job:
+            for future in job["futures"]:
+                future.cancel()
+
+    @contextmanager
+    def foreground(self):
+        """ユーザー操作によるクエリ実行中であることを示す。この間は新しい先読みを開始しない。"""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def wait_for(self, key: str, timeout: float = PREFETCH_INFLIGHT_WAIT_SEC) -> bool:
+        """key のクエリを先読み中であれば完了まで待つ。待った結果、実行中でなくなっていれば True。"""
+        with self._cond:
+            return self._cond.wait_for(lambda: key not in self._inflight, timeout=timeout)
+
+    def _run(self, cancelled: threading.Event, run: Callable[[Dict[str, Any]], Any], query: Dict[str, Any],
+             key: Optional[str] = None):
+        with self._cond:
+            idle = self._cond.wait_for(lambda: self._foreground == 0 or cancelled.is_set(), timeout=self.foreground_wait_sec)
+            if cancelled.is_set() or not idle:
+                self.skipped += 1
+                return
+            if key is not None:
+                self._inflight[key] = self._inflight.get(key, 0) + 1
+        try:
+            run(query)
+            succeeded = True
+        except Exception as e:
+            succeeded = False
+            print(f"Preview prefetch failed: {e}")
+        # 件数は複数のワーカースレッドから更新するため、ロックを取って数える
+        with self._cond:
+            if key is not None:
+                self._inflight[key] -= 1
+                if not self._inflight[key]:
+                    del self._inflight[key]
+                self._cond.notify_all()
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = sum(1 for job in self._jobs.values() for f in job["futures"] if not f.done())
+            return {"pending": pending, "foreground": self._foreground, "inflight": len(self._inflight), "completed": self.completed,
+                    "skipped": self.skipped, "failed": self.failed}
@@ -1,23 +1,13 @@
 
-import json
+from log_loader import load_logs
 
-LOG_FILE = '/Users/jin/metabase/TEST/python-app/logs/app_log.jsonl'
 TARGET_DASHBOARDS = ['25', '26', '19', '20', '12', '5'] # Itai, Yugo, Takumi, Sako
 
 def print_details():
     dashboards = {id: [] for id in TARGET_DASHBOARDS}
     
-    with open(LOG_FILE, 'r') as f:
-        for line in f:
-            try:
-                entry = json.loads(line)
-            except:
-                continue
-            
-            db_id = entry.get('dashboard_id')
-            if db_id in TARGET_DASHBOARDS:
-                if entry.get('action') == 'create_view':
-                    dashboards[db_id].append(entry)
+    for entry in load_logs(dashboard_ids=TARGET_DASHBOARDS, actions=['create_view']):
+        dashboards[entry['dashboard_id']].append(entry)
 
     for db_id in TARGET_DASHBOARDS:
         print(f"\n=== Dashboard {db_id} ===")
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# --- クエリ結果キャッシュ設定 ---
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+QUERY_CACHE_DEFAULT_TTL_SEC = float(os.getenv("QUERY_CACHE_DEFAULT_TTL_SEC", 600))
+# テーブル名ごとのTTL (実験データは更新されないため長めに保持する)
+# 例: QUERY_CACHE_TABLE_TTLS='{"wine_review": 3600, "ufo_scrubbed": 3600}'
+QUERY_CACHE_TABLE_TTLS: Dict[str, float] = json.loads(os.getenv("QUERY_CACHE_TABLE_TTLS", "{}"))
+
+
+def normalize_mbql(value: Any) -> Any:
+    """
+    同じ意味のMBQLが同じキーになるよう正規化する。
+    - ["field-id", 1] / ["field", 1, {}] / ["field", 1, None] -> ["field", 1, None]
+    - フィールドオプション内の None 値は除去する
+    辞書キーの順序は json.dumps(sort_keys=True) で揃える。
+    """
+    if isinstance(value, dict):
+        return {k: normalize_mbql(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and value[0] == "field-id":
+            return ["field", value[1], None]
+        if len(value) in (2, 3) and value[0] == "field":
+            options = value[2] if len(value) == 3 else None
+            options = normalize_mbql(options) if isinstance(options, dict) else options
+            return ["field", normalize_mbql(value[1]), options or None]
+        return [normalize_mbql(v) for v in value]
+    return value
+
+
+def query_cache_key(dataset_query: Dict[str, Any]) -> str:
+    """データベースIDと正規化したMBQLから内容アドレスのキーを作る。"""
+    canonical = {
+        "database": dataset_query.get("database"),
+        "type": dataset_query.get("type", "query"),
+        "query": normalize_mbql(dataset_query.get("query", dataset_query.get("native"))),
+    }
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QueryResultCache:
+    """
+    /api/dataset の結果を保持する、合計バイト数上限付きのLRUキャッシュ。
+    プロセス内の全セッションで共有する。エントリごとにテーブル別のTTLを持つ。
+    返す結果は共有オブジェクトのため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES, default_ttl_sec: float = QUERY_CACHE_DEFAULT_TTL_SEC,
+                 table_ttls: Optional[Dict[str, float]] = None):
+        self.max_bytes = max_bytes
+        self.default_ttl_sec = default_ttl_sec
+        self.table_ttls = QUERY_CACHE_TABLE_TTLS if table_ttls is None else table_ttls
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def ttl_for(self, table_name: Optional[str]) -> float:
+        return self.table_ttls.get(table_name, self.default_ttl_sec) if table_name else self.default_ttl_sec
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["expires_at"] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def contains(self, key: str) -> bool:
+        """有効期限内の結果があるか。ヒット率の集計には数えない。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry["expires_at"] >= time.time()
+
+    def put(self, key: str, result: Dict, size_bytes: int, table_id: Optional[int] = None, table_name: Optional[str] = None):
+        # 1件で上限を超える結果はキャッシュしない
+        if size_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "result": result, "size": size_bytes, "table_id": table_id,
+                "expires_at": time.time() + self.ttl_for(table_name),
+            }
+            self.total_bytes += size_bytes
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry["size"]
+
+    def invalidate_table(self, table_id: int):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e["table_id"] == table_id]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            }
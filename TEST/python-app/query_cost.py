@@ -0,0 +1,184 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from preview_engine import is_raw_row_query
+
+# --- クエリコストのガードレール設定 ---
+# 予測実行時間がこの秒数を超える場合は警告し、COST_BLOCK_SEC を超える場合は確認なしでは実行しない
+COST_WARN_SEC = float(os.getenv("QUERY_COST_WARN_SEC", 2))
+COST_BLOCK_SEC = float(os.getenv("QUERY_COST_BLOCK_SEC", 10))
+# 実行時間の目安: DBの走査速度と、Metabase が結果をJSONにする速度 (行/秒)
+SCAN_ROWS_PER_SEC = 5_000_000
+RESULT_ROWS_PER_SEC = 20_000
+# 異なる値の数が行数に対してこの比率を超えるテキスト列は、自由記述の列とみなす
+FREE_TEXT_DISTINCT_RATIO = 0.5
+# 範囲の条件 (>, <, between) の選択率。PostgreSQL の既定の推定値と同じ
+RANGE_SELECTIVITY = 1 / 3
+
+# 時間粒度の1区間の長さ (秒)。粗い順
+UNIT_SECONDS = {
+    "year": 31_556_952, "quarter": 7_889_238, "month": 2_629_746, "week": 604_800,
+    "day": 86_400, "hour": 3_600, "minute": 60,
+}
+UNIT_LABELS = {"year": "年", "quarter": "四半期", "month": "月", "week": "週", "day": "日", "hour": "時間", "minute": "分"}
+
+
+def estimate_runtime_sec(scan_rows: float, result_rows: float) -> float:
+    return scan_rows / SCAN_ROWS_PER_SEC + result_rows / RESULT_ROWS_PER_SEC
+
+
+def _field_id(ref: Any) -> Optional[int]:
+    # 結合先の列は統計がないため対象外
+    if isinstance(ref, list) and len(ref) >= 2 and ref[0] == "field" and isinstance(ref[1], int):
+        if not (len(ref) > 2 and ref[2] and "join-alias" in ref[2]):
+            return ref[1]
+    return None
+
+
+def _temporal_groups(stats: Dict[str, Any], unit: str) -> Optional[float]:
+    """最小値・最大値の期間を時間粒度で区切った区間数。"""
+    if stats.get("min") is None or stats.get("max") is None:
+        return None
+    try:
+        span = (pd.Timestamp(stats["max"]) - pd.Timestamp(stats["min"])).total_seconds()
+    except (TypeError, ValueError):
+        return None
+    return span / UNIT_SECONDS[unit] + 1
+
+
+def _selectivity(clause: Optional[List[Any]], columns: Dict[int, Dict[str, Any]], row_count: int) -> float:
+    """フィルターで残る行の割合の推定値。統計のない列の条件は絞り込まないものとする。"""
+    if not clause:
+        return 1.0
+    op = clause[0]
+    if op == "and":
+        result = 1.0
+        for c in clause[1:]:
+            result *= _selectivity(c, columns, row_count)
+        return result
+    if op == "or":
+        remaining = 1.0
+        for c in clause[1:]:
+            remaining *= 1 - _selectivity(c, columns, row_count)
+        return 1 - remaining
+    if op == "not":
+        return 1 - _selectivity(clause[1], columns, row_count)
+    stats = columns.get(_field_id(clause[1]))
+    if stats is None:
+        return 1.0
+    null_ratio = (stats.get("null_count") or 0) / max(row_count, 1)
+    if op == "is-null":
+        return null_ratio
+    if op == "not-null":
+        return 1 - null_ratio
+    if op in ("=", "!="):
+        # 値ごとの件数が分かれば (上位の値) それを、分からなければ均等に分布しているものとする
+        top_values = {str(v): n for v, n in stats.get("top_values") or []}
+        distinct = max(stats.get("distinct") or 1, 1)
+        matched = sum(top_values.get(str(v), row_count / distinct) for v in clause[2:]) / max(row_count, 1)
+        matched = min(matched, 1.0)
+        return matched if op == "=" else 1 - matched
+    return RANGE_SELECTIVITY
+
+
+def estimate_query_cost(query: Dict[str, Any], table_stats: Optional[Dict[str, Any]],
+                        plan: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    列の統計 (ColumnStatsService のテーブル統計) から、クエリの走査行数・結果行数・実行時間を推定する。
+    plan (PreviewEngine.explain の結果) があれば、結果行数は PostgreSQL の推定値を使う。
+    統計がない場合は None。
+    戻り値: {"scan_rows", "rows", "groups": [(field_id, unit, 区間数)], "runtime_sec", "source"}
+    """
+    if not table_stats or table_stats.get("row_count") is None:
+        return None
+    row_count = table_stats["row_count"]
+    columns = table_stats["columns"]
+    filtered = row_count * _selectivity(query.get("filter"), columns, row_count)
+
+    groups = []
+    if is_raw_row_query(query):
+        rows = filtered
+    elif not query.get("breakout"):
+        rows = 1
+    else:
+        rows = 1.0
+        for ref in query["breakout"]:
+            stats = columns.get(_field_id(ref))
+            options = ref[2] if len(ref) > 2 and ref[2] else {}
+            unit = options.get("temporal-unit")
+            count = None
+            if stats is not None:
+                count = stats.get("distinct")
+                if unit in UNIT_SECONDS:
+                    span_groups = _temporal_groups(stats, unit)
+                    count = min(count, span_groups) if count is not None and span_groups is not None else (span_groups or count)
+            groups.append((_field_id(ref), unit, count))
+            # 統計のない列 (結合先など) は1区間として扱う
+            rows *= count or 1
+        rows = min(rows, filtered)
+    if "limit" in query:
+        rows = min(rows, query["limit"])
+
+    source = "stats"
+    if plan is not None:
+        rows, source = plan["rows"], "explain"
+    return {"scan_rows": int(row_count), "rows": int(rows), "groups": groups,
+            "runtime_sec": estimate_runtime_sec(row_count, rows), "source": source}
+
+
+def coarser_unit(stats: Dict[str, Any], unit: str, max_groups: int) -> Optional[str]:
+    """区間数が max_groups 以下になる最も細かい時間粒度 (unit より粗いもの)。"""
+    units = list(UNIT_SECONDS)
+    for candidate in reversed(units[:units.index(unit)]):
+        groups = _temporal_groups(stats, candidate)
+        if groups is not None and groups <= max_groups:
+            return candidate
+    return None
+
+
+def assess_query_cost(query: Dict[str, Any], estimate: Optional[Dict[str, Any]], table_stats: Optional[Dict[str, Any]],
+                      fields: List[Dict[str, Any]], row_cap: int) -> Dict[str, Any]:
+    """
+    推定値からプレビューを実行してよいかを判定する。
+    戻り値: {"level": "ok" | "warn" | "block", "messages": [str], "suggested_unit": {field_id: unit}}
+    block は利用者が確認するまで Metabase に送らない。行数の上限は execute_preview_query が自動で適用する。
+    """
+    assessment: Dict[str, Any] = {"level": "ok", "messages": [], "suggested_unit": {}}
+    if estimate is None:
+        return assessment
+
+    def raise_level(level: str, message: str):
+        if level == "block" or assessment["level"] == "ok":
+            assessment["level"] = level
+        assessment["messages"].append(message)
+
+    fields_by_id = {f["id"]: f for f in fields}
+    row_count = max(estimate["scan_rows"], 1)
+    for field_id, unit, count in estimate["groups"]:
+        field = fields_by_id.get(field_id)
+        if field is None or count is None:
+            continue
+        name = field.get("display_name", field.get("name"))
+        is_text = "text" in (field.get("base_type") or "").lower()
+        if unit is None and is_text and count > row_count * FREE_TEXT_DISTINCT_RATIO and count > row_cap:
+            raise_level("block", f"「{name}」はほぼ行ごとに値が異なる自由記述の列です (約 {int(count):,} 種類)。"
+                                 "グループ化には値の種類が少ない列を選んでください。")
+        elif unit in UNIT_SECONDS and count > row_cap:
+            suggested = coarser_unit(table_stats["columns"][field_id], unit, row_cap)
+            message = f"「{name}」を{UNIT_LABELS[unit]}単位でグループ化すると約 {int(count):,} 区間になります。"
+            if suggested:
+                assessment["suggested_unit"][field_id] = suggested
+                message += f"時間粒度を「{UNIT_LABELS[suggested]}」にすると {row_cap:,} 区間以内に収まります。"
+            raise_level("warn", message)
+
+    if estimate["rows"] > row_cap:
+        raise_level("warn", f"結果は約 {estimate['rows']:,} 行と推定されます。プレビューは {row_cap:,} 行に制限して表示します。")
+    # プレビューが受け取るのは上限までの行のみ
+    runtime_sec = estimate_runtime_sec(estimate["scan_rows"], min(estimate["rows"], row_cap + 1))
+    if runtime_sec > COST_BLOCK_SEC:
+        raise_level("block", f"実行に約 {runtime_sec:.0f} 秒かかると推定されます。")
+    elif runtime_sec > COST_WARN_SEC:
+        raise_level("warn", f"実行に約 {runtime_sec:.1f} 秒かかると推定されます。")
+    return assessment
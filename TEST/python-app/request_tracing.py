@@ -0,0 +1,197 @@
+import atexit
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+# --- トレース設定 ---
+METRICS_SNAPSHOT_FILE = os.path.join("logs", "metrics_snapshots.jsonl")
+PROMETHEUS_FILE = os.path.join("logs", "metabase_metrics.prom")
+METRICS_SNAPSHOT_SEC = float(os.getenv("METRICS_SNAPSHOT_SEC", 60))
+RECENT_TRACES_SIZE = 2000
+
+LATENCY_BUCKETS_SEC = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+SIZE_BUCKETS_BYTES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000]
+# ApiGuard がキャッシュから返した古い応答のステータス
+STALE_STATUS = "stale"
+
+# 現在のユーザー操作 (trace_id, action) をリクエストに紐付けるためのコンテキスト
+_current_action: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("current_action", default={})
+
+
+def begin_action(action: str, **attrs) -> str:
+    """以降のMetabaseリクエストを紐付けるユーザー操作を開始し、trace_id を返す。ユーザーIDなどの属性は引き継ぐ。"""
+    trace_id = uuid.uuid4().hex[:16]
+    inherited = {k: v for k, v in _current_action.get().items() if k not in ("trace_id", "action")}
+    _current_action.set({**inherited, "trace_id": trace_id, "action": action, **attrs})
+    return trace_id
+
+
+def current_action() -> Dict[str, Any]:
+    return _current_action.get()
+
+
+def endpoint_template(path: str) -> str:
+    """/api/dashboard/12?x=1 -> /api/dashboard/{id}"""
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path.split("?", 1)[0])
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result, total = [], 0
+        for bound, count in zip([str(b) for b in self.buckets] + ["+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"buckets": dict(self.cumulative()), "sum": self.sum, "count": self.count}
+
+
+class RequestTracer:
+    """
+    Metabase へのリクエストごとにエンドポイント・ステータス・バイト数・レイテンシ・リトライ回数を記録する。
+    集計はメモリ上のヒストグラムで保持し、Prometheus テキスト形式と JSONL スナップショットで出力する。
+    ApiGuard がキャッシュから返した古い応答は Metabase の応答ではないため、ステータス "stale" として数え、
+    レイテンシとバイト数のヒストグラムには含めない。
+    """
+
+    def __init__(self, snapshot_file: str = METRICS_SNAPSHOT_FILE, prometheus_file: str = PROMETHEUS_FILE):
+        self.snapshot_file = snapshot_file
+        self.prometheus_file = prometheus_file
+        self._lock = threading.Lock()
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.size: Dict[Tuple[str, str], Histogram] = {}
+        self.statuses: Dict[Tuple[str, str, str], int] = {}
+        self.retries: Dict[Tuple[str, str], int] = {}
+        self.recent = deque(maxlen=RECENT_TRACES_SIZE)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, method: str, path: str, status: str, latency_sec: float, size_bytes: int, retries: int,
+               stale: bool = False):
+        key = (method.upper(), endpoint_template(path))
+        trace = {
+            "timestamp": datetime.now().isoformat(),
+            "method": key[0], "endpoint": key[1], "status": STALE_STATUS if stale else status,
+            "latency_sec": latency_sec, "bytes": size_bytes, "retries": retries,
+            **({"stale": True, "cached_status": status} if stale else {}),
+            **current_action(),
+        }
+        if stale:
+            status = STALE_STATUS
+        with self._lock:
+            if not stale:
+                self.latency.setdefault(key, Histogram(LATENCY_BUCKETS_SEC)).observe(latency_sec)
+                self.size.setdefault(key, Histogram(SIZE_BUCKETS_BYTES)).observe(size_bytes)
+            self.statuses[key + (status,)] = self.statuses.get(key + (status,), 0) + 1
+            self.retries[key] = self.retries.get(key, 0) + retries
+            self.recent.append(trace)
+
+    def request(self, send: Callable[..., requests.Response], method: str, path: str, *args, **kwargs) -> requests.Response:
+        """send(method, path, *args, **kwargs) を計測しながら呼び出す。"""
+        start = time.perf_counter()
+        try:
+            response = send(method, path, *args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            status = str(e.response.status_code) if e.response is not None else type(e).__name__
+            self.record(method, path, status, time.perf_counter() - start, 0, 0)
+            raise
+        # ストリーミング応答は本文を読むと全体がメモリに載るため、Content-Length で代用する
+        size = int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(response.content or b"")
+        # 401 後の再認証リトライは TokenManager が retry_count に記録する
+        self.record(method, path, str(response.status_code), time.perf_counter() - start, size, getattr(response, "retry_count", 0),
+                    stale=getattr(response, "served_stale", False))
+        return response
+
+    # --- 出力 ---
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = {}
+            # 古い応答しか返していないエンドポイントはヒストグラムを持たない
+            for method, endpoint in sorted({(m, e) for m, e, _ in self.statuses}):
+                endpoints[f"{method} {endpoint}"] = {
+                    "latency_sec": self.latency.get((method, endpoint), Histogram(LATENCY_BUCKETS_SEC)).to_dict(),
+                    "bytes": self.size.get((method, endpoint), Histogram(SIZE_BUCKETS_BYTES)).to_dict(),
+                    "retries": self.retries.get((method, endpoint), 0),
+                    "statuses": {s: c for (m, e, s), c in self.statuses.items() if (m, e) == (method, endpoint)},
+                }
+            traces = list(self.recent)
+            self.recent.clear()
+        return {"timestamp": datetime.now().isoformat(), "pid": os.getpid(), "endpoints": endpoints, "traces": traces}
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP metabase_request_duration_seconds Latency of Metabase API requests.",
+            "# TYPE metabase_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (method, endpoint), hist in sorted(self.latency.items()):
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                for bound, count in hist.cumulative():
+                    lines.append(f'metabase_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"metabase_request_duration_seconds_sum{{{labels}}} {hist.sum}")
+                lines.append(f"metabase_request_duration_seconds_count{{{labels}}} {hist.count}")
+            lines += ["# HELP metabase_response_bytes Size of Metabase API responses.", "# TYPE metabase_response_bytes histogram"]
+            for (method, endpoint), hist in sorted(self.size.items()):
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                for bound, count in hist.cumulative():
+                    lines.append(f'metabase_response_bytes_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"metabase_response_bytes_sum{{{labels}}} {hist.sum}")
+                lines.append(f"metabase_response_bytes_count{{{labels}}} {hist.count}")
+            lines += ["# HELP metabase_requests_total Metabase API requests by status.", "# TYPE metabase_requests_total counter"]
+            for (method, endpoint, status), count in sorted(self.statuses.items()):
+                lines.append(f'metabase_requests_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}')
+            lines += ["# HELP metabase_request_retries_total Re-authentication retries.", "# TYPE metabase_request_retries_total counter"]
+            for (method, endpoint), count in sorted(self.retries.items()):
+                lines.append(f'metabase_request_retries_total{{method="{method}",endpoint="{endpoint}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """JSONL スナップショットを追記し、Prometheus テキストファイルを書き換える。"""
+        snapshot = self.snapshot()
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_file) or ".", exist_ok=True)
+            if snapshot["endpoints"]:
+                with open(self.snapshot_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+            tmp_path = f"{self.prometheus_file}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, self.prometheus_file)
+        except OSError as e:
+            print(f"Failed to write request metrics: {e}")
+
+    def start(self, interval_sec: float = METRICS_SNAPSHOT_SEC) -> "RequestTracer":
+        def run():
+            while not self._stop.wait(interval_sec):
+                self.flush()
+
+        self._thread = threading.Thread(target=run, name="request-tracer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,134 @@
+import json
+import re
+from datetime import timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # 標準の json で代用する (低速)
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow がない場合は pandas の nullable 型を使う
+    pa = None
+
+INTEGER_TYPES = ("type/Integer", "type/BigInteger")
+FLOAT_TYPES = ("type/Float", "type/Decimal", "type/Number", "type/Currency", "type/Percentage")
+TEMPORAL_TYPES = ("type/DateTime", "type/DateTimeWithLocalTZ", "type/DateTimeWithTZ", "type/DateTimeWithZoneOffset",
+                  "type/DateTimeWithZoneID", "type/Date", "type/Instant")
+TEXT_TYPES = ("type/Text", "type/TextLike")
+UTC_OFFSET_PATTERN = re.compile(r"(Z|[+-]\d{2}:\d{2})$")
+
+
+def decode_json(content: bytes) -> Any:
+    """/api/dataset などの応答本文をデコードする。orjson があれば使う。"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def preview_column_names(cols: List[Dict[str, Any]]) -> List[str]:
+    """cols の display_name から、重複がなくグラフに使える列名を作る。"""
+    names, counts = [], {}
+    for col in cols:
+        name = col["display_name"]
+        counts[name] = counts.get(name, 0) + 1
+        names.append(name if counts[name] == 1 else f"{name}_{counts[name]}")
+    # Altair/Streamlit fails if column names contain colons (interpreted as type encoding)
+    return [name.replace(":", "_") for name in names]
+
+
+def _parse_temporal(values: Sequence[Any]) -> pd.Series:
+    """
+    ISO 8601 の日時文字列を datetime 列にする。
+    Metabase は結果全体で同じUTCオフセットを付けて返すため、オフセットを外して numpy で一括変換し、
+    そのオフセットのタイムゾーンを付け直す (pandas のオフセット付き文字列の解析より大幅に速い)。
+    """
+    strings = [v for v in values if v is not None]
+    if strings and all(isinstance(v, str) for v in strings):
+        match = UTC_OFFSET_PATTERN.search(strings[0])
+        suffix = match.group(0) if match else ""
+        same_offset = all(v.endswith(suffix) for v in strings) if suffix else not any(UTC_OFFSET_PATTERN.search(v) for v in strings)
+        if same_offset:
+            naive = np.array(["NaT" if v is None else v[:len(v) - len(suffix)] for v in values], dtype="datetime64[ms]")
+            index = pd.DatetimeIndex(naive)
+            if suffix == "Z":
+                index = index.tz_localize("UTC")
+            elif suffix:
+                sign = 1 if suffix[0] == "+" else -1
+                index = index.tz_localize(timezone(sign * timedelta(hours=int(suffix[1:3]), minutes=int(suffix[4:6]))))
+            return pd.Series(index)
+    return pd.to_datetime(pd.Series(values, dtype=object), format="ISO8601")
+
+
+def _numeric_values(values: Sequence[Any], base_type: Optional[str]) -> Tuple[Sequence[Any], Optional[str]]:
+    """
+    数値の列の値と、実際の値に合う base_type を返す。
+    Integer の列に整数でない値 (1.5 や Decimal('1.5')) があれば切り捨てずに Float として扱い、
+    Decimal は float にする (ドライバーによって numeric 型の集計結果が Decimal で返る)。
+    """
+    if any(isinstance(v, Decimal) for v in values):
+        values = [float(v) if isinstance(v, Decimal) else v for v in values]
+    if base_type in INTEGER_TYPES and not all(v is None or isinstance(v, int) for v in values):
+        integral = all(v is None or (isinstance(v, (int, float)) and float(v).is_integer()) for v in values)
+        if integral:
+            values = [None if v is None else int(v) for v in values]
+        else:
+            base_type = "type/Float"
+    return values, base_type
+
+
+def _typed_column(values: Sequence[Any], base_type: Optional[str]):
+    """base_type に従って1列分の値を型付きの配列にする。変換できない場合は値のまま返す。"""
+    try:
+        if base_type in INTEGER_TYPES or base_type in FLOAT_TYPES:
+            values, base_type = _numeric_values(values, base_type)
+        if base_type in TEMPORAL_TYPES:
+            # 時間粒度付きの集計結果は "2024-01-01T00:00:00+09:00" のような文字列で返る。タイムゾーンは変換しない
+            return _parse_temporal(values)
+        if pa is not None:
+            if base_type in INTEGER_TYPES:
+                return pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.int64()))
+            if base_type in FLOAT_TYPES:
+                return pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.float64()))
+            if base_type == "type/Boolean":
+                return pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.bool_()))
+            if base_type in TEXT_TYPES:
+                return pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.string()))
+        else:
+            if base_type in INTEGER_TYPES:
+                return pd.array(values, dtype="Int64")
+            if base_type in FLOAT_TYPES:
+                return np.asarray(values, dtype=float)
+            if base_type == "type/Boolean":
+                return pd.array(values, dtype="boolean")
+            if base_type in TEXT_TYPES:
+                return pd.array(values, dtype="string")
+    except (TypeError, ValueError, OverflowError) as e:
+        # pyarrow の ArrowInvalid / ArrowTypeError もここで捕捉される
+        print(f"Falling back to untyped column for {base_type}: {e}")
+    return pd.Series(values, dtype=object).infer_objects()
+
+
+def result_to_frame(result: Dict[str, Any], column_names: List[str], max_rows: Optional[int] = None) -> pd.DataFrame:
+    """
+    /api/dataset 形式の結果を、cols の base_type に従った型付きの列から DataFrame にする。
+    行指向 (data.rows) は列ごとに転置してから変換し、列指向 (data.columns) はそのまま変換する。
+    pyarrow がある場合は Arrow バックエンドの列になる。
+    """
+    data = result["data"]
+    cols = data["cols"]
+    if "columns" in data:
+        columns = data["columns"]
+    else:
+        rows = data["rows"]
+        columns = list(zip(*rows)) if rows else [()] * len(cols)
+    if max_rows is not None:
+        columns = [c[:max_rows] for c in columns]
+    frame = {name: _typed_column(values, col.get("base_type")) for name, values, col in zip(column_names, columns, cols)}
+    return pd.DataFrame(frame, columns=column_names)
@@ -0,0 +1,254 @@
+"""
+カード・クエリの全件を CSV / Parquet にストリーミングで書き出す。
+結果全体をメモリ (DataFrame) に載せず、受信したチャンクごとにファイルへ書き込む。
+
+    python result_export.py card 42 --out exports/card_42.parquet --username root --password root
+    python result_export.py query query.json --out exports/query.csv --username root --password root
+    python result_export.py query query.json --out exports/query.parquet --direct --username root --password root
+"""
+import argparse
+import csv
+import json
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 出力のみ pyarrow が必要
+    pa = None
+
+from preview_engine import FETCH_CHUNK_ROWS, MbqlCompiler, UnsupportedQueryError
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_FORMATS = ("csv", "parquet")
+# Metabase からの受信・ファイル書き込みの単位
+STREAM_CHUNK_BYTES = 1024 * 1024
+# Metabase のエクスポートは大きな結果を返すため、クエリ用の既定より長く待つ
+EXPORT_TIMEOUT_SEC = 600
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+def arrow_type(base_type: Optional[str]):
+    """Metabase の base_type に対応する Arrow 型。日時はエクスポートの書式が版により異なるため文字列で保持する。"""
+    if base_type in ("type/Integer", "type/BigInteger"):
+        return pa.int64()
+    if base_type in ("type/Float", "type/Decimal", "type/Number", "type/Currency", "type/Percentage"):
+        return pa.float64()
+    if base_type == "type/Boolean":
+        return pa.bool_()
+    return pa.string()
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+
+def _report(progress: Optional[ProgressCallback], started: float, rows: int, bytes_written: int, done: bool = False):
+    if progress:
+        progress({"rows": rows, "bytes": bytes_written, "elapsed_sec": time.monotonic() - started, "done": done})
+
+
+def _tmp_path(out_path: str) -> str:
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    return f"{out_path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+# --- Metabase のエクスポートAPI経由 ---
+def _stream_csv_response(response: requests.Response, out_path: str, fmt: str, cols: Optional[List[Dict[str, Any]]],
+                         progress: Optional[ProgressCallback]) -> Dict[str, Any]:
+    """Metabase の CSV 応答をそのまま (csv) または Arrow の CSV ストリームリーダー経由で (parquet) 書き出す。"""
+    started = time.monotonic()
+    tmp_path = _tmp_path(out_path)
+    rows, size = 0, 0
+    try:
+        if fmt == "csv":
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                    f.write(chunk)
+                    size += len(chunk)
+                    # ヘッダー行を含み、値の中の改行も数えるため概算
+                    rows += chunk.count(b"\n")
+                    _report(progress, started, rows, size)
+            rows = max(rows - 1, 0)
+        else:
+            _require_pyarrow()
+            response.raw.decode_content = True
+            column_types = {c["display_name"]: arrow_type(c.get("base_type")) for c in cols or []}
+            reader = pa_csv.open_csv(
+                response.raw,
+                read_options=pa_csv.ReadOptions(block_size=STREAM_CHUNK_BYTES),
+                convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+            )
+            with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+                    size = os.path.getsize(tmp_path)
+                    _report(progress, started, rows, size)
+            size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        response.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _report(progress, started, rows, size, done=True)
+    return {"path": out_path, "rows": rows, "bytes": size}
+
+
+def export_card(request: Callable[..., requests.Response], session_id: str, card_id: int, out_path: str,
+                fmt: str = "csv", progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """保存済みカードの全件を POST /api/card/{id}/query/csv で受信しながら書き出す。"""
+    cols = None
+    if fmt == "parquet":
+        card = request("GET", f"/api/card/{card_id}", session_id)
+        card.raise_for_status()
+        cols = card.json().get("result_metadata") or []
+    # format_rows=false: 数値の桁区切りなどの表示用書式を付けずに出力させる
+    response = request("POST", f"/api/card/{card_id}/query/csv", session_id, data={"format_rows": "false"},
+                       stream=True, timeout=EXPORT_TIMEOUT_SEC)
+    response.raise_for_status()
+    return _stream_csv_response(response, out_path, fmt, cols, progress)
+
+
+def export_query(request: Callable[..., requests.Response], session_id: str, dataset_query: Dict[str, Any], out_path: str,
+                 fmt: str = "csv", progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """ビルダーのクエリの全件を POST /api/dataset/csv で受信しながら書き出す。"""
+    cols = None
+    if fmt == "parquet":
+        # 列の型を決めるため、1行だけ実行して cols を得る
+        probe_query = {**dataset_query, "query": {**dataset_query["query"], "limit": 1}}
+        probe = request("POST", "/api/dataset", session_id, json=probe_query)
+        probe.raise_for_status()
+        cols = probe.json()["data"]["cols"]
+    response = request("POST", "/api/dataset/csv", session_id, data={"query": json.dumps(dataset_query), "format_rows": "false"},
+                       stream=True, timeout=EXPORT_TIMEOUT_SEC)
+    response.raise_for_status()
+    return _stream_csv_response(response, out_path, fmt, cols, progress)
+
+
+# --- 分析用DBへの直接接続 ---
+def export_direct(engine, dataset_query: Dict[str, Any], table: Dict[str, Any], fields: List[Dict[str, Any]], out_path: str,
+                  fmt: str = "csv", progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """
+    PreviewEngine のコネクションプールとサーバーサイドカーソルで全件を取得し、チャンクごとに書き出す。
+    直接実行できないクエリは UnsupportedQueryError を送出する。
+    """
+    if dataset_query.get("type") != "query":
+        raise UnsupportedQueryError("Only MBQL queries are supported")
+    if fmt == "parquet":
+        _require_pyarrow()
+    sql, params, cols = MbqlCompiler(table, fields).compile(dataset_query["query"], limit=None)
+    started = time.monotonic()
+    tmp_path = _tmp_path(out_path)
+    rows = 0
+    try:
+        with engine.pool.connection() as conn:
+            with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+                cur.itersize = FETCH_CHUNK_ROWS
+                cur.execute(sql, params)
+                if fmt == "csv":
+                    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        writer.writerow([c["display_name"] for c in cols])
+                        while True:
+                            chunk = cur.fetchmany(FETCH_CHUNK_ROWS)
+                            if not chunk:
+                                break
+                            writer.writerows(chunk)
+                            rows += len(chunk)
+                            _report(progress, started, rows, f.tell())
+                else:
+                    writer = None
+                    try:
+                        while True:
+                            chunk = cur.fetchmany(FETCH_CHUNK_ROWS)
+                            if not chunk:
+                                break
+                            if writer is None:
+                                # 日時・numeric (Decimal) など DB の型はそのまま保つため、最初のチャンクから型を推定する
+                                inferred = [pa.array(values) for values in zip(*chunk)]
+                                schema = pa.schema([(c["name"], arr.type if arr.type != pa.null() else arrow_type(c.get("base_type")))
+                                                    for c, arr in zip(cols, inferred)])
+                                writer = pq.ParquetWriter(tmp_path, schema)
+                            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+                            writer.write_batch(pa.record_batch(columns, schema=schema))
+                            rows += len(chunk)
+                            _report(progress, started, rows, os.path.getsize(tmp_path))
+                    finally:
+                        if writer is not None:
+                            writer.close()
+                    if writer is None:
+                        pq.write_table(pa.table({c["name"]: pa.array([], type=arrow_type(c.get("base_type"))) for c in cols}), tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _report(progress, started, rows, size, done=True)
+    return {"path": out_path, "rows": rows, "bytes": size}
+
+
+def default_export_path(name: str, fmt: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}")
+
+
+def main():
+    from metabase_session import TokenManager
+
+    parser = argparse.ArgumentParser(description="カード・クエリの全件を CSV / Parquet に書き出す")
+    parser.add_argument("kind", choices=["card", "query"])
+    parser.add_argument("target", help="カードID、または dataset_query を含むJSONファイル")
+    parser.add_argument("--out", help="出力ファイル (拡張子で形式を判定。省略時は exports/ 以下)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS)
+    parser.add_argument("--url", default=os.getenv("METABASE_URL", "http://metabase:3000"))
+    parser.add_argument("--username", default=os.getenv("METABASE_USERNAME"))
+    parser.add_argument("--password", default=os.getenv("METABASE_PASSWORD"))
+    parser.add_argument("--direct", action="store_true", help="クエリを分析用DBで直接実行する (DATA_DB_* 環境変数)")
+    args = parser.parse_args()
+
+    fmt = args.format or (os.path.splitext(args.out)[1].lstrip(".") if args.out else "csv")
+    if fmt not in EXPORT_FORMATS:
+        parser.error(f"unsupported format: {fmt}")
+    token_manager = TokenManager(args.url)
+    session_id = token_manager.get_token(args.username, args.password)
+
+    def print_progress(p: Dict[str, Any]):
+        print(f"\r{p['rows']:>12,} rows  {p['bytes'] / 1e6:>10.1f} MB  {p['elapsed_sec']:>7.1f}s", end="\n" if p["done"] else "", flush=True)
+
+    if args.kind == "card":
+        out_path = args.out or default_export_path(f"card_{args.target}", fmt)
+        result = export_card(token_manager.request, session_id, int(args.target), out_path, fmt, print_progress)
+    else:
+        with open(args.target, "r", encoding="utf-8") as f:
+            dataset_query = json.load(f)
+        out_path = args.out or default_export_path("query", fmt)
+        if args.direct:
+            from metadata_cache import MetadataCache
+            from preview_engine import PreviewEngine
+
+            table_id = dataset_query["query"]["source-table"]
+            table = MetadataCache(args.url, request=token_manager.request).get_table(session_id, dataset_query["database"], table_id)
+            engine = PreviewEngine({
+                "host": os.getenv("DATA_DB_HOST", "data_db"), "port": int(os.getenv("DATA_DB_PORT", 5432)),
+                "dbname": os.getenv("DATA_DB_NAME", "data_db"), "user": os.getenv("DATA_DB_USER", "data_user"),
+                "password": os.getenv("DATA_DB_PASS", "data_password"),
+            })
+            try:
+                result = export_direct(engine, dataset_query, table, table.get("fields", []), out_path, fmt, print_progress)
+            finally:
+                engine.close()
+        else:
+            result = export_query(token_manager.request, session_id, dataset_query, out_path, fmt, print_progress)
+    print(f"Exported {result['rows']:,} rows to {result['path']}")
+
+
+if __name__ == "__main__":
+    main()
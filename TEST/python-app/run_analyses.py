@@ -0,0 +1,307 @@
+"""
+分析スクリプトをまとめて実行し、結果を1つのレポートのディレクトリに書き出す。
+
+各タスク (分析スクリプト) は、使う共有の入力 (analysis_inputs の操作ログ・セッション・グループ分け・アンケート) と
+共有の入力を通さずに読むファイルを宣言する。共有の入力は実行するタスクが使うものだけを親プロセスで1度作り、
+それからワーカーのプロセスを fork して独立したタスクを並列に実行する (fork できない環境では各ワーカーが作り直す)。
+タスクの結果 (標準出力と出力ファイル) は logs/.cache/analysis/tasks/ に残し、スクリプトとそれがインポートしている
+このディレクトリのモジュールのソース・入力の指紋・ファイルの指紋が変わっていなければ実行せずに再利用する。
+
+    reports/<日時>/<タスク>.txt      タスクの標準出力
+    reports/<日時>/<出力ファイル>    analysis_summary.csv など
+    reports/<日時>/run.json          タスクごとの状態 (ok / failed)・キャッシュを使ったか・実行時間
+
+    python run_analyses.py                        # すべてのタスク
+    python run_analyses.py generate_appendix      # 論文の付録だけ
+    python run_analyses.py --list
+    python run_analyses.py --force --jobs 4       # キャッシュを使わずに4プロセスで実行
+"""
+import argparse
+import ast
+import contextlib
+import functools
+import glob
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import analysis_inputs
+from analysis_inputs import ANALYSIS_CACHE_DIR, DATA_DIR, file_fingerprint
+from log_loader import LOG_DIR, discover_log_files
+
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+TASK_CACHE_DIR = os.path.join(ANALYSIS_CACHE_DIR, "tasks")
+TASK_CACHE_VERSION = 1
+RESULT_FILE = "result.json"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Task:
+    """
+    分析スクリプト1つ分のタスク。スクリプト (name.py) の calls の関数を順に呼ぶ。
+    inputs は analysis_inputs の共有の入力の名前、files は共有の入力を通さずに読むファイル。
+    outputs は {スクリプトの変数名: ファイル名} で、出力先の変数をタスクのディレクトリに向けてから呼ぶ。
+    """
+
+    def __init__(self, name: str, calls: Sequence[str] = ("analyze",), inputs: Sequence[str] = (),
+                 files: Callable[[], Sequence[str]] = lambda: (), outputs: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.calls = tuple(calls)
+        self.inputs = tuple(inputs)
+        self.files = files
+        self.outputs = dict(outputs or {})
+
+
+def _data_files(*names: str) -> Callable[[], List[str]]:
+    return lambda: [os.path.join(DATA_DIR, name) for name in names]
+
+
+OLYMPICS = _data_files("athlete_events.csv")
+
+# check_health.py は Metabase に接続するため含めない
+TASKS: Dict[str, Task] = {task.name: task for task in [
+    Task("analyze_logs", calls=["main"], inputs=["logs", "user_sessions"],
+         outputs={"OUTPUT_CSV": "analysis_summary.csv", "OUTPUT_HISTORY": "user_history.txt"}),
+    Task("analyze_all", inputs=["logs"]),
+    Task("analyze_dash_7_8", inputs=["logs"]),
+    Task("analyze_dashboard_logs", inputs=["logs"]),
+    Task("analyze_rec_effectiveness", inputs=["logs"]),
+    Task("analyze_recent_logs", inputs=["logs"]),
+    Task("analyze_reduction_rates", inputs=["logs"]),
+    Task("analyze_view_usage_list", inputs=["logs"]),
+    Task("count_rec_types", inputs=["logs"]),
+    Task("find_candidate_dashboards", calls=["analyze_dashboards"], inputs=["logs"]),
+    Task("map_users", calls=["analyze_participants"], inputs=["logs"]),
+    Task("analyze_hanawa", files=discover_log_files),
+    Task("print_dashboard_details", calls=["print_details"], files=discover_log_files),
+    Task("analyze_specific_experiment",
+         files=lambda: [os.path.join(LOG_DIR, "archive_20251209_085844", "app_log.jsonl")]),
+    Task("analyze_multi_user_experiment", inputs=["dashboard_sessions"]),
+    Task("analyze_multi_user_experiment_refined", inputs=["dashboard_sessions"]),
+    Task("analyze_created_views", inputs=["logs", "group_mapping"]),
+    Task("analyze_new_metrics", inputs=["logs", "group_mapping"]),
+    Task("analyze_unique_views", inputs=["logs", "group_mapping"]),
+    Task("analyze_full_experiment", inputs=["logs", "dashboard_sessions", "group_mapping", "survey"]),
+    Task("analyze_user_details", inputs=["logs", "group_rows", "survey"]),
+    Task("generate_appendix", calls=["main"], inputs=["logs", "group_mapping", "survey"]),
+    Task("analyze_survey", calls=["main"], inputs=["survey"]),
+    Task("debug_survey_details", inputs=["group_rows", "survey"]),
+    Task("verify_task_survey", calls=["main"], inputs=["group_mapping", "survey"]),
+    Task("analyze_rec_correlation"),
+    Task("analyze_user_sensitivity"),
+    Task("format_summary", calls=["main"]),
+    Task("analyze_data_for_answers", calls=["analyze_ufo", "analyze_wine"],
+         files=_data_files("UFOscrubbed.csv", "wineReview.csv")),
+    Task("analyze_data_for_tasks", calls=["analyze_olympics", "analyze_wine", "analyze_social_media", "analyze_ufo"],
+         files=_data_files("athlete_events.csv", "wineReview.csv", "social_media_ads.csv", "UFOscrubbed.csv")),
+    Task("generate_data_descriptions", calls=["main"],
+         files=_data_files("athlete_events.csv", "wineReview.csv", "social_media_ads.csv", "UFOscrubbed.csv")),
+    Task("analyze_superpower_details", calls=["analyze_superpower_details"], files=OLYMPICS),
+    Task("check_nocs", calls=["check_nocs"], files=OLYMPICS),
+    Task("check_olympics", calls=["check_dominance"], files=OLYMPICS),
+    Task("check_urs_rus", calls=["check_urs_rus"], files=OLYMPICS),
+    Task("compare_superpowers", calls=["compare_superpowers"], files=OLYMPICS),
+]}
+
+
+# --- キャッシュのキー ---
+@functools.lru_cache(maxsize=None)
+def _read_source(path: str) -> Tuple[str, Tuple[str, ...]]:
+    """ファイルの内容のハッシュと、インポートしているモジュール (関数の中でのインポートも含む)。"""
+    with open(path, "rb") as f:
+        source = f.read()
+    modules = []
+    for node in ast.walk(ast.parse(source, filename=path)):
+        if isinstance(node, ast.Import):
+            modules += [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module.split(".")[0])
+    return hashlib.sha1(source).hexdigest(), tuple(dict.fromkeys(modules))
+
+
+def local_sources(module: str, seen: Optional[set] = None) -> List[str]:
+    """スクリプトと、それが (間接的にも) インポートしているこのディレクトリのモジュールのファイル。"""
+    seen = set() if seen is None else seen
+    path = os.path.join(SCRIPT_DIR, f"{module}.py")
+    if module in seen or not os.path.exists(path):
+        return []
+    seen.add(module)
+    paths = [path]
+    for name in _read_source(path)[1]:
+        paths += local_sources(name, seen)
+    return paths
+
+
+def task_key(task: Task) -> str:
+    digest = hashlib.sha1(f"{TASK_CACHE_VERSION}\0{task.name}\0{task.calls}\0{sorted(task.outputs.items())}".encode("utf-8"))
+    for path in sorted(local_sources(task.name)):
+        digest.update(f"\0{os.path.basename(path)}={_read_source(path)[0]}".encode("utf-8"))
+    for name in task.inputs:
+        digest.update(f"\0{name}={analysis_inputs.fingerprint(name)}".encode("utf-8"))
+    digest.update(file_fingerprint(task.files()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_dir(name: str, key: str) -> str:
+    return os.path.join(TASK_CACHE_DIR, f"{name}-{key}")
+
+
+# --- タスクの実行 ---
+def run_task(name: str, work_dir: str) -> Dict[str, Any]:
+    """タスクを実行し、標準出力 (と標準エラー出力) を work_dir/<タスク>.txt に、出力ファイルを work_dir に書く。"""
+    task = TASKS[name]
+    start = time.perf_counter()
+    error = None
+    with open(os.path.join(work_dir, f"{name}.txt"), "w", encoding="utf-8") as out, \
+            contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            module = importlib.import_module(name)
+            for attr, filename in task.outputs.items():
+                setattr(module, attr, os.path.join(work_dir, filename))
+            for call in task.calls:
+                getattr(module, call)()
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f"SystemExit: {e.code}"
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+    return {"status": "failed" if error else "ok", "seconds": round(time.perf_counter() - start, 3),
+            "error": error.strip().splitlines()[-1] if error else None}
+
+
+def _copy_results(src_dir: str, report_dir: str):
+    for path in glob.glob(os.path.join(src_dir, "*")):
+        if os.path.basename(path) != RESULT_FILE:
+            shutil.copy2(path, report_dir)
+
+
+def _store(name: str, key: str, work_dir: str, result: Dict[str, Any]) -> str:
+    """成功したタスクの結果をキャッシュに移し、同じタスクの古い結果を消す。移動先を返す。"""
+    with open(os.path.join(work_dir, RESULT_FILE), "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    for old in glob.glob(os.path.join(TASK_CACHE_DIR, f"{name}-*")):
+        if os.path.basename(old).rsplit("-", 1)[0] == name:
+            shutil.rmtree(old, ignore_errors=True)
+    os.replace(work_dir, _cache_dir(name, key))
+    return _cache_dir(name, key)
+
+
+def run(names: Sequence[str], report_dir: str, jobs: int = 1, force: bool = False) -> Dict[str, Any]:
+    """タスクを実行 (またはキャッシュから再利用) し、結果を report_dir に書く。run.json の内容を返す。"""
+    os.makedirs(report_dir, exist_ok=True)
+    os.makedirs(TASK_CACHE_DIR, exist_ok=True)
+    started = time.perf_counter()
+    results: Dict[str, Dict[str, Any]] = {}
+
+    pending = []
+    for name in names:
+        key = task_key(TASKS[name])
+        cached = os.path.join(_cache_dir(name, key), RESULT_FILE)
+        if not force and os.path.exists(cached):
+            with open(cached, "r", encoding="utf-8") as f:
+                results[name] = {**json.load(f), "cached": True}
+            _copy_results(os.path.dirname(cached), report_dir)
+        else:
+            pending.append((name, key))
+
+    # 実行するタスクが使う共有の入力だけを、ワーカーを fork する前に作っておく
+    inputs: Dict[str, Dict[str, Any]] = {}
+    for name in dict.fromkeys(input_name for task_name, _ in pending for input_name in TASKS[task_name].inputs):
+        start = time.perf_counter()
+        try:
+            analysis_inputs.prepare(name)
+            inputs[name] = {"status": "ok", "seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            inputs[name] = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+    runnable = []
+    for name, key in pending:
+        failed = [input_name for input_name in TASKS[name].inputs if inputs[input_name]["status"] != "ok"]
+        if failed:
+            error = "; ".join(f"input {input_name}: {inputs[input_name]['error']}" for input_name in failed)
+            with open(os.path.join(report_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write(error + "\n")
+            results[name] = {"status": "failed", "seconds": 0.0, "error": error, "cached": False}
+        else:
+            runnable.append((name, key, tempfile.mkdtemp(prefix=f".{name}-", dir=TASK_CACHE_DIR)))
+
+    def finish(name: str, key: str, work_dir: str, result: Dict[str, Any]):
+        if result["status"] == "ok":
+            work_dir = _store(name, key, work_dir, result)
+        _copy_results(work_dir, report_dir)
+        if result["status"] != "ok":
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results[name] = {**result, "cached": False}
+
+    if jobs > 1 and len(runnable) > 1:
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=min(jobs, len(runnable)), mp_context=context) as executor:
+            futures = {executor.submit(run_task, name, work_dir): (name, key, work_dir) for name, key, work_dir in runnable}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカーのプロセスが異常終了した場合
+                    result = {"status": "failed", "seconds": 0.0, "error": f"{type(e).__name__}: {e}"}
+                finish(*futures[future], result)
+    else:
+        for name, key, work_dir in runnable:
+            finish(name, key, work_dir, run_task(name, work_dir))
+
+    summary = {
+        "created_at": datetime.now().isoformat(), "jobs": jobs, "force": force,
+        "seconds": round(time.perf_counter() - started, 3), "inputs": inputs,
+        "tasks": {name: results[name] for name in names},
+    }
+    with open(os.path.join(report_dir, "run.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析スクリプトをまとめて実行し、結果をレポートのディレクトリに書き出す")
+    parser.add_argument("tasks", nargs="*", help="実行するタスク (省略するとすべて)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="並列に実行するプロセスの数")
+    parser.add_argument("--force", action="store_true", help="キャッシュした結果を使わずに実行し直す")
+    parser.add_argument("--report-dir", help=f"結果の書き出し先 (省略すると {REPORT_DIR}/<日時>)")
+    parser.add_argument("--list", action="store_true", help="タスクと入力の一覧を表示する")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.tasks if name not in TASKS]
+    if unknown:
+        parser.error(f"unknown tasks: {', '.join(unknown)}")
+    if args.list:
+        for task in TASKS.values():
+            print(f"{task.name}: {', '.join(task.inputs) or '-'}")
+        return
+
+    names = args.tasks or list(TASKS)
+    report_dir = args.report_dir or os.path.join(REPORT_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    summary = run(names, report_dir, jobs=max(1, args.jobs), force=args.force)
+
+    for name, input_result in summary["inputs"].items():
+        if input_result["status"] != "ok":
+            print(f"Input {name} failed: {input_result['error']}")
+    for name, result in summary["tasks"].items():
+        timing = "cached" if result["cached"] else f"{result['seconds']:.2f}s"
+        print(f"{name:<40} {result['status']:<6} {timing:>8}" + (f"  {result['error']}" if result["error"] else ""))
+    failed = sum(result["status"] != "ok" for result in summary["tasks"].values())
+    cached = sum(result["cached"] for result in summary["tasks"].values())
+    print(f"{len(names) - failed} ok, {failed} failed ({cached} cached) in {summary['seconds']:.2f}s -> {report_dir}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from typing import Any, Callable, Dict, List, Optional
+
+# ブラウザの sessionStorage に置く操作ログのキー。チャンクごとに別のキーへ追記し、既存のチャンクは書き換えない
+CHUNK_INDEX_KEY = "operation_log_chunks"
+CHUNK_KEY_PREFIX = "operation_log_"
+# 以前の形式 (全件を1つの配列で保存) のキー
+LEGACY_KEY = "operation_log"
+
+
+def chunk_key(index: int) -> str:
+    return f"{CHUNK_KEY_PREFIX}{index}"
+
+
+class SessionLogBuffer:
+    """
+    1つのブラウザセッションの操作ログをサーバー側に追記していく。
+    ブラウザへの保存はまだ送っていないエントリだけを1つのチャンクとして送るため、
+    1回の同期で送る量はログ全体の長さによらず、前回の同期以降のエントリ数だけになる。
+    """
+
+    def __init__(self, entries: Optional[List[Dict[str, Any]]] = None, chunks: int = 0):
+        self.entries: List[Dict[str, Any]] = list(entries or [])
+        self.chunks = chunks
+        self.synced = len(self.entries)
+
+    def append(self, entry: Dict[str, Any]):
+        self.entries.append(entry)
+
+    def tail(self, count: int) -> List[Dict[str, Any]]:
+        return self.entries[-count:]
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """ブラウザにまだ保存していないエントリ。"""
+        return self.entries[self.synced:]
+
+    def sync(self, set_item: Callable[[str, Any], None]) -> int:
+        """未保存のエントリを新しいチャンクとして set_item(key, value) で保存し、送ったエントリ数を返す。"""
+        pending = self.pending()
+        if not pending:
+            return 0
+        set_item(chunk_key(self.chunks), pending)
+        self.chunks += 1
+        set_item(CHUNK_INDEX_KEY, self.chunks)
+        self.synced = len(self.entries)
+        return len(pending)
+
+    @classmethod
+    def restore(cls, get_item: Callable[[str], Any]) -> "SessionLogBuffer":
+        """ブラウザに保存されたチャンク (と以前の形式の配列) から、ページの再読み込み前のログを復元する。"""
+        entries = list(get_item(LEGACY_KEY) or [])
+        chunks = get_item(CHUNK_INDEX_KEY) or 0
+        for index in range(chunks):
+            entries.extend(get_item(chunk_key(index)) or [])
+        return cls(entries, chunks)
@@ -0,0 +1,312 @@
+"""
+操作ログのセッション分割と集計を、列形式の DataFrame に対してまとめて (行ごとのループなしで) 行う。
+
+入力は log_loader.load_logs() のエントリを logs_to_frame() で変換したもの、
+または event_store.load_events() の DataFrame (列名が同じなのでそのまま使える)。
+
+    frame = logs_to_frame(load_logs())
+    sessions = sessionize(frame, by=("user_id",), split="login")   # analyze_logs と同じ分け方
+    metrics = session_metrics(sessions)
+    windows = window_metrics(sessions, window_sec=300)
+
+セッションの分け方 (split):
+    "login"      login のたびに全ユーザーのセッションを切り替える (analyze_logs の従来の分け方)
+    "gap"        グループ (by) ごとに、操作の間隔が gap_sec を超えたら切り替える
+    "login+gap"  グループごとに、そのグループの login か gap_sec を超える間隔で切り替える
+    "none"       グループ (by) をそのまま1つのセッションにする (ダッシュボードごとの集計など)
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 集計に使う列。キーがないエントリの値 (従来のスクリプトの log.get(key, 既定値) と同じ)
+FRAME_COLUMNS = {
+    "timestamp": None,
+    "user_id": "unknown",
+    "dashboard_id": None,
+    "action": None,
+    "recommendation_enabled": None,
+    "recommendation_source": "custom",
+    "task_duration_sec": None,
+    "card_type": "unknown",
+    "table_name": None,
+}
+SPLITS = ("login", "gap", "login+gap", "none")
+# split="gap" で同じセッションとみなす操作の間隔の上限
+SESSION_GAP_SEC = float(os.getenv("SESSION_GAP_SEC", 30 * 60))
+
+# analyze_logs.py が出力する列名
+REPORT_COLUMNS = {
+    "session_id": "Session ID",
+    "user_id": "User ID",
+    "rec_enabled": "Rec Enabled",
+    "start_time": "Start Time",
+    "end_time": "End Time",
+    "duration_sec": "Duration (sec)",
+    "views_created": "Total Views Created",
+    "rec_views_created": "Rec Views Created",
+    "custom_views_created": "Custom Views Created",
+    "views_deleted": "Views Deleted",
+    "avg_time_rec_sec": "Avg Time Rec (sec)",
+    "avg_time_custom_sec": "Avg Time Custom (sec)",
+}
+
+
+# 値の種類が少ない文字列の列。category 型にする (event_store の辞書エンコードした列と同じ)
+CATEGORY_COLUMNS = ("user_id", "dashboard_id", "action", "recommendation_source", "card_type", "table_name")
+
+
+def _object_array(values: List[Any]) -> np.ndarray:
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _timestamps(values: List[Any]) -> np.ndarray:
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except ValueError:
+        # タイムゾーン付きなど numpy で読めない形式
+        return pd.to_datetime(pd.Series(_object_array(values)), format="ISO8601").to_numpy()
+
+
+def logs_to_frame(logs: Sequence[Dict[str, Any]], columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """エントリのリストを集計用の DataFrame にする。行の順 (index) はリストの順のまま。"""
+    columns = list(columns) if columns is not None else list(FRAME_COLUMNS)
+    data = {}
+    for column in columns:
+        default = FRAME_COLUMNS.get(column)
+        values = [entry.get(column, default) for entry in logs]
+        if column == "timestamp":
+            data[column] = _timestamps(values)
+        elif column == "task_duration_sec":
+            try:
+                data[column] = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                data[column] = pd.to_numeric(pd.Series(_object_array(values)), errors="coerce").to_numpy()
+        elif column in CATEGORY_COLUMNS:
+            codes, uniques = pd.factorize(_object_array(values))
+            data[column] = pd.Categorical.from_codes(codes, pd.Index(uniques, dtype=object))
+        else:
+            data[column] = _object_array(values)
+    return pd.DataFrame(data, columns=columns)
+
+
+def _key_codes(frame: pd.DataFrame, by: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    by の列の組み合わせを、最初に現れた順の整数にする (値は文字列として比べる)。
+    各行の番号と、番号ごとの名前 (値を "_" でつないだもの) を返す。
+    """
+    codes = np.zeros(len(frame), dtype=np.int64)
+    names = _object_array([""])
+    for i, column in enumerate(by):
+        default = FRAME_COLUMNS.get(column) or "None"
+        column_codes, uniques = pd.factorize(frame[column], use_na_sentinel=False)
+        labels = [default if pd.isna(v) else str(v) for v in np.asarray(uniques, dtype=object)]
+        label_codes, label_names = pd.factorize(_object_array(labels))
+        column_codes = label_codes[column_codes]
+        previous = codes
+        codes, first = _first_order(previous * len(label_names) + column_codes)
+        column_names = np.asarray(label_names, dtype=object)[column_codes[first]]
+        names = column_names if i == 0 else names[previous[first]] + "_" + column_names
+    return codes, names
+
+
+def _first_order(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """値を最初に現れた順の番号にし、番号ごとの最初の行の位置とともに返す。"""
+    codes = pd.factorize(values)[0]
+    return codes, _first_rows(codes)
+
+
+def _first_rows(codes: np.ndarray) -> np.ndarray:
+    """最初に現れた順の番号 (0, 1, 2, ...) について、番号ごとの最初の行の位置。"""
+    if not len(codes):
+        return np.zeros(0, dtype=np.int64)
+    seen = np.maximum.accumulate(codes)
+    return np.flatnonzero(np.r_[True, codes[1:] > seen[:-1]])
+
+
+def sessionize(frame: pd.DataFrame, by: Sequence[str] = ("user_id",), split: str = "login",
+               gap_sec: float = SESSION_GAP_SEC) -> pd.DataFrame:
+    """
+    frame を時刻の順 (同時刻は元の順) に並べ、次の列を加えて返す。
+        session      セッションの番号 (0 から、最初の操作の時刻の順)
+        session_seq  セッション名の末尾の番号 ("login" では全体の login の回数、それ以外はグループ内の通し番号)
+        session_id   セッション名 ("<by の値>_<session_seq>"。"none" では "<by の値>")
+    元の index は残すため、frame の元になったエントリのリストと対応が取れる。
+    """
+    if split not in SPLITS:
+        raise ValueError(f"split must be one of {SPLITS}: {split}")
+    frame = frame.sort_values("timestamp", kind="stable")
+    n = len(frame)
+    group, group_names = _key_codes(frame, by)
+    is_login = (frame["action"] == "login").to_numpy(dtype=bool)
+
+    if split == "login":
+        seq = np.cumsum(is_login)
+        session, first = _first_order(group * (int(seq[-1]) + 1 if n else 1) + seq)
+    elif split == "none":
+        seq = np.zeros(n, dtype=np.int64)
+        session, first = _first_order(group)
+    else:
+        # グループごとに時刻の順に並べ、グループの変わり目・間隔・login で区切る
+        order = np.lexsort((np.arange(n), group))
+        g = group[order]
+        ts = frame["timestamp"].to_numpy()[order]
+        group_start = np.ones(n, dtype=bool)
+        group_start[1:] = g[1:] != g[:-1]
+        new = group_start.copy()
+        new[1:] |= (ts[1:] - ts[:-1]) > np.timedelta64(int(gap_sec * 1e6), "us")
+        if split == "login+gap":
+            new |= is_login[order]
+        number = np.cumsum(new)
+        group_first = np.maximum.accumulate(np.where(group_start, number, 0))
+        seq = np.empty(n, dtype=np.int64)
+        session = np.empty(n, dtype=np.int64)
+        seq[order] = number - group_first + 1
+        session[order] = number
+        session, first = _first_order(session)
+
+    # セッション名はセッションごとに作り、行へは番号で配る
+    names = group_names[group[first]]
+    if split != "none":
+        names = names + "_" + seq[first].astype(str).astype(object)
+    return frame.assign(session=session, session_seq=seq,
+                        session_id=pd.Series(names[session], index=frame.index, dtype=object))
+
+
+def _session_codes(sessions: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    sessionize() の結果 (行を絞り込んだものでもよい) のセッションを 0 からの連続した番号にし直し、
+    各行の番号と番号ごとの最初の行の位置を返す。集計結果の行はこの番号の順になる。
+    """
+    return _first_order(sessions["session"].to_numpy())
+
+
+def _per_session(codes: np.ndarray, size: int, mask: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    w = mask.astype(np.float64) if weights is None else np.where(mask, weights, 0.0)
+    return np.bincount(codes, weights=w, minlength=size)
+
+
+def _action_masks(sessions: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ビューの作成・推薦からの作成・削除の行。"""
+    action = sessions["action"]
+    create = (action == "create_view").to_numpy(dtype=bool)
+    rec = create & (sessions["recommendation_source"] == "recommendation").to_numpy(dtype=bool)
+    return create, rec, (action == "delete_view").to_numpy(dtype=bool)
+
+
+def session_metrics(sessions: pd.DataFrame, rec_enabled_default: Any = True) -> pd.DataFrame:
+    """
+    sessionize() の結果からセッションごとの指標を求める (1行1セッション、最初の操作の時刻の順)。
+    create_view は recommendation_source が "recommendation" なら推薦、それ以外は独自のビューとして数え、
+    作成時間の平均は task_duration_sec が 0・欠損でないものだけで取る。
+    rec_enabled はセッション内の最後の値 (値がなければ rec_enabled_default)。
+    """
+    columns = ["session_id", "user_id", "dashboard_id", "rec_enabled", "start_time", "end_time", "duration_sec", "events",
+               "views_created", "rec_views_created", "custom_views_created", "views_deleted",
+               "avg_time_rec_sec", "avg_time_custom_sec", "rec_rate"]
+    if sessions.empty:
+        return pd.DataFrame(columns=columns)
+    codes, first = _session_codes(sessions)
+    size = len(first)
+    create, rec, deleted = _action_masks(sessions)
+    custom = create & ~rec
+    duration = sessions["task_duration_sec"].to_numpy(dtype=np.float64, na_value=np.nan)
+    timed = ~np.isnan(duration) & (duration != 0)
+
+    times = sessions["timestamp"].groupby(codes, sort=True).agg(["min", "max"])
+    views = _per_session(codes, size, create)
+    rec_views = _per_session(codes, size, rec)
+    rec_timed = _per_session(codes, size, rec & timed)
+    custom_timed = _per_session(codes, size, custom & timed)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_rec = np.where(rec_timed > 0, _per_session(codes, size, rec & timed, duration) / rec_timed, 0.0)
+        avg_custom = np.where(custom_timed > 0, _per_session(codes, size, custom & timed, duration) / custom_timed, 0.0)
+        rec_rate = np.where(views > 0, rec_views / views * 100, 0.0)
+    enabled = sessions["recommendation_enabled"].groupby(codes, sort=True).last().reindex(range(size))
+    enabled = enabled.astype(object).where(enabled.notna(), rec_enabled_default)
+
+    def first_value(column):
+        return sessions[column].to_numpy(dtype=object)[first] if column in sessions else np.full(size, None, dtype=object)
+
+    return pd.DataFrame({
+        "session_id": first_value("session_id"),
+        "user_id": first_value("user_id"),
+        "dashboard_id": first_value("dashboard_id"),
+        "rec_enabled": enabled.to_numpy(),
+        "start_time": times["min"].to_numpy(),
+        "end_time": times["max"].to_numpy(),
+        "duration_sec": (times["max"] - times["min"]).dt.total_seconds().to_numpy(),
+        "events": np.bincount(codes, minlength=size),
+        "views_created": views.astype(np.int64),
+        "rec_views_created": rec_views.astype(np.int64),
+        "custom_views_created": _per_session(codes, size, custom).astype(np.int64),
+        "views_deleted": _per_session(codes, size, deleted).astype(np.int64),
+        "avg_time_rec_sec": avg_rec,
+        "avg_time_custom_sec": avg_custom,
+        "rec_rate": rec_rate,
+    }, columns=columns)
+
+
+def report_frame(metrics: pd.DataFrame) -> pd.DataFrame:
+    """session_metrics() の結果を analyze_logs.py の CSV の列名・列の順にする。"""
+    return metrics[list(REPORT_COLUMNS)].rename(columns=REPORT_COLUMNS)
+
+
+def value_counts(sessions: pd.DataFrame, column: str, action: Optional[str] = "create_view") -> List[Dict[Any, int]]:
+    """
+    セッションごとの column の値の件数 (action の操作だけ。値は最初に現れた順) を、session_metrics() の行の順で返す。
+    例: value_counts(sessions, "card_type") でセッションごとに作成したグラフの種類の件数。
+    """
+    codes, first = _session_codes(sessions)
+    mask = np.ones(len(sessions), dtype=bool) if action is None else (sessions["action"] == action).to_numpy(dtype=bool)
+    pairs = pd.DataFrame({"session": codes[mask], "value": sessions[column].to_numpy(dtype=object)[mask]})
+    counts = pairs.groupby(["session", "value"], sort=False, dropna=False).size()
+    result: List[Dict[Any, int]] = [{} for _ in range(len(first))]
+    for (session, value), count in counts.items():
+        result[session][value] = int(count)
+    return result
+
+
+def distinct_values(sessions: pd.DataFrame, column: str) -> List[List[Any]]:
+    """セッションごとの column の値 (欠損を除き、最初に現れた順) を、session_metrics() の行の順で返す。"""
+    codes, first = _session_codes(sessions)
+    mask = sessions[column].notna().to_numpy()
+    pairs = pd.DataFrame({"session": codes[mask], "value": sessions[column].to_numpy(dtype=object)[mask]}).drop_duplicates()
+    result: List[List[Any]] = [[] for _ in range(len(first))]
+    for session, value in zip(pairs["session"].to_numpy(), pairs["value"].to_numpy(dtype=object)):
+        result[session].append(value)
+    return result
+
+
+def window_metrics(sessions: pd.DataFrame, window_sec: float = 300) -> pd.DataFrame:
+    """
+    各セッションを開始からの経過時間で window_sec ごとの区間に分け、区間ごとの操作数・ビューの作成・削除数と、
+    その区間までの作成数の累計を返す (操作のない区間の行はない)。
+    """
+    columns = ["session_id", "window", "window_start", "events", "views_created", "rec_views_created", "views_deleted",
+               "cumulative_views_created"]
+    if sessions.empty:
+        return pd.DataFrame(columns=columns)
+    codes, first = _session_codes(sessions)
+    ts = sessions["timestamp"].to_numpy()
+    start = sessions["timestamp"].groupby(codes, sort=True).min().to_numpy()
+    step = np.timedelta64(int(window_sec * 1e6), "us")
+    create, rec, deleted = _action_masks(sessions)
+    parts = pd.DataFrame({
+        "session": codes,
+        "window": (ts - start[codes]) // step,
+        "events": 1,
+        "views_created": create.astype(np.int64),
+        "rec_views_created": rec.astype(np.int64),
+        "views_deleted": deleted.astype(np.int64),
+    })
+    result = parts.groupby(["session", "window"], sort=True).sum().reset_index()
+    result["cumulative_views_created"] = result.groupby("session")["views_created"].cumsum()
+    session = result["session"].to_numpy()
+    result["window_start"] = start[session] + result["window"].to_numpy() * step
+    result["session_id"] = sessions["session_id"].to_numpy(dtype=object)[first][session]
+    return result[columns]
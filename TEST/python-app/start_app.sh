@@ -1,12 +1,16 @@
 #!/bin/sh
 
-# Archive existing logs
-if [ -f "logs/app_log.jsonl" ]; then
+# Rotate the operation log of the previous run into a compressed segment (logs/segments/).
+# Always run it: it also recovers segments whose compression was interrupted, even when there is no live log.
+echo "Rotating old operation log into logs/segments..."
+python log_segments.py rotate
+
+# Archive other analysis outputs
+if [ -f "logs/analysis_summary.csv" ] || [ -f "logs/user_history.txt" ]; then
     TIMESTAMP=$(date +%Y%m%d_%H%M%S)
     ARCHIVE_DIR="logs/archive_${TIMESTAMP}"
-    echo "Archiving old logs to ${ARCHIVE_DIR}..."
+    echo "Archiving old analysis outputs to ${ARCHIVE_DIR}..."
     mkdir -p "${ARCHIVE_DIR}"
-    mv logs/app_log.jsonl "${ARCHIVE_DIR}/" 2>/dev/null
     mv logs/analysis_summary.csv "${ARCHIVE_DIR}/" 2>/dev/null
     mv logs/user_history.txt "${ARCHIVE_DIR}/" 2>/dev/null
 fi
@@ -15,6 +19,9 @@ fi
 echo "Waiting for Metabase..."
 while ! nc -z metabase 3000; do sleep 1; done;
 
+# Keep the Parquet event store (logs/events/) up to date for the analysis scripts
+python event_store.py ingest --watch 300 &
+
 # Start App
 echo "Starting Streamlit App..."
 streamlit run app.py --server.port 8080
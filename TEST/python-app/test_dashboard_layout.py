@@ -0,0 +1,37 @@
+from dashboard_layout import DashboardOccupancy, PlacementEngine, find_empty_space
+
+
+def _card(card_id, row, col, size_x, size_y):
+    return {"id": card_id, "row": row, "col": col, "size_x": size_x, "size_y": size_y}
+
+
+def test_placement_engine_finds_first_free_slot():
+    engine = PlacementEngine([_card(1, 0, 0, 12, 4), _card(2, 4, 0, 24, 4)])
+    assert engine.find(12, 4) == (0, 12)
+    assert engine.find(24, 1) == (8, 0)
+
+
+def test_placement_engine_place_many_does_not_overlap():
+    engine = PlacementEngine([])
+    assert engine.place_many([(12, 4), (12, 4), (8, 2)]) == [(0, 0), (0, 12), (4, 0)]
+    assert engine.bottom == 6
+
+
+def test_find_empty_space_matches_engine():
+    dashcards = [_card(1, 0, 0, 6, 4), _card(2, 0, 12, 6, 4)]
+    assert find_empty_space(dashcards, 6, 4) == (0, 6)
+    assert find_empty_space([], 6, 4) == (0, 0)
+
+
+def test_compact_moves_cards_up_and_keeps_columns():
+    occupancy = DashboardOccupancy([_card(1, 0, 0, 12, 4), _card(2, 10, 0, 12, 4), _card(3, 6, 12, 12, 2)])
+    assert occupancy.compact() == {2: 4, 3: 0}
+    assert occupancy.cards[2] == (4, 0, 4, 12)
+    assert occupancy.bottom == 8
+    assert occupancy.find(12, 2) == (2, 12)
+
+
+def test_sync_removes_deleted_cards():
+    occupancy = DashboardOccupancy([_card(1, 0, 0, 24, 4), _card(2, 4, 0, 24, 4)])
+    assert occupancy.sync([_card(2, 4, 0, 24, 4)]) == 1
+    assert occupancy.find(24, 4) == (0, 0)
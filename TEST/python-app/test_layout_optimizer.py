@@ -0,0 +1,38 @@
+from layout_optimizer import bottom_left_pack, layout_cost, optimize_layout
+
+
+def _cells(cards, placements):
+    cells = set()
+    for card, (row, col) in zip(cards, placements):
+        for r in range(row, row + card["height"]):
+            for c in range(col, col + card["width"]):
+                assert (r, c) not in cells, "cards overlap"
+                cells.add((r, c))
+    return cells
+
+
+def test_bottom_left_pack_fills_gaps():
+    cards = [{"width": 16, "height": 10}, {"width": 12, "height": 10}, {"width": 8, "height": 5}, {"width": 8, "height": 5}]
+    placements = bottom_left_pack(cards, columns=24)
+    assert placements == [(0, 0), (10, 0), (0, 16), (5, 16)]
+    _cells(cards, placements)
+
+
+def test_layout_cost_counts_separated_groups():
+    cards = [{"width": 8, "height": 5, "group": "a"}, {"width": 8, "height": 5, "group": "b"},
+             {"width": 8, "height": 5, "group": "a"}]
+    assert layout_cost(cards, [(0, 0), (0, 8), (0, 16)], columns=24)[1:] == (5, 1)
+    assert layout_cost(cards, [(0, 0), (0, 16), (0, 8)], columns=24)[1:] == (5, 0)
+
+
+def test_optimize_layout_groups_cards_without_overlap_and_is_deterministic():
+    sizes = [(8, 5), (12, 10), (16, 10)]
+    cards = [{"key": i, "width": sizes[i % 3][0], "height": sizes[i % 3][1], "group": i % 4} for i in range(20)]
+    result = optimize_layout(cards)
+    assert result["placements"] == optimize_layout(cards)["placements"]
+    assert set(result["placements"]) == {card["key"] for card in cards}
+    placements = [result["placements"][card["key"]] for card in cards]
+    assert all(col + card["width"] <= 24 for card, (_, col) in zip(cards, placements))
+    _cells(cards, placements)
+    assert result["height"] == max(row + card["height"] for card, (row, _) in zip(cards, placements))
+    assert result["separated"] == layout_cost(cards, placements)[2]